@@ -0,0 +1,57 @@
+"""
+Regression tests run the crawler against the fake Telegram client of tgc.bench
+"""
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from tgc import codec
+from tgc.bench.crawl import bench_config
+from tgc.bench.fake_client import ChannelSpec, FakeTelegramClient
+
+
+@pytest.fixture(autouse=True)
+def bench_env(monkeypatch, tmp_path):
+    from tgc.pyro import download_media
+    monkeypatch.setattr(download_media, 'DOWNLOAD_DELAY', (0, 0))
+    monkeypatch.setenv('tgc_config', bench_config())
+    monkeypatch.setenv('tgc_cache_dir', str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def channel():
+    """
+    Create a fake client for a synthetic channel (see ChannelSpec)
+    """
+    return lambda **spec: FakeTelegramClient(ChannelSpec(**spec))
+
+
+@pytest.fixture
+def export(tmp_path):
+    """
+    Create the config of an export in tmp_path/export, stored locally
+    """
+    def make(client: FakeTelegramClient, **kwargs) -> dict:
+        return {'chat_id': client.spec.chat_id, 'path': str(tmp_path / "export"), 'storage': {'type': 'local'},
+                **kwargs}
+    return make
+
+
+def load_posts(path: Path) -> list[dict]:
+    fp = path / "posts.json"
+    return codec.read(fp) if fp.exists() else []
+
+
+@pytest.fixture
+def crawl():
+    """
+    Run process_chat once, and return the saved posts
+    """
+    from tgc.pyro.crawl import process_chat
+
+    def run(client: FakeTelegramClient, export: dict) -> list[dict]:
+        path = Path(export['path'])
+        asyncio.run(process_chat(export['chat_id'], path, export, client))
+        return load_posts(path)
+    return run
@@ -0,0 +1,45 @@
+from collections import defaultdict
+
+
+def caption(client, keep) -> dict[int, list[int]]:
+    """
+    Caption the first message of every album, with #keep if keep(album index)
+
+    :return: Message ids of the kept albums, by grouped_id
+    """
+    albums = defaultdict(list)
+    for i, m in sorted(client.messages.items()):
+        m.entities = None
+        m.message = f"post {i}"
+        if m.grouped_id:
+            albums[m.grouped_id].append(i)
+    for k, ids in enumerate(albums.values()):
+        client.messages[ids[0]].message = f"album {k} #keep" if keep(k) else f"album {k}"
+        for i in ids[1:]:
+            client.messages[i].message = ""
+    return {gid: ids for k, (gid, ids) in enumerate(albums.items()) if keep(k)}
+
+
+def test_albums_across_batches(channel, export, crawl):
+    client = channel(posts=80, photo_ratio=0.7, video_ratio=0, document_ratio=0, group_ratio=0.6, seed=3)
+    kept = caption(client, lambda k: k % 2 == 0)
+    assert len(kept) > 5
+    # Batches of 7 messages split many albums
+    exp = export(client, max_posts_per_run=7, filter={'include_hashtags': ['#keep']})
+    for _ in range(40):
+        posts = crawl(client, exp)
+
+    assert {p['media_group_id']: p['msg_ids'] for p in posts} == kept
+
+
+def test_filtered_history_is_scanned_once(channel, export, crawl):
+    client = channel(posts=3000, photo_ratio=0, video_ratio=0, document_ratio=0, group_ratio=0)
+    for i, m in client.messages.items():
+        m.message = f"post {i} #keep" if i % 500 == 0 else f"post {i}"
+        m.entities = None
+    exp = export(client, max_posts_per_run=20, filter={'include_hashtags': ['#keep']})
+    assert [p['id'] for p in crawl(client, exp)] == [500, 1000, 1500, 2000, 2500, 3000]
+
+    calls = client.calls['get_messages']
+    assert len(crawl(client, exp)) == 6
+    assert client.calls['get_messages'] - calls == 1
@@ -0,0 +1,39 @@
+import asyncio
+from pathlib import Path
+
+from tgc import codec
+from tgc.pyro import media_queue
+from tgc.pyro.media_policy import Decision, MediaPolicy
+
+
+def test_deferred_mixed_album(monkeypatch, channel, export, crawl):
+    client = channel(posts=3, photo_ratio=0, video_ratio=1, document_ratio=0, group_ratio=1, video_size=100_000)
+    album = sorted(i for i, m in client.messages.items() if m.grouped_id == client.messages[1].grouped_id)
+    assert len(album) >= 3
+    thumb, download, skip = album[:3]
+
+    evaluate = MediaPolicy.evaluate
+
+    def policy(self, m):
+        if m.id == thumb:
+            return Decision('thumb', "too big")
+        if m.id == skip:
+            return Decision('skip', "denied")
+        return evaluate(self, m)
+
+    monkeypatch.setattr(MediaPolicy, 'evaluate', policy)
+    exp = export(client, max_posts_per_run=30, defer_media=True)
+    path = Path(exp['path'])
+
+    post = crawl(client, exp)[0]
+    # Every media of the post but the skipped one is queued, the worker replaces all of them
+    assert media_queue.load_jobs(path)[0]['msg_ids'] == [i for i in album if i != skip]
+    assert all(f.get('pending') for f in post['files'])
+
+    asyncio.run(media_queue.drain(client, exp))
+    assert not media_queue.load_jobs(path)
+    post = codec.read(path / "posts.json")[0]
+    assert not any(f.get('pending') for f in post['files'])
+    omitted = [f for f in post['files'] if f.get('omitted')]
+    assert len(omitted) == 1 and omitted[0]['thumb']
+    assert [f['url'] for f in post['files'] if not f.get('omitted')] == [f"{album[0]}/{download}.mp4"]
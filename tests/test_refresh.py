@@ -0,0 +1,67 @@
+from pathlib import Path
+
+from tgc import codec
+from tgc.pyro.refresh import ALBUM_SIZE
+
+
+def spy_ids(client) -> list[int]:
+    """
+    Record the message ids fetched by id
+    """
+    fetched = []
+    get_messages = client.get_messages
+
+    async def spy(entity, *args, ids=None, **kwargs):
+        if ids is not None:
+            fetched.extend([ids] if isinstance(ids, int) else ids)
+        return await get_messages(entity, *args, ids=ids, **kwargs)
+
+    client.get_messages = spy
+    return fetched
+
+
+def test_probe_only_albums(channel, export, crawl):
+    client = channel(posts=40, photo_ratio=0.6, video_ratio=0, document_ratio=0, group_ratio=0.5)
+    exp = export(client, max_posts_per_run=500, refresh_posts=100)
+    posts = crawl(client, exp)
+    albums = {p['id']: p['msg_ids'] for p in posts if p.get('msg_ids')}
+    assert albums and len(albums) < len(posts)
+
+    # Saved by a version without msg_ids
+    for p in posts:
+        p.pop('msg_ids', None)
+    codec.write_json(Path(exp['path']) / "posts.json", posts)
+
+    fetched = spy_ids(client)
+    posts = crawl(client, exp)
+    assert {p['id']: p['msg_ids'] for p in posts if p.get('msg_ids')} == albums
+    # Posts of a single message are fetched by their own id, only albums are probed past it
+    assert set(fetched) == {p['id'] for p in posts} | {i for a in albums for i in range(a, a + ALBUM_SIZE)}
+
+
+def test_album_changes(channel, export, crawl):
+    client = channel(posts=40, photo_ratio=0.6, video_ratio=0, document_ratio=0, group_ratio=0.9)
+    exp = export(client, max_posts_per_run=500, refresh_posts=100)
+    posts = crawl(client, exp)
+    albums = [p for p in posts if p.get('msg_ids') and len(p['msg_ids']) > 2]
+    deleted, moved, cleared = albums[:3]
+    assert cleared.get('text')
+
+    del client.messages[deleted['msg_ids'][0]]
+    for i, mid in enumerate(moved['msg_ids']):
+        client.messages[mid].message = "moved caption" if i == 1 else ""
+        client.messages[mid].entities = None
+    for mid in cleared['msg_ids']:
+        client.messages[mid].message = ""
+        client.messages[mid].entities = None
+
+    posts = {p['id']: p for p in crawl(client, exp)}
+    # An album is kept until all of its messages are deleted
+    assert posts[deleted['id']]['msg_ids'] == deleted['msg_ids'][1:]
+    assert posts[moved['id']]['text'] == "moved caption"
+    assert not posts[cleared['id']].get('text')
+
+    for mid in deleted['msg_ids'][1:]:
+        del client.messages[mid]
+    posts = {p['id']: p for p in crawl(client, exp)}
+    assert deleted['id'] not in posts
@@ -0,0 +1,58 @@
+from pathlib import Path
+
+from tgc.pyro import storage, upload_journal
+from tgc.pyro.upload_journal import JOURNAL, UploadJournal
+
+
+class BrokenStorage(storage.Storage):
+    async def put(self, fp: Path, key: str):
+        return None
+
+    async def exists(self, key: str) -> bool:
+        return False
+
+    def url_for(self, key: str) -> None:
+        return None
+
+
+def test_abort_and_compaction(tmp_path):
+    journal = UploadJournal(tmp_path)
+    failed = tmp_path / "1" / "a.jpg"
+    interrupted = tmp_path / "2" / "b.jpg"
+    for fp in (failed, interrupted):
+        fp.parent.mkdir()
+        fp.write_bytes(b'x')
+
+    journal.begin(1, 1)
+    journal.abort(1, 1, [failed])
+    assert not failed.exists()
+    journal.begin(2, 2)
+    journal._append(journal.key(interrupted), 'uploaded', {'url': '2/b.jpg'})
+    journal.begin(3, 3)
+    journal.finish(3, 3, [{'url': '3/c.jpg'}], [])
+
+    journal.commit()
+    # Failed and committed messages are dropped, interrupted ones are kept with their files
+    assert set(UploadJournal(tmp_path).records) == {'msg:2/2', 'file:2/b.jpg'}
+    assert journal.result('file:2/b.jpg') == {'url': '2/b.jpg'}
+
+    journal.finish(2, 2, [{'url': '2/b.jpg'}], [interrupted])
+    journal.commit()
+    assert not (tmp_path / JOURNAL).exists()
+
+
+def test_failed_uploads_dont_accumulate(channel, export, crawl):
+    client = channel(posts=20, photo_ratio=0.5, video_ratio=0, document_ratio=0)
+    exp = export(client, max_posts_per_run=100)
+    path = Path(exp['path'])
+    storage._storages[path.absolute()] = BrokenStorage()
+    try:
+        crawl(client, exp)
+    finally:
+        del storage._storages[path.absolute()]
+
+    assert client.bytes_downloaded
+    assert not (path / JOURNAL).exists()
+    assert not upload_journal.get(path).records
+    # Downloaded files of the failed uploads are deleted
+    assert not [f for f in path.glob('[0-9]*/*') if f.is_file()]
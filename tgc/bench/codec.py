@@ -0,0 +1,47 @@
+"""
+Benchmark load/dump times of the JSON codec backends on a large synthetic posts.json
+
+Usage: python -m tgc.bench.codec [--posts 100000] [--repeat 3]
+"""
+import argparse
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from .synth import make_posts
+from .. import codec
+
+
+def best_of(repeat: int, fn) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser("tgc JSON codec benchmark")
+    parser.add_argument("--posts", type=int, default=100_000, help="Number of synthetic posts")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions (the best time is reported)")
+    args = parser.parse_args()
+
+    posts = make_posts(args.posts)
+    print(f"Generated {len(posts)} posts, selected backend: {codec.BACKEND}")
+    print(f"{'backend':<10}{'size':>10}{'dump':>10}{'dump -i2':>10}{'load':>10}{'posts':>10}")
+
+    with TemporaryDirectory() as tmp:
+        fp = Path(tmp) / "posts.json"
+        for name, (loads, dumps) in codec.BACKENDS.items():
+            data = dumps(posts, True)
+            fp.write_bytes(data)
+            t_dump = best_of(args.repeat, lambda: dumps(posts, False))
+            t_dump_i = best_of(args.repeat, lambda: dumps(posts, True))
+            t_load = best_of(args.repeat, lambda: loads(fp.read_bytes()))
+            t_posts = best_of(args.repeat, lambda: codec.decode_posts(loads(fp.read_bytes())))
+            print(f"{name:<10}{len(data) / 1e6:>8.1f}MB{t_dump:>9.3f}s{t_dump_i:>9.3f}s{t_load:>9.3f}s{t_posts:>9.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+End-to-end crawl benchmark against the fake Telegram client
+
+Runs process_chat repeatedly over a synthetic channel until every post is crawled, and reports
+posts/s, bytes/s and the wall time spent in each stage.
+
+Usage: python -m tgc.bench.crawl [--posts 500] [--latency 0.02] [--flood-every 50] ...
+"""
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from .fake_client import ChannelSpec, FakeTelegramClient
+from .. import codec
+
+
+def bench_config(**kwargs) -> str:
+    """
+    Config for load_config() (which process_chat calls while uploading), as a toml string
+    """
+    cfg = {'api_id': 1, 'api_hash': 'bench', 'string_session': '', **kwargs}
+    return "\n".join(f'{k} = {codec.stringify(v)}' for k, v in cfg.items())
+
+
+async def run_crawl(client: FakeTelegramClient, path: Path, export: dict, max_runs: int = 10_000) -> int:
+    """
+    Call process_chat until no new posts are added
+
+    :return: Number of runs
+    """
+    from ..pyro.crawl import process_chat
+
+    posts_path = path / "posts.json"
+    runs = 0
+    while runs < max_runs:
+        before = posts_path.stat().st_mtime_ns if posts_path.exists() else None
+        await process_chat(export['chat_id'], path, export, client)
+        runs += 1
+        if posts_path.exists() and posts_path.stat().st_mtime_ns == before:
+            break
+        if not posts_path.exists():
+            break
+    return runs
+
+
+def report(client: FakeTelegramClient, wall: float, posts: int, runs: int):
+    print()
+    print(f"{'stage':<28}{'calls':>8}{'time':>10}{'share':>8}")
+    accounted = 0
+    for name, t in sorted(client.timings.items(), key=lambda x: -x[1]):
+        accounted += t
+        print(f"{name:<28}{client.calls[name]:>8}{t:>9.3f}s{t / wall:>8.1%}")
+    rest = wall - accounted
+    print(f"{'processing (everything else)':<28}{'':>8}{rest:>9.3f}s{rest / wall:>8.1%}")
+    print()
+    print(f"Wall time:   {wall:.3f}s over {runs} runs")
+    print(f"Posts:       {posts} ({posts / wall:.1f} posts/s)")
+    print(f"Downloaded:  {client.bytes_downloaded / 1e6:.1f} MB ({client.bytes_downloaded / 1e6 / wall:.2f} MB/s)")
+    print(f"FloodWaits:  {client.flood_waits} ({client.flood_wait_seconds}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser("tgc end-to-end crawl benchmark")
+    parser.add_argument("--posts", type=int, default=500, help="Posts in the synthetic channel")
+    parser.add_argument("--photos", type=float, default=0.3, help="Ratio of photo messages")
+    parser.add_argument("--videos", type=float, default=0.05, help="Ratio of video messages")
+    parser.add_argument("--documents", type=float, default=0.05, help="Ratio of document messages")
+    parser.add_argument("--groups", type=float, default=0.1, help="Ratio of media messages starting an album")
+    parser.add_argument("--emojis", type=float, default=0.0, help="Ratio of text messages with custom emojis")
+    parser.add_argument("--video-mb", type=float, default=2, help="Size of each video")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds of latency per API call")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Download bandwidth in MB/s (0 = unlimited)")
+    parser.add_argument("--flood-every", type=int, default=0, help="Inject a FloodWait every n API calls")
+    parser.add_argument("--flood-seconds", type=int, default=1, help="Seconds of each FloodWait")
+    parser.add_argument("--per-run", type=int, default=100, help="max_posts_per_run of the export")
+    parser.add_argument("--upload-url", help="Upload endpoint (e.g. the local stand-in server), media are "
+                                             "stored locally if not set")
+    parser.add_argument("--s3", action="store_true", help="Store media in the S3 stand-in server")
+    parser.add_argument("--keep", help="Keep the export in this directory instead of a temporary one")
+    parser.add_argument("--metrics-dir", help="Write the per-run metrics reports into this directory")
+    args = parser.parse_args()
+
+    spec = ChannelSpec(posts=args.posts, photo_ratio=args.photos, video_ratio=args.videos,
+                       document_ratio=args.documents, group_ratio=args.groups, emoji_ratio=args.emojis,
+                       video_size=int(args.video_mb * 1e6))
+    client = FakeTelegramClient(spec, latency=args.latency, bandwidth=args.bandwidth * 1e6,
+                                flood_every=args.flood_every, flood_seconds=args.flood_seconds)
+
+    upload = {'upload_url': args.upload_url, 'upload_auth_code': 'bench',
+              'image_base_url': args.upload_url.split('/upload')[0]} if args.upload_url else {}
+    os.environ['tgc_config'] = bench_config(**upload)
+
+    # No artificial delay between downloads, the fake client simulates latency instead
+    from ..pyro import download_media
+    download_media.DOWNLOAD_DELAY = (0, 0)
+
+    with TemporaryDirectory() as tmp:
+        path = Path(args.keep or tmp)
+        export = {'chat_id': spec.chat_id, 'path': str(path), 'max_posts_per_run': args.per_run,
+                  'metrics_dir': args.metrics_dir}
+        if args.s3:
+            from .s3_server import S3Server
+            s3 = S3Server(("127.0.0.1", 0))
+            s3.start()
+            export['storage'] = {'type': 's3', 'endpoint': s3.url, 'bucket': 'bench',
+                                 'access_key': 'bench', 'secret_key': 'bench'}
+        print(f"Crawling {args.posts} synthetic posts ({len(client.messages)} messages) into {path}")
+        start = time.perf_counter()
+        runs = asyncio.run(run_crawl(client, path, export))
+        wall = time.perf_counter() - start
+        posts = len(codec.load_posts(path / "posts.json")) if (path / "posts.json").exists() else 0
+
+    report(client, wall, posts, runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+In-process stand-in for the Telethon client over a deterministic synthetic channel
+
+It implements the part of the Telethon surface the crawler uses (get_me, get_entity, get_messages,
+download_media, GetCustomEmojiDocumentsRequest), so process_chat and the media helpers can run
+end-to-end without a Telegram account. Latency, bandwidth and FloodWaits can be injected, and the
+time spent in each method is recorded for benchmarks.
+"""
+import asyncio
+import io
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Message, PeerChannel, Channel, User, ChatPhotoEmpty, MessageMediaPhoto, Photo, \
+    PhotoSize, MessageMediaDocument, Document, DocumentAttributeVideo, DocumentAttributeFilename, \
+    MessageEntityBold, MessageEntityTextUrl, MessageEntityCustomEmoji, DocumentAttributeCustomEmoji, \
+    InputStickerSetEmpty, InputPeerUser
+
+from .synth import WORDS, EPOCH
+
+
+@dataclass
+class ChannelSpec:
+    """
+    Shape of the synthetic channel. Ratios are per message.
+    """
+    posts: int = 1000
+    photo_ratio: float = 0.3
+    video_ratio: float = 0.05
+    document_ratio: float = 0.05
+    group_ratio: float = 0.1        # Ratio of media messages that start an album of 2-4 messages
+    emoji_ratio: float = 0.0        # Ratio of text messages with a custom emoji
+    emoji_variety: int = 50         # Number of distinct custom emojis
+    photo_px: int = 640             # Longest side of generated photos
+    video_size: int = 2_000_000
+    document_size: int = 200_000
+    seed: int = 0
+
+    chat_id: int = 1000000001
+    username: str = "bench_channel"
+    title: str = "Benchmark Channel"
+
+
+class FakeTelegramClient:
+    """
+    Deterministic stand-in for telethon.TelegramClient
+
+    :param spec: Synthetic channel spec
+    :param latency: Seconds added to every API call
+    :param bandwidth: Download bandwidth in bytes/s (0 = unlimited)
+    :param flood_every: Inject a FloodWait on every n-th API call (0 = never)
+    :param flood_seconds: Seconds of each injected FloodWait
+    """
+
+    def __init__(self, spec: ChannelSpec | None = None, latency: float = 0, bandwidth: float = 0,
+                 flood_every: int = 0, flood_seconds: int = 1):
+        self.spec = spec = spec or ChannelSpec()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+
+        # Stats
+        self.timings: dict[str, float] = defaultdict(float)
+        self.calls: Counter = Counter()
+        self.bytes_downloaded = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self._api_calls = 0
+
+        self.channel = Channel(id=spec.chat_id, title=spec.title, photo=ChatPhotoEmpty(), date=EPOCH,
+                               broadcast=True, access_hash=spec.chat_id * 31, username=spec.username)
+        self.me = User(id=42, bot=True, first_name="bench", username="bench_bot", access_hash=1)
+        self._me_fetched = False
+        self.messages: dict[int, Message] = {}
+        self._photo_cache: dict[tuple[int, int], bytes] = {}
+        self._generate()
+
+    # ---------- Synthetic data ----------
+
+    def _generate(self):
+        s = self.spec
+        rnd = random.Random(s.seed)
+        peer = PeerChannel(s.chat_id)
+        msg_id = 1
+        for i in range(s.posts):
+            date = EPOCH + timedelta(minutes=37 * i)
+            r = rnd.random()
+            kind = 'photo' if r < s.photo_ratio else \
+                'video' if r < s.photo_ratio + s.video_ratio else \
+                'document' if r < s.photo_ratio + s.video_ratio + s.document_ratio else None
+            count = rnd.randint(2, 4) if kind and rnd.random() < s.group_ratio else 1
+            gid = 13000000000000000 + msg_id if count > 1 else None
+
+            for k in range(count):
+                text, entities = self._make_text(rnd) if k == 0 and rnd.random() < 0.85 else ("", None)
+                self.messages[msg_id] = Message(
+                    id=msg_id, peer_id=peer, date=date, message=text, entities=entities, post=True,
+                    media=self._make_media(rnd, kind, msg_id, date), grouped_id=gid,
+                    views=rnd.randint(10, 50000), forwards=rnd.randint(0, 500))
+                msg_id += 1
+
+    def _make_text(self, rnd: random.Random) -> tuple[str, list]:
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 60)))
+        entities = [MessageEntityBold(0, min(len(text), 10))]
+        if rnd.random() < 0.2:
+            text += " link"
+            entities.append(MessageEntityTextUrl(len(text) - 4, 4, "https://example.com"))
+        if rnd.random() < self.spec.emoji_ratio:
+            text += " 😺"
+            doc_id = 5000000000000000000 + rnd.randrange(self.spec.emoji_variety)
+            entities.append(MessageEntityCustomEmoji(len(text) - 2, 2, doc_id))
+        return text, entities
+
+    def _make_media(self, rnd: random.Random, kind: str | None, msg_id: int, date: datetime):
+        s = self.spec
+        if kind == 'photo':
+            w, h = s.photo_px, s.photo_px * 3 // 4
+            size = len(self._photo_bytes(w, h))
+            return MessageMediaPhoto(photo=Photo(id=msg_id, access_hash=msg_id, file_reference=b'', date=date,
+                                                 sizes=[PhotoSize('y', w, h, size)], dc_id=2))
+        if kind == 'video':
+            attrs = [DocumentAttributeVideo(duration=rnd.randint(3, 300), w=1280, h=720, supports_streaming=True),
+                     DocumentAttributeFilename(f"video_{msg_id}.mp4")]
+            return MessageMediaDocument(video=True, document=Document(
+                id=msg_id, access_hash=msg_id, file_reference=b'', date=date, mime_type='video/mp4',
+                size=s.video_size, dc_id=2, attributes=attrs,
+                thumbs=[PhotoSize('m', 320, 180, len(self._photo_bytes(320, 180)))]))
+        if kind == 'document':
+            return MessageMediaDocument(document=Document(
+                id=msg_id, access_hash=msg_id, file_reference=b'', date=date, mime_type='application/pdf',
+                size=s.document_size, dc_id=2, attributes=[DocumentAttributeFilename(f"doc_{msg_id}.pdf")]))
+        return None
+
+    def _photo_bytes(self, w: int, h: int) -> bytes:
+        if (w, h) not in self._photo_cache:
+            from PIL import Image
+            img = Image.effect_noise((w, h), 40).convert('RGB')
+            buf = io.BytesIO()
+            img.save(buf, 'JPEG', quality=85)
+            self._photo_cache[(w, h)] = buf.getvalue()
+        return self._photo_cache[(w, h)]
+
+    def _media_bytes(self, media) -> bytes:
+        if isinstance(media, MessageMediaPhoto):
+            size = media.photo.sizes[-1]
+            return self._photo_bytes(size.w, size.h)
+        doc = media.document if isinstance(media, MessageMediaDocument) else media
+        if doc.mime_type.startswith('image/'):
+            return self._photo_bytes(100, 100)
+        return random.Random(doc.id).randbytes(doc.size)
+
+    # ---------- Simulation helpers ----------
+
+    async def _api(self, name: str, auto_sleep: bool = True):
+        """
+        Account one API call: latency, and injected FloodWaits. Like Telethon's flood_sleep_threshold,
+        FloodWaits of regular requests are slept through, while downloads raise FloodWaitError.
+        """
+        self.calls[name] += 1
+        self._api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_every and self._api_calls % self.flood_every == 0:
+            self.flood_waits += 1
+            self.flood_wait_seconds += self.flood_seconds
+            if not auto_sleep:
+                raise FloodWaitError(request=None, capture=self.flood_seconds)
+            await asyncio.sleep(self.flood_seconds)
+
+    def _timed(self, name: str, start: float):
+        self.timings[name] += time.perf_counter() - start
+
+    # ---------- Telethon surface ----------
+
+    async def get_me(self, input_peer: bool = False) -> User | InputPeerUser:
+        if input_peer and self._me_fetched:
+            return InputPeerUser(self.me.id, self.me.access_hash)
+        start = time.perf_counter()
+        await self._api('get_me')
+        self._timed('get_me', start)
+        self._me_fetched = True
+        return InputPeerUser(self.me.id, self.me.access_hash) if input_peer else self.me
+
+    async def get_entity(self, entity):
+        start = time.perf_counter()
+        await self._api('get_entity')
+        self._timed('get_entity', start)
+        s = self.spec
+        if entity in (s.chat_id, int(f"-100{s.chat_id}"), s.username, f"@{s.username}", self.channel) or \
+                getattr(entity, 'channel_id', None) == s.chat_id:
+            return self.channel
+        raise ValueError(f'Could not find the input entity for {entity!r}')
+
+    async def get_messages(self, entity, limit: int | None = 100, min_id: int = 0, max_id: int = 0,
+                           ids: int | list[int] | None = None, **kwargs):
+        start = time.perf_counter()
+        await self._api('get_messages')
+        try:
+            if ids is not None:
+                if isinstance(ids, int):
+                    return self.messages.get(ids)
+                return [self.messages.get(i) for i in ids]
+
+            # Same semantics as Telethon: newest first, min_id < id < max_id (max_id=0 means no upper bound)
+            out = []
+            top = max_id - 1 if max_id else max(self.messages, default=0)
+            for i in range(top, min_id, -1):
+                if i in self.messages:
+                    out.append(self.messages[i])
+                    if limit is not None and len(out) >= limit:
+                        break
+            return out
+        finally:
+            self._timed('get_messages', start)
+
+    async def download_media(self, message, file=None, thumb=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            await self._api('download_media', auto_sleep=False)
+            media = getattr(message, 'media', message)
+            data = self._photo_bytes(320, 180) if thumb is not None else self._media_bytes(media)
+            if self.bandwidth:
+                await asyncio.sleep(len(data) / self.bandwidth)
+            self.bytes_downloaded += len(data)
+            if file is None:
+                return data
+            Path(file).parent.mkdir(parents=True, exist_ok=True)
+            Path(file).write_bytes(data)
+            return str(file)
+        finally:
+            self._timed('download_media', start)
+
+    async def __call__(self, request):
+        # Raw API requests, only GetCustomEmojiDocumentsRequest is used by the crawler
+        if type(request).__name__ != 'GetCustomEmojiDocumentsRequest':
+            raise NotImplementedError(type(request).__name__)
+        return await self.get_custom_emoji_stickers(request.document_id)
+
+    async def get_custom_emoji_stickers(self, ids: list[int]) -> list[Document]:
+        start = time.perf_counter()
+        await self._api('get_custom_emoji_stickers')
+        self._timed('get_custom_emoji_stickers', start)
+        return [Document(id=i, access_hash=i, file_reference=b'', date=EPOCH, mime_type='image/webp', size=0,
+                         dc_id=2, attributes=[DocumentAttributeCustomEmoji(alt="😺", stickerset=InputStickerSetEmpty())])
+                for i in ids]
+
+    # ---------- Stats ----------
+
+    def reset_stats(self):
+        self.timings.clear()
+        self.calls.clear()
+        self.bytes_downloaded = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
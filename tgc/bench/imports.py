@@ -0,0 +1,77 @@
+"""
+Import-time budget check for the CLI entry points
+
+Each entry module is imported in a fresh interpreter with `-X importtime`. The check fails (exit
+code 1) when the best cumulative import time exceeds its budget, or when a heavy dependency that
+should only be imported on use shows up.
+
+Usage: python -m tgc.bench.imports [--repeat 5] [--scale 1.0]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+# Heavy dependencies that are imported where they are used
+LAZY = {'telethon', 'PIL', 'feedgen', 'markdown', 'dateutil', 'requests'}
+
+# Entry module: (budget in ms, packages that must not be imported)
+BUDGETS: dict[str, tuple[float, set[str]]] = {
+    'tgc.convert_export': (150, LAZY),                            # tgce
+    'tgc.rss.__main__': (150, LAZY),                              # python -m tgc.rss
+    'tgc.rss.posts_to_feed': (150, LAZY),
+    'tgc.pyro.crawl': (600, LAZY - {'telethon', 'PIL'}),          # tgc (Telethon imports PIL itself)
+}
+
+
+def import_time(module: str) -> tuple[float, set[str]]:
+    """
+    :return: Cumulative import time of the module in seconds, and all imported top-level packages
+    """
+    root = str(Path(__file__).parents[2])
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([root, os.environ.get('PYTHONPATH', '')])}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, env=env, check=True)
+    total = 0.0
+    packages = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            total = int(cumulative) / 1e6
+    return total, packages
+
+
+def main():
+    parser = argparse.ArgumentParser("tgc import-time budget check")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions (the best time is used)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the budgets (for slow machines)")
+    args = parser.parse_args()
+
+    failed = []
+    print(f"{'module':<24}{'time':>10}{'budget':>10}  status")
+    for module, (budget, forbidden) in BUDGETS.items():
+        runs = [import_time(module) for _ in range(args.repeat)]
+        best = min(t for t, _ in runs)
+        eager = sorted(forbidden & runs[0][1])
+        budget *= args.scale
+        status = 'ok'
+        if best * 1000 > budget:
+            status = 'OVER BUDGET'
+        if eager:
+            status = f"imports {', '.join(eager)}"
+        if status != 'ok':
+            failed.append(module)
+        print(f"{module:<24}{best * 1000:>8.1f}ms{budget:>8.0f}ms  {status}")
+
+    if failed:
+        print(f"\n{len(failed)} module(s) failed the import budget: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""
+Microbenchmarks for the CPU-bound conversion functions, with stored baselines
+
+Each case runs on generated inputs at several scales. The best time and the peak traced memory
+are compared against tgc/bench/baseline.json, and the run fails (exit code 1) when a case
+regresses past the threshold. Times are normalized by a fixed calibration loop, so a baseline
+recorded on one machine stays roughly comparable on another.
+
+Usage: python -m tgc.bench.micro [--scales 1000,10000] [--cases convert_text,...] [--threshold 0.25]
+       python -m tgc.bench.micro --update-baseline
+"""
+import argparse
+import contextlib
+import io
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable
+
+from .synth import WORDS, EPOCH, make_posts
+from .. import codec
+
+BASELINE = Path(__file__).parent / "baseline.json"
+DEFAULT_SCALES = [1_000, 10_000, 100_000]
+
+# Timings and peak memory below these are dominated by noise and never flagged
+NOISE_FLOOR = 0.002
+MEMORY_NOISE_FLOOR = 1_000_000
+
+
+@dataclass
+class Case:
+    name: str
+    # Takes the scale and returns a factory, which returns a fresh zero-argument callable to time
+    setup: Callable[[int], Callable[[], Callable[[], object]]]
+    max_scale: int = 100_000
+
+
+def _words(rnd: random.Random, n: int) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(n))
+
+
+def _quiet(fn: Callable[[], object]) -> Callable[[], object]:
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return run
+
+
+# ---------- tgc.pyro ----------
+
+def setup_pyro_convert_text(n: int):
+    from telethon.tl.types import MessageEntityBold, MessageEntityItalic, MessageEntityTextUrl, \
+        MessageEntityHashtag, MessageEntityCode
+    from ..pyro.convert import convert_text
+
+    rnd = random.Random(0)
+    msgs = []
+    for _ in range(n):
+        text = _words(rnd, rnd.randint(3, 80))
+        entities = []
+        for _ in range(rnd.randint(0, 6)):
+            start = rnd.randrange(len(text))
+            length = rnd.randint(1, min(20, len(text) - start))
+            kind = rnd.choice([MessageEntityBold, MessageEntityItalic, MessageEntityHashtag, MessageEntityCode])
+            entities.append(kind(start, length))
+        if rnd.random() < 0.2:
+            entities.append(MessageEntityTextUrl(0, min(4, len(text)), "https://example.com"))
+        msgs.append((text, entities))
+
+    def run():
+        for text, entities in msgs:
+            convert_text(text, entities)
+    return lambda: run
+
+
+def setup_group_msgs(n: int):
+    from ..pyro.grouper import group_msgs
+
+    # Crawled messages before grouping: one message per image or file, albums share a media_group_id
+    msgs = []
+    for post in make_posts(n):
+        media = [('image', m) for m in post.get('images', [])] + [('file', m) for m in post.get('files', [])]
+        for k, (key, m) in enumerate(media or [(None, None)]):
+            msg = {'id': post['id'] + k, 'date': post['date'], 'views': post['views']}
+            if 'media_group_id' in post:
+                msg['media_group_id'] = post['media_group_id']
+            if k == 0 and 'text' in post:
+                msg['text'] = post['text']
+            if key:
+                msg[key] = m
+            msgs.append(msg)
+    rnd = random.Random(0)
+    for i in rnd.sample(range(1, len(msgs)), len(msgs) // 10):
+        msgs[i]['reply_id'] = msgs[rnd.randrange(i)]['id']
+
+    # group_msgs modifies the messages, so each run gets a copy
+    def make():
+        data = [dict(m) for m in msgs]
+        return lambda: group_msgs(data)
+    return make
+
+
+def setup_guess_ext(n: int):
+    from ..pyro.download_media import guess_ext
+
+    mimes = ['image/jpeg', 'video/mp4', 'image/webp', 'audio/ogg', 'application/pdf', 'application/x-tgsticker',
+             'video/webm', 'image/png']
+    rnd = random.Random(0)
+    args = []
+    for i in range(n):
+        r = rnd.random()
+        if r < 0.6:
+            args.append((rnd.choice(mimes), None))
+        elif r < 0.9:
+            args.append((rnd.choice(mimes), f"file_{i}.{rnd.choice(['jpg', 'mp4', 'pdf', 'zip'])}"))
+        elif r < 0.98:
+            args.append(('image/heic', None))
+        else:
+            # Unknown types
+            args.append((f'application/x-unknown-{i % 7}', None))
+
+    def run():
+        for mime, name in args:
+            guess_ext(None, mime, name)
+    return lambda: _quiet(run)
+
+
+# ---------- tgc.convert_export ----------
+
+def make_export_msgs(n: int, seed: int = 0) -> list[dict]:
+    """
+    Generate n messages in the Telegram Desktop result.json format (oldest first)
+    """
+    rnd = random.Random(seed)
+    msgs = []
+    ts = int(EPOCH.timestamp())
+    for i in range(1, n + 1):
+        ts += rnd.choice([1, 2, 60, 600, 3600])
+        d = {'id': i, 'type': 'message', 'date': datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+             'date_unixtime': str(ts)}
+        if rnd.random() < 0.7:
+            d['text'] = [_words(rnd, rnd.randint(1, 30)), {'type': rnd.choice(['bold', 'italic', 'code', 'spoiler']),
+                                                          'text': _words(rnd, 3)},
+                         {'type': 'text_link', 'text': 'link', 'href': 'https://example.com'},
+                         _words(rnd, rnd.randint(1, 30))]
+        elif rnd.random() < 0.5:
+            d['text'] = _words(rnd, rnd.randint(1, 30))
+        else:
+            d['text'] = ""
+        if rnd.random() < 0.4:
+            d['photo'] = f"photos/photo_{i}.jpg"
+            d['width'], d['height'] = 1280, 960
+        if i > 1 and rnd.random() < 0.1:
+            d['reply_to_message_id'] = rnd.randint(1, i - 1)
+        msgs.append(d)
+    return msgs
+
+
+def setup_infer_groups(n: int):
+    from ..convert_export import infer_groups
+
+    msgs = make_export_msgs(n)
+
+    def make():
+        data = [dict(m) for m in msgs]
+        return lambda: infer_groups(data)
+    return make
+
+
+def setup_convert_msg(n: int):
+    from .. import convert_export as ce
+
+    msgs = make_export_msgs(n)
+    ce.infer_groups(msgs)
+
+    # Same module state as convert_export.run() sets up
+    def make():
+        ce.id_map = {d['id']: d for d in msgs}
+        groups = {}
+        for d in msgs:
+            if 'media_group_id' in d:
+                groups.setdefault(d['media_group_id'], []).append(d)
+        ce.groups = groups
+        ce.processed_groups = {}
+        return lambda: [ce.convert_msg(d) for d in msgs]
+    return make
+
+
+def setup_export_convert_text(n: int):
+    from ..convert_export import convert_text
+
+    texts = [d['text'] for d in make_export_msgs(n)]
+
+    def run():
+        for t in texts:
+            convert_text(t)
+    return lambda: run
+
+
+# ---------- tgc.rss ----------
+
+def _setup_artifact(n: int, fn: Callable[[Path, list[dict]], object]):
+    posts = make_posts(n)
+    tmp = TemporaryDirectory()
+
+    def make():
+        path = Path(tmp.name)
+        for f in path.iterdir():
+            f.unlink()
+        return _quiet(lambda: fn(path, posts))
+    return make
+
+
+def setup_posts_to_feed(n: int):
+    from ..rss.posts_to_feed import posts_to_feed, FeedMeta
+    meta = FeedMeta(title="Bench", link="https://example.com", description="Bench feed", language="en",
+                    image_url="https://example.com/icon.png")
+    return _setup_artifact(n, lambda path, posts: posts_to_feed(path, meta, posts))
+
+
+def setup_posts_to_sitemap(n: int):
+    from ..rss.posts_to_feed import posts_to_sitemap, SitemapMeta
+    meta = SitemapMeta(base_url="https://example.com")
+    return _setup_artifact(n, lambda path, posts: posts_to_sitemap(path, meta, posts))
+
+
+CASES = [
+    Case('pyro.convert_text', setup_pyro_convert_text),
+    Case('pyro.group_msgs', setup_group_msgs),
+    Case('pyro.guess_ext', setup_guess_ext),
+    Case('export.convert_text', setup_export_convert_text),
+    Case('export.infer_groups', setup_infer_groups),
+    Case('export.convert_msg', setup_convert_msg),
+    Case('rss.posts_to_feed', setup_posts_to_feed, max_scale=10_000),
+    Case('rss.posts_to_sitemap', setup_posts_to_sitemap),
+]
+
+
+# ---------- Measurement ----------
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    Time a fixed pure-Python workload, used to normalize timings between machines
+    """
+    def work():
+        rnd = random.Random(0)
+        d = {}
+        for i in range(200_000):
+            d[str(rnd.random())] = i
+        return sorted(d)
+    return best_time(lambda: work, repeat)
+
+
+def best_time(make: Callable[[], Callable[[], object]], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        fn = make()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(make: Callable[[], Callable[[], object]]) -> int:
+    """
+    Peak memory allocated while running (inputs are allocated before tracing starts)
+    """
+    fn = make()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def compare(result: dict, base: dict | None, calib: float, base_calib: float, threshold: float,
+            mem_threshold: float) -> tuple[float | None, float | None, bool]:
+    """
+    :return: (time ratio, memory ratio, regressed)
+    """
+    if not base:
+        return None, None, False
+    t_ratio = (result['seconds'] / calib) / (base['seconds'] / base_calib)
+    m_ratio = result['peak_bytes'] / max(base['peak_bytes'], 1)
+    slow = t_ratio > 1 + threshold and result['seconds'] > NOISE_FLOOR
+    bloated = m_ratio > 1 + mem_threshold and result['peak_bytes'] > MEMORY_NOISE_FLOOR
+    return t_ratio, m_ratio, slow or bloated
+
+
+def main():
+    parser = argparse.ArgumentParser("tgc microbenchmarks")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="Comma-separated input sizes (number of posts/messages)")
+    parser.add_argument("--cases", help="Comma-separated case names or prefixes (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions (the best time is used)")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown ratio before failing")
+    parser.add_argument("--memory-threshold", type=float, default=0.2,
+                        help="Allowed peak memory increase ratio before failing")
+    parser.add_argument("--baseline", type=Path, default=BASELINE, help="Baseline json file")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(",")]
+    wanted = args.cases.split(",") if args.cases else None
+    cases = [c for c in CASES if not wanted or any(c.name.startswith(w) for w in wanted)]
+
+    baseline = codec.read(args.baseline) if args.baseline.is_file() else {'calibration': None, 'results': {}}
+    calib = calibrate()
+    base_calib = baseline['calibration'] or calib
+    print(f"Calibration: {calib * 1000:.1f}ms (baseline {base_calib * 1000:.1f}ms), "
+          f"Python {platform.python_version()}")
+    print()
+    print(f"{'case':<24}{'n':>8}{'time':>11}{'ratio':>8}{'peak':>10}{'ratio':>8}  status")
+
+    results = {}
+    regressions = []
+    for case in cases:
+        for n in scales:
+            if n > case.max_scale:
+                continue
+            make = case.setup(n)
+            key = f"{case.name}@{n}"
+            results[key] = r = {'seconds': best_time(make, args.repeat), 'peak_bytes': peak_memory(make)}
+            t_ratio, m_ratio, regressed = compare(r, baseline['results'].get(key), calib, base_calib,
+                                                  args.threshold, args.memory_threshold)
+            status = 'new' if t_ratio is None else 'REGRESSED' if regressed else 'ok'
+            if regressed:
+                regressions.append(key)
+            print(f"{case.name:<24}{n:>8}{r['seconds'] * 1000:>9.1f}ms"
+                  f"{'' if t_ratio is None else f'{t_ratio:.2f}x':>8}{r['peak_bytes'] / 1e6:>8.2f}MB"
+                  f"{'' if m_ratio is None else f'{m_ratio:.2f}x':>8}  {status}")
+
+    if args.update_baseline:
+        # Keep baselines of cases and scales that were not run this time, rescaled to this machine
+        for r in baseline['results'].values():
+            r['seconds'] *= calib / base_calib
+        baseline['results'].update(results)
+        baseline['calibration'] = calib
+        baseline['python'] = platform.python_version()
+        baseline['results'] = dict(sorted(baseline['results'].items()))
+        codec.write_json(args.baseline, baseline, indent=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) past {args.threshold:.0%} time / {args.memory_threshold:.0%} "
+              f"memory: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
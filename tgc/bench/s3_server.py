@@ -0,0 +1,127 @@
+"""
+Local stand-in for an S3-compatible object store (like MinIO), used to test S3Storage
+
+Serves path-style PUT, HEAD and GET requests (/<bucket>/<key>) from memory. Signatures aren't
+verified, but requests without an AWS4-HMAC-SHA256 Authorization header are rejected like on a
+private bucket. The server counts requests, uploads and bytes.
+
+Usage: python -m tgc.bench.s3_server [--port 9000] [--latency 0.05]
+"""
+import argparse
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+@dataclass
+class S3Stats:
+    requests: int = 0
+    uploads: int = 0
+    bytes: int = 0
+    rejected: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **kwargs):
+        with self.lock:
+            for k, v in kwargs.items():
+                setattr(self, k, getattr(self, k) + v)
+
+
+class S3Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr: tuple[str, int], latency: float = 0):
+        """
+        :param addr: (host, port), port 0 picks a free port
+        :param latency: Seconds before each response
+        """
+        super().__init__(addr, S3Handler)
+        self.latency = latency
+        self.objects: dict[str, tuple[bytes, str]] = {}
+        self.stats = S3Stats()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: S3Server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes = b"", content_type: str = "application/xml", length: int | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _start(self) -> str | None:
+        """
+        :return: Object path (<bucket>/<key>), None if the request was rejected
+        """
+        srv = self.server
+        srv.stats.add(requests=1)
+        if srv.latency:
+            time.sleep(srv.latency)
+        if not self.headers.get("Authorization", "").startswith("AWS4-HMAC-SHA256 "):
+            srv.stats.add(rejected=1)
+            self._reply(403, b"<Error><Code>AccessDenied</Code></Error>")
+            return None
+        return unquote(urlparse(self.path).path).lstrip("/")
+
+    def do_PUT(self):
+        # Read the body first so that the connection stays usable after a rejection
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if (key := self._start()) is None:
+            return
+        self.server.objects[key] = (body, self.headers.get("Content-Type", "application/octet-stream"))
+        self.server.stats.add(uploads=1, bytes=len(body))
+        self._reply(200)
+
+    def do_HEAD(self):
+        if (key := self._start()) is None:
+            return
+        if key not in self.server.objects:
+            return self._reply(404)
+        body, content_type = self.server.objects[key]
+        self._reply(200, content_type=content_type, length=len(body))
+
+    def do_GET(self):
+        if (key := self._start()) is None:
+            return
+        if key not in self.server.objects:
+            return self._reply(404, b"<Error><Code>NoSuchKey</Code></Error>")
+        body, content_type = self.server.objects[key]
+        self._reply(200, body, content_type)
+
+
+def main():
+    parser = argparse.ArgumentParser("Local stand-in for an S3-compatible object store")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds before each response")
+    args = parser.parse_args()
+
+    srv = S3Server((args.host, args.port), args.latency)
+    print(f"S3 stand-in listening on {srv.url}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        print(srv.stats)
+
+
+if __name__ == '__main__':
+    main()
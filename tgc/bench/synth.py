@@ -0,0 +1,53 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+WORDS = ["telegram", "channel", "backup", "猫", "今天", "天气", "不错", "meow", "post", "photo", "video", "😺",
+         "hello", "world", "记录", "日常", "quick", "brown", "fox", "jumps"]
+
+EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def make_text(rnd: random.Random, words: int) -> str:
+    text = " ".join(rnd.choice(WORDS) for _ in range(words))
+    if rnd.random() < 0.3:
+        text = f"<b>{text[:20]}</b>{text[20:]}"
+    if rnd.random() < 0.2:
+        text += ' <a href="https://example.com">link</a> <span class=\'hashtag\'>#tag</span>'
+    return text
+
+
+def make_posts(n: int, seed: int = 0) -> list[dict]:
+    """
+    Generate n deterministic posts in tg-blog's posts.json schema (oldest first)
+
+    Roughly 40% of the posts have images, 10% have files, and some of them are media groups.
+    """
+    rnd = random.Random(seed)
+    posts = []
+    msg_id = 1
+    for i in range(n):
+        date = (EPOCH + timedelta(minutes=37 * i)).isoformat()
+        post = {"id": msg_id, "date": date}
+        r = rnd.random()
+        count = rnd.choice([1, 1, 1, 2, 3, 4]) if r < 0.5 else 1
+        if r < 0.5:
+            post["media_group_id"] = 13000000000000000 + msg_id
+        if rnd.random() < 0.85:
+            post["text"] = make_text(rnd, rnd.randint(3, 80))
+        post["views"] = rnd.randint(10, 50000)
+        if r < 0.4:
+            post["images"] = [{
+                "width": 1280, "height": 960, "date": date, "media_type": "photo",
+                "original_name": f"{msg_id + k}.jpg", "url": f"https://img.example.com/file/{msg_id + k}.jpg",
+                "size": rnd.randint(50_000, 500_000), "thumb": f"https://img.example.com/file/{msg_id + k}.jpg",
+            } for k in range(count)]
+        elif r < 0.5:
+            post["files"] = [{
+                "width": 1920, "height": 1080, "duration": rnd.randint(3, 600), "file_name": f"{msg_id + k}.mp4",
+                "mime_type": "video/mp4", "supports_streaming": True, "media_type": "video_file", "date": date,
+                "original_name": f"{msg_id + k}.mp4", "url": f"https://img.example.com/file/{msg_id + k}.mp4",
+                "size": rnd.randint(1_000_000, 50_000_000), "thumb": f"https://img.example.com/file/{msg_id + k}_t.jpg",
+            } for k in range(count)]
+        posts.append(post)
+        msg_id += count
+    return posts
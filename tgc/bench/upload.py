@@ -0,0 +1,117 @@
+"""
+Upload throughput benchmark against the local stand-in upload server
+
+Measures upload_file_with_retry for single photos, thumbnails and chunked videos, and reports
+throughput, retry overhead (requests per successful upload) and connection reuse.
+
+Usage: python -m tgc.bench.upload [--photos 50] [--videos 1] [--video-mb 45] [--error-rate 0.1]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from .upload_server import UploadServer
+
+
+@dataclass
+class UploadConfig:
+    upload_url: str
+    image_base_url: str
+    upload_auth_code: str = "bench"
+
+
+def make_files(d: Path, prefix: str, count: int, size: int, ext: str, seed: int) -> list[Path]:
+    rnd = random.Random(seed)
+    out = []
+    for i in range(count):
+        fp = d / f"{prefix}{i}{ext}"
+        fp.write_bytes(rnd.randbytes(size))
+        out.append(fp)
+    return out
+
+
+def bench_case(name: str, files: list[Path], cfg: UploadConfig, srv: UploadServer, verbose: bool) -> dict:
+    from ..pyro.download_media import upload_file_with_retry
+
+    total = sum(f.stat().st_size for f in files)
+    before = (srv.stats.requests, srv.stats.uploads, srv.stats.connections, srv.stats.errors_injected)
+    failed = 0
+
+    start = time.perf_counter()
+    # upload_file_with_retry logs every attempt, hide it unless requested
+    with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO()):
+        for f in files:
+            if upload_file_with_retry(str(f), cfg) is None:
+                failed += 1
+    wall = time.perf_counter() - start
+
+    requests, uploads, connections, errors = (a - b for a, b in zip(
+        (srv.stats.requests, srv.stats.uploads, srv.stats.connections, srv.stats.errors_injected), before))
+    return {
+        'case': name, 'files': len(files), 'mb': total / 1e6, 'wall': wall, 'failed': failed,
+        'requests': requests, 'uploads': uploads, 'errors': errors, 'connections': connections,
+    }
+
+
+def print_results(results: list[dict]):
+    print()
+    print(f"{'case':<12}{'files':>6}{'MB':>8}{'time':>9}{'MB/s':>8}{'files/s':>9}{'req':>6}{'retry%':>8}"
+          f"{'err':>5}{'fail':>5}{'conns':>7}{'req/conn':>9}")
+    for r in results:
+        retry = (r['requests'] - r['uploads']) / max(r['uploads'], 1)
+        print(f"{r['case']:<12}{r['files']:>6}{r['mb']:>8.1f}{r['wall']:>8.2f}s{r['mb'] / r['wall']:>8.1f}"
+              f"{r['files'] / r['wall']:>9.1f}{r['requests']:>6}{retry:>8.1%}{r['errors']:>5}{r['failed']:>5}"
+              f"{r['connections']:>7}{r['requests'] / max(r['connections'], 1):>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser("tgc upload benchmark")
+    parser.add_argument("--photos", type=int, default=50, help="Number of single photo uploads")
+    parser.add_argument("--photo-kb", type=int, default=300)
+    parser.add_argument("--thumbs", type=int, default=50, help="Number of thumbnail uploads")
+    parser.add_argument("--thumb-kb", type=int, default=30)
+    parser.add_argument("--videos", type=int, default=1, help="Number of chunked video uploads")
+    parser.add_argument("--video-mb", type=float, default=45, help="Size of each video (chunked above 20 MB)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Server latency per request (s)")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Server bandwidth in MB/s (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Ratio of HTTP 500 responses")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Ratio of responses without src")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show upload logs")
+    args = parser.parse_args()
+
+    srv = UploadServer(("127.0.0.1", 0), args.latency, args.bandwidth * 1e6, args.error_rate, args.drop_rate)
+    srv.start()
+    cfg = UploadConfig(upload_url=f"{srv.url}/upload", image_base_url=srv.url)
+    print(f"Upload server on {srv.url} (latency {args.latency}s, error rate {args.error_rate}, "
+          f"drop rate {args.drop_rate})")
+
+    results = []
+    cwd = os.getcwd()
+    with TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        # Chunked uploads write their parts into the working directory
+        os.chdir(tmp)
+        try:
+            cases = [
+                ('photo', make_files(tmp, "photo", args.photos, args.photo_kb * 1000, ".jpg", 1)),
+                ('thumbnail', make_files(tmp, "thumb", args.thumbs, args.thumb_kb * 1000, ".jpg", 2)),
+                ('video', make_files(tmp, "video", args.videos, int(args.video_mb * 1e6), ".mp4", 3)),
+            ]
+            for name, files in cases:
+                if files:
+                    results.append(bench_case(name, files, cfg, srv, args.verbose))
+        finally:
+            os.chdir(cwd)
+
+    srv.shutdown()
+    print_results(results)
+
+
+if __name__ == '__main__':
+    main()
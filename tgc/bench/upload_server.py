@@ -0,0 +1,170 @@
+"""
+Local stand-in for the image-host upload API used by upload_file_with_retry
+
+Accepts multipart POSTs with an `authCode` query parameter and answers like the real host
+(`[{"src": "/file/<name>"}]`). Latency, bandwidth and error rates are configurable, and the
+server counts requests, bytes and TCP connections so upload benchmarks can measure retry
+overhead and connection reuse.
+
+Usage: python -m tgc.bench.upload_server [--port 8765] [--latency 0.05] [--error-rate 0.1]
+"""
+import argparse
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from .. import codec
+
+FILENAME_RE = re.compile(rb'filename="([^"]*)"')
+
+
+@dataclass
+class ServerStats:
+    requests: int = 0
+    uploads: int = 0
+    bytes: int = 0
+    errors_injected: int = 0
+    connections: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **kwargs):
+        with self.lock:
+            for k, v in kwargs.items():
+                setattr(self, k, getattr(self, k) + v)
+
+
+class UploadServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr: tuple[str, int], latency: float = 0, bandwidth: float = 0, error_rate: float = 0,
+                 drop_rate: float = 0, auth_code: str = "bench", store: Path | None = None, seed: int = 0):
+        """
+        :param addr: (host, port), port 0 picks a free port
+        :param latency: Seconds before each response
+        :param bandwidth: Upload bandwidth in bytes/s (0 = unlimited)
+        :param error_rate: Ratio of requests answered with HTTP 500
+        :param drop_rate: Ratio of requests answered with HTTP 200 but without a src field
+        :param auth_code: Expected authCode (requests with another code get HTTP 401)
+        :param store: Save uploaded files into this directory (not saved if None)
+        """
+        super().__init__(addr, UploadHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.auth_code = auth_code
+        self.store = store
+        self.rnd = random.Random(seed)
+        self.stats = ServerStats()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Allow keep-alive so that connection reuse is observable
+    server: UploadServer
+
+    def setup(self):
+        super().setup()
+        self.server.stats.add(connections=1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: object):
+        data = codec.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        remaining = int(self.headers.get("Content-Length") or 0)
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 256 * 1024))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+        return b"".join(chunks)
+
+    def do_POST(self):
+        srv = self.server
+        srv.stats.add(requests=1)
+        query = parse_qs(urlparse(self.path).query)
+        body = self._read_body()
+        srv.stats.add(bytes=len(body))
+
+        if srv.latency:
+            time.sleep(srv.latency)
+
+        if query.get("authCode", [None])[0] != srv.auth_code:
+            return self._reply(401, {"error": "invalid authCode"})
+
+        with srv.stats.lock:
+            r = srv.rnd.random()
+        if r < srv.error_rate:
+            srv.stats.add(errors_injected=1)
+            return self._reply(500, {"error": "injected error"})
+        if r < srv.error_rate + srv.drop_rate:
+            srv.stats.add(errors_injected=1)
+            return self._reply(200, {"data": []})
+
+        m = FILENAME_RE.search(body[:4096])
+        name = Path(m.group(1).decode(errors='replace')).name if m else "upload.bin"
+        folder = query.get("uploadFolder", ["other"])[0]
+        stored = f"{uuid.uuid4().hex[:12]}_{name}"
+
+        if srv.store:
+            # Strip the multipart envelope: the file starts after the part headers and ends before the boundary
+            start = body.find(b"\r\n\r\n", m.end() if m else 0) + 4
+            end = body.rfind(b"\r\n--")
+            out = srv.store / folder / stored
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_bytes(body[start:end])
+
+        srv.stats.add(uploads=1)
+        self._reply(200, [{"src": f"/file/{folder}/{stored}"}])
+
+
+def main():
+    parser = argparse.ArgumentParser("Local stand-in for the upload API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds before each response")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Upload bandwidth in MB/s (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Ratio of HTTP 500 responses")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Ratio of responses without src")
+    parser.add_argument("--auth-code", default="bench")
+    parser.add_argument("--store", help="Save uploaded files into this directory")
+    args = parser.parse_args()
+
+    srv = UploadServer((args.host, args.port), args.latency, args.bandwidth * 1e6, args.error_rate, args.drop_rate,
+                       args.auth_code, Path(args.store) if args.store else None)
+    print(f"Upload server listening on {srv.url}/upload (authCode={args.auth_code})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        print(srv.stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+JSON codec for everything tgc reads and writes
+
+An accelerated backend (orjson or msgspec) is used when it's installed, otherwise the stdlib json
+module is used. The backend can be forced with the TGC_JSON_BACKEND environment variable.
+"""
+import dataclasses
+import datetime
+import json
+import os
+from enum import Enum
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, TypedDict
+
+from hypy_utils import write
+
+
+class _PostRequired(TypedDict):
+    id: int
+
+
+class PostJson(_PostRequired, total=False):
+    """
+    A post in tg-blog's posts.json schema
+    """
+    date: str
+    type: str
+    text: str
+    views: int
+    forwards: int
+    author: str
+    media_group_id: int
+    msg_ids: list[int]
+    forwarded_from: dict[str, Any]
+    reply: dict[str, Any]
+    video: dict[str, Any]
+    images: list[dict[str, Any]]
+    files: list[dict[str, Any]]
+
+
+def default(o: object) -> object:
+    """
+    Serialize objects that JSON doesn't support natively (same rules as hypy_utils' json_stringify)
+    """
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if isinstance(o, SimpleNamespace):
+        return o.__dict__
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if isinstance(o, (set, frozenset, tuple)):
+        return list(o)
+    if isinstance(o, Path):
+        return str(o)
+    if isinstance(o, Enum):
+        return o.name
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _stdlib() -> tuple[Callable, Callable]:
+    def loads(data: bytes | str) -> Any:
+        return json.loads(data)
+
+    def dumps(obj: Any, indent: bool = False) -> bytes:
+        if indent:
+            return json.dumps(obj, ensure_ascii=False, indent=2, default=default).encode('utf-8')
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+    return loads, dumps
+
+
+def _orjson() -> tuple[Callable, Callable]:
+    import orjson
+
+    def dumps(obj: Any, indent: bool = False) -> bytes:
+        opt = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=default, option=opt)
+
+    return orjson.loads, dumps
+
+
+def _msgspec() -> tuple[Callable, Callable]:
+    import msgspec
+
+    enc = msgspec.json.Encoder(enc_hook=default)
+    dec = msgspec.json.Decoder()
+
+    def dumps(obj: Any, indent: bool = False) -> bytes:
+        buf = enc.encode(obj)
+        return msgspec.json.format(buf, indent=2) if indent else buf
+
+    return dec.decode, dumps
+
+
+def available_backends() -> dict[str, tuple[Callable, Callable]]:
+    """
+    All installed backends, fastest first
+    """
+    out = {}
+    for name, fn in [('orjson', _orjson), ('msgspec', _msgspec), ('json', _stdlib)]:
+        try:
+            out[name] = fn()
+        except ImportError:
+            pass
+    return out
+
+
+BACKENDS = available_backends()
+BACKEND = os.getenv('TGC_JSON_BACKEND') or next(iter(BACKENDS))
+assert BACKEND in BACKENDS, f"JSON backend {BACKEND} is not installed (available: {', '.join(BACKENDS)})"
+_loads, _dumps = BACKENDS[BACKEND]
+
+
+def loads(data: bytes | str) -> Any:
+    return _loads(data)
+
+
+def dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serialize to UTF-8 JSON bytes. Non-ascii characters are not escaped.
+
+    :param obj: Object
+    :param indent: Indent with 2 spaces (otherwise the output is compact)
+    """
+    return _dumps(obj, indent)
+
+
+def stringify(obj: Any, indent: bool = False) -> str:
+    return dumps(obj, indent).decode('utf-8')
+
+
+def read(fp: Path | str) -> Any:
+    return loads(Path(fp).read_bytes())
+
+
+def write_json(fp: Path | str, obj: Any, indent: bool = False):
+    write(fp, dumps(obj, indent))
+
+
+def decode_posts(data: Any) -> list[PostJson]:
+    """
+    Validate decoded posts.json content, and normalize post ids to int
+
+    :param data: Decoded JSON
+    :return: Posts
+    """
+    if not isinstance(data, list):
+        raise ValueError(f"posts.json must contain a list, got {type(data).__name__}")
+    for p in data:
+        if not isinstance(p, dict) or 'id' not in p:
+            raise ValueError(f"Invalid post: {str(p)[:100]}")
+        if not isinstance(p['id'], int):
+            p['id'] = int(p['id'])
+    return data
+
+
+def load_posts(fp: Path | str) -> list[PostJson]:
+    """
+    Read and validate a posts.json file
+    """
+    return decode_posts(read(fp))
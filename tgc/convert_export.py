@@ -1,15 +1,18 @@
 import argparse
-import json
 import os.path
 import shutil
+from contextlib import nullcontext
 from pathlib import Path
 from subprocess import check_call, CalledProcessError
 
-from hypy_utils import printc, write, json_stringify
+from hypy_utils import printc, write
 from hypy_utils.dict_utils import remove_nones
 
+from . import codec, profiling
 from .convert_media_types import tgs_to_apng, extract_album_art
-from .pyro.consts import HTML
+from .output import precompress
+from .pages import write_pages
+from .pyro.consts import load_html
 
 test_text = [
     "test ",
@@ -297,7 +300,7 @@ def convert_original_filenames(json_path: Path):
     Convert filenames in the original result.json
     """
     renamed: dict[str, str] = {}
-    results = json.loads(json_path.read_text())
+    results = codec.read(json_path)
 
     if results.get('processed'):
         return
@@ -321,16 +324,27 @@ def convert_original_filenames(json_path: Path):
                 renamed[orig] = np
     results['processed'] = True
 
-    write(json_path, json_stringify(results, indent=2))
+    codec.write_json(json_path, results, indent=True)
 
 
 def run():
-    global p, id_map, groups, processed_groups
     parser = argparse.ArgumentParser("Telegram export converter",
                                      description="A tool to convert exported json into tg-blog json")
     parser.add_argument("dir", help="Export directory")
+    parser.add_argument("--page-size", type=int, help="Also write paginated posts/page-N.json with this many "
+                                                     "posts per page")
+    parser.add_argument("--compress", action="store_true", help="Write compact JSON and pre-compressed .gz files")
+    parser.add_argument("--zstd", action="store_true", help="Also write pre-compressed .zst files (implies --compress)")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
 
+    profiler = profiling.from_args(args)
+    with profiler.section(Path(args.dir).resolve().name) if profiler else nullcontext():
+        convert(args)
+
+
+def convert(args: argparse.Namespace):
+    global p, id_map, groups, processed_groups
     p = Path(args.dir)
     f = p / "result.json"
     assert f.is_file(), f"Error: File {f} not found"
@@ -339,7 +353,7 @@ def run():
     convert_original_filenames(f)
 
     # Read export result json
-    j: list[dict] = json.loads(f.read_text())["messages"]
+    j: list[dict] = codec.read(f)["messages"]
     id_map = {d['id']: d for d in j}
 
     # Assign groups
@@ -357,8 +371,15 @@ def run():
     j = [convert_msg(d) for d in j]
     j = [d for d in j if d is not None]
 
-    write(p / "posts.json", json_stringify(j, indent=2))
-    write(p / "index.html", HTML.replace("$$POSTS_DATA$$", json_stringify(j)))
+    compress = args.compress or args.zstd
+    codec.write_json(p / "posts.json", j, indent=not compress)
+    # The front end only loads posts.json, pages are written for clients that load them lazily
+    if args.page_size:
+        write_pages(p, j, args.page_size)
+    write(p / "index.html", load_html().replace("$$POSTS_DATA$$", codec.stringify(j)))
+
+    if compress:
+        precompress(p, zstd=args.zstd)
 
     printc(f"&aDone! Saved to {p / 'posts.json'}")
 
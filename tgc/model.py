@@ -0,0 +1,212 @@
+"""
+Compact in-memory model of tg-blog posts
+
+Posts and media items are slotted dataclasses with integer ids and epoch timestamps parsed once on
+load. Conversion to and from the posts.json schema is lossless: unknown keys are kept in `extra`,
+and the original key order is remembered (orders are interned, since almost all posts share a few).
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from typing import Any, Iterable
+
+from .codec import PostJson
+
+_orders: dict[tuple[str, ...], tuple[str, ...]] = {}
+
+
+def _intern_order(keys: Iterable[str]) -> tuple[str, ...]:
+    t = tuple(keys)
+    return _orders.setdefault(t, t)
+
+
+def parse_ts(date: str | datetime | None) -> int:
+    """
+    Parse a post date into epoch seconds. Dates without a timezone are treated as UTC.
+    """
+    if date is None:
+        return 0
+    if isinstance(date, str):
+        try:
+            date = datetime.fromisoformat(date)
+        except ValueError:
+            from dateutil import parser
+            try:
+                date = parser.parse(date)
+            except (ValueError, OverflowError):
+                return 0
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return int(date.timestamp())
+
+
+def parse_until(value: str | date | None) -> int:
+    """
+    Parse the inclusive end of a date range into epoch seconds. A date without a time means the
+    end of that day (e.g. "2024-01-01" includes all of January 1st).
+    """
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = value.isoformat()
+    ts = parse_ts(value)
+    if isinstance(value, str) and len(value.strip()) == 10:
+        ts += 86399
+    return ts
+
+
+def _split(cls, d: dict) -> tuple[dict, dict | None]:
+    known = {}
+    extra = {}
+    for k, v in d.items():
+        if k in cls.FIELD_SET:
+            known[k] = v
+        else:
+            extra[k] = v
+    return known, extra or None
+
+
+def _join(obj) -> dict:
+    out = {}
+    extra = obj.extra or {}
+    for k in obj.order:
+        if k in extra:
+            out[k] = extra[k]
+        elif k in obj.FIELD_SET:
+            out[k] = getattr(obj, k)
+
+    # Fields that were set after loading
+    for k in obj.FIELDS:
+        if k not in out and (v := getattr(obj, k)) is not None:
+            out[k] = v
+    return out
+
+
+@dataclass(slots=True)
+class MediaItem:
+    """
+    An image or file attached to a post
+    """
+    url: str | None = None
+    thumb: str | None = None
+    media_type: str | None = None
+    mime_type: str | None = None
+    original_name: str | None = None
+    file_name: str | None = None
+    width: int | None = None
+    height: int | None = None
+    duration: int | None = None
+    size: int | None = None
+    date: str | None = None
+    extra: dict[str, Any] | None = None
+    order: tuple[str, ...] = ()
+
+    FIELDS = ('url', 'thumb', 'media_type', 'mime_type', 'original_name', 'file_name',
+              'width', 'height', 'duration', 'size', 'date')
+    FIELD_SET = frozenset(FIELDS)
+
+    @classmethod
+    def from_dict(cls, d: dict, post_date: str | None = None) -> 'MediaItem':
+        known, extra = _split(cls, d)
+        date = known.get('date')
+        if isinstance(date, datetime):
+            known['date'] = date = date.isoformat()
+
+        # Share duplicate strings instead of keeping a copy per item
+        if date is not None and date == post_date:
+            known['date'] = post_date
+        if 'thumb' in known and known['thumb'] == known.get('url'):
+            known['thumb'] = known['url']
+        return cls(**known, extra=extra, order=_intern_order(d))
+
+    def to_dict(self) -> dict:
+        return _join(self)
+
+
+def _media_list(items: list[dict] | None, post_date: str | None) -> list[MediaItem] | None:
+    if items is None:
+        return None
+    return [MediaItem.from_dict(i, post_date) for i in items]
+
+
+@dataclass(slots=True)
+class Post:
+    """
+    A post in the tg-blog model
+    """
+    id: int
+    ts: int = 0
+    date: str | None = None
+    type: str | None = None
+    text: str | None = None
+    author: str | None = None
+    views: int | None = None
+    forwards: int | None = None
+    media_group_id: int | None = None
+    # Ids of the messages of an album (a post without them is its own message)
+    msg_ids: list[int] | None = None
+    forwarded_from: dict | None = None
+    reply: dict | None = None
+    video: dict | None = None
+    images: list[MediaItem] | None = None
+    files: list[MediaItem] | None = None
+    extra: dict[str, Any] | None = None
+    order: tuple[str, ...] = field(default=())
+
+    FIELDS = ('id', 'media_group_id', 'msg_ids', 'date', 'type', 'text', 'author', 'views', 'forwards',
+              'forwarded_from', 'reply', 'video', 'images', 'files')
+    FIELD_SET = frozenset(FIELDS)
+
+    @classmethod
+    def from_dict(cls, d: PostJson | dict) -> 'Post':
+        known, extra = _split(cls, d)
+        known['id'] = int(known['id'])
+        date = known.get('date')
+        if isinstance(date, datetime):
+            known['date'] = date.isoformat()
+        known['images'] = _media_list(known.get('images'), known.get('date'))
+        known['files'] = _media_list(known.get('files'), known.get('date'))
+        return cls(**known, ts=parse_ts(date), extra=extra, order=_intern_order(d))
+
+    def to_dict(self) -> PostJson:
+        out = _join(self)
+        if self.images is not None:
+            out['images'] = [i.to_dict() for i in self.images]
+        if self.files is not None:
+            out['files'] = [f.to_dict() for f in self.files]
+        return out
+
+    @property
+    def datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.ts, timezone.utc)
+
+    @property
+    def body(self) -> str:
+        """
+        Text of the post, falling back to the caption of posts created by older versions
+        """
+        return self.text or (self.extra or {}).get('caption') or ''
+
+
+def as_posts(posts: Iterable[Post | dict]) -> list[Post]:
+    return [p if isinstance(p, Post) else Post.from_dict(p) for p in posts]
+
+
+def to_dicts(posts: Iterable[Post]) -> list[PostJson]:
+    return [p.to_dict() for p in posts]
+
+
+def merge_posts(old: list[Post], new: list[Post]) -> list[Post]:
+    """
+    Merge new posts into existing posts. New posts replace old posts with the same id, and the
+    result is sorted by increasing id.
+
+    :param old: Existing posts (sorted by id)
+    :param new: New posts (any order)
+    :return: Merged posts
+    """
+    if not new:
+        return old
+    new = sorted(new, key=lambda p: p.id)
+    if not old or new[0].id > old[-1].id:
+        # Fast path: new posts are all newer than the existing ones
+        return old + new
+    new_ids = {p.id for p in new}
+    return sorted([p for p in old if p.id not in new_ids] + new, key=lambda p: p.id)
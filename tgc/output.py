@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from hypy_utils import printc
+
+from . import codec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Generated artifacts of an export, relative to the export directory
+ARTIFACTS = ["posts.json", "index.html", "rss.xml", "atom.xml", "sitemap.xml", "robots.txt"]
+
+# Content hashes of the artifacts at the time they were last compressed
+MANIFEST = ".precompress.json"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_if_changed(fp: Path, data: bytes | str) -> bool:
+    """
+    Write a file only if its content would change, so that unchanged artifacts keep their mtime
+
+    :param fp: File path
+    :param data: New content (strings are encoded as utf-8)
+    :return: Whether the file was written
+    """
+    fp = Path(fp)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if fp.is_file() and fp.stat().st_size == len(data) and content_hash(fp.read_bytes()) == content_hash(data):
+        return False
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    fp.write_bytes(data)
+    return True
+
+
+def find_artifacts(path: Path) -> list[str]:
+    """
+    List the generated artifacts that exist in an export directory, including paginated posts
+    """
+    names = [n for n in ARTIFACTS if (path / n).is_file()]
+    names += sorted(str(f.relative_to(path)) for f in (path / "posts").glob("*.json"))
+    return names
+
+
+def _compress(fp: Path, data: bytes, zstd: bool, level: int) -> list[Path]:
+    # mtime=0 keeps the gzip output deterministic, so unchanged content produces identical bytes
+    gz = fp.with_name(fp.name + ".gz")
+    gz.write_bytes(gzip.compress(data, compresslevel=level, mtime=0))
+    out = [gz]
+
+    if zstd:
+        zst = fp.with_name(fp.name + ".zst")
+        zst.write_bytes(zstandard.ZstdCompressor(level=19).compress(data))
+        out.append(zst)
+
+    return out
+
+
+def precompress(path: Path, names: list[str] | None = None, zstd: bool = False,
+                level: int = 9, workers: int = 4) -> list[Path]:
+    """
+    Write pre-compressed .gz (and optionally .zst) siblings next to each artifact
+
+    Only artifacts whose content hash changed since the last run are recompressed. The compression
+    itself runs in a thread pool (zlib and zstandard release the GIL while compressing).
+
+    :param path: Export directory
+    :param names: Artifacts relative to path (default: all existing artifacts)
+    :param zstd: Also write .zst variants (requires the zstandard package)
+    :param level: Gzip compression level
+    :param workers: Compression threads
+    :return: Compressed files that were written
+    """
+    if zstd and zstandard is None:
+        printc("&eWarning! zstandard is not installed, only writing .gz variants (pip install zstandard)")
+        zstd = False
+
+    mf = path / MANIFEST
+    manifest: dict[str, str] = codec.read(mf) if mf.is_file() else {}
+    full = names is None
+    names = find_artifacts(path) if full else names
+    exts = [".gz", ".zst"] if zstd else [".gz"]
+
+    todo = []
+    hashes = {} if full else dict(manifest)
+    for n in names:
+        fp = path / n
+        data = fp.read_bytes()
+        hashes[n] = h = content_hash(data)
+        if manifest.get(n) == h and all(fp.with_name(fp.name + e).is_file() for e in exts):
+            continue
+        todo.append((fp, data))
+
+    # Remove compressed siblings of artifacts that no longer exist
+    for n in manifest.keys() - hashes.keys():
+        for e in [".gz", ".zst"]:
+            (path / (n + e)).unlink(missing_ok=True)
+
+    written = []
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for out in pool.map(lambda t: _compress(*t, zstd, level), todo):
+                written += out
+
+    if hashes != manifest:
+        codec.write_json(mf, hashes, indent=True)
+
+    printc(f"&aPre-compressed {len(todo)} of {len(names)} artifacts ({len(names) - len(todo)} unchanged)")
+    return written
@@ -0,0 +1,101 @@
+import hashlib
+from pathlib import Path
+
+from hypy_utils import write
+
+from . import codec
+
+PAGES_DIR = "posts"
+DEFAULT_PAGE_SIZE = 500
+
+
+def page_name(n: int) -> str:
+    return f"page-{n}.json"
+
+
+def paginate(posts: list[dict], page_size: int) -> list[list[dict]]:
+    """
+    Split posts into fixed-size pages
+
+    Pages are anchored at the oldest post: page 1 holds the oldest posts and the last page (the head
+    page) holds the newest ones and may be partially filled. This way, appending new posts only
+    changes the head page. Posts inside each page are ordered newest first.
+
+    :param posts: Posts in any order
+    :param page_size: Number of posts per page
+    :return: Pages, oldest page first
+    """
+    assert page_size > 0, f"Invalid page size {page_size}"
+    posts = sorted(posts, key=lambda x: int(x['id']))
+    return [posts[i:i + page_size][::-1] for i in range(0, len(posts), page_size)]
+
+
+def read_index(path: Path) -> dict:
+    """
+    Read posts/index.json of an export, returns an empty dict if it doesn't exist or is broken
+    """
+    fp = path / PAGES_DIR / "index.json"
+    if not fp.is_file():
+        return {}
+    try:
+        return codec.read(fp)
+    except ValueError:
+        return {}
+
+
+def write_pages(path: Path, posts: list[dict], page_size: int = DEFAULT_PAGE_SIZE) -> list[Path]:
+    """
+    Write posts as posts/page-N.json with a small posts/index.json
+
+    Each page's hash is recorded in the index, so only pages whose content changed are rewritten.
+    When new posts arrive, that is just the head page and the index.
+
+    :param path: Export directory
+    :param posts: All posts of the export
+    :param page_size: Number of posts per page
+    :return: Files that were (re)written
+    """
+    out = path / PAGES_DIR
+    old = read_index(path)
+    old_pages = old.get('pages', [])
+
+    # Hashes of the old pages are only comparable if the page size didn't change
+    old_hashes = {e['page']: e['hash'] for e in old_pages} if old.get('page_size') == page_size else {}
+
+    written = []
+    entries = []
+    for n, page in enumerate(paginate(posts, page_size), 1):
+        data = codec.dumps(page)
+        h = hashlib.sha1(data).hexdigest()
+        fp = out / page_name(n)
+        if old_hashes.get(n) != h or not fp.is_file():
+            write(fp, data)
+            written.append(fp)
+
+        entries.append({
+            "page": n,
+            "file": page_name(n),
+            "count": len(page),
+            "min_id": page[-1]['id'],
+            "max_id": page[0]['id'],
+            "hash": h,
+        })
+
+    # Remove pages that no longer exist (e.g. after the page size changed)
+    for e in old_pages:
+        if e['page'] > len(entries):
+            (out / page_name(e['page'])).unlink(missing_ok=True)
+
+    # Index lists the newest page first, which is the one the front end should load first
+    index = {
+        "count": len(posts),
+        "page_size": page_size,
+        "min_id": entries[0]['min_id'] if entries else None,
+        "max_id": entries[-1]['max_id'] if entries else None,
+        "pages": entries[::-1],
+    }
+    if written or index != old:
+        codec.write_json(out / "index.json", index, indent=True)
+        written.append(out / "index.json")
+
+    return written
@@ -0,0 +1,177 @@
+"""
+Built-in profiling for tgc and tgce runs (--profile)
+
+Each export is profiled as a section, with one cProfile.Profile enabled for the whole section (a
+thread can only have one active profiler, and Python 3.12+ raises if a second one is enabled).
+Inside an event loop, the profiler installs a task factory that measures the CPU time of every
+step of each asyncio task, so the section's CPU time is also broken down by task (labelled by its
+coroutine). Optionally, tracemalloc records the peak memory and the top allocation sites of each
+section.
+
+For each section, <dir>/<name>.prof (pstats dump, e.g. for snakeviz) and <dir>/<name>.txt
+(hotspot summary) are written.
+"""
+import cProfile
+import collections.abc
+import io
+import pstats
+import re
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from hypy_utils import printc
+
+
+class _ProfiledCoro(collections.abc.Coroutine):
+    """
+    Wraps a task's coroutine, adding the CPU time of each step to the task's total
+    """
+    __slots__ = ('coro', 'profiler', 'label')
+
+    def __init__(self, coro, profiler: 'Profiler', label: str):
+        self.coro = coro
+        self.profiler = profiler
+        self.label = label
+
+    def send(self, value):
+        start = time.thread_time()
+        try:
+            return self.coro.send(value)
+        finally:
+            self.profiler.add_task_time(self.label, time.thread_time() - start)
+
+    def throw(self, *args):
+        start = time.thread_time()
+        try:
+            return self.coro.throw(*args)
+        finally:
+            self.profiler.add_task_time(self.label, time.thread_time() - start)
+
+    def close(self):
+        return self.coro.close()
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    def __getattr__(self, name):
+        # cr_frame, __qualname__ etc. used by asyncio's task repr
+        return getattr(self.coro, name)
+
+
+class Profiler:
+    """
+    :param out_dir: Directory for the profile dumps and summaries
+    :param memory: Also trace memory allocations with tracemalloc (slows the run down)
+    :param top: Number of hotspots in the summaries
+    """
+
+    def __init__(self, out_dir: Path, memory: bool = False, top: int = 25):
+        self.out_dir = out_dir
+        self.memory = memory
+        self.top = top
+        self.section_name: str | None = None
+        self.profile: cProfile.Profile | None = None
+        # CPU seconds of each task in the current section
+        self.tasks: dict[str, float] = {}
+
+    def add_task_time(self, label: str, seconds: float):
+        if self.section_name is not None:
+            self.tasks[label] = self.tasks.get(label, 0) + seconds
+
+    def install(self, loop):
+        """
+        Measure the CPU time of the tasks created in this asyncio loop
+        """
+        import asyncio
+
+        def factory(loop, coro, **kwargs):
+            label = getattr(coro, '__qualname__', None) or type(coro).__name__
+            return asyncio.Task(_ProfiledCoro(coro, self, label), loop=loop, **kwargs)
+        loop.set_task_factory(factory)
+
+    @contextmanager
+    def section(self, name: str):
+        """
+        Profile a block (usually one export), including every task of the event loop that runs
+        until the block ends
+        """
+        self.section_name = name
+        self.tasks = {}
+        self.profile = cProfile.Profile()
+        start = time.thread_time()
+        if self.memory:
+            tracemalloc.start(10)
+        self.profile.enable()
+        try:
+            yield self
+        finally:
+            # Stop profiling first, so that dumping is not profiled
+            self.profile.disable()
+            cpu = time.thread_time() - start
+            if not self.tasks:
+                self.tasks['main'] = cpu
+            snapshot = None
+            if self.memory:
+                snapshot = (tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            self.dump(name, snapshot)
+            self.section_name = None
+
+    def dump(self, name: str, snapshot: tuple[tracemalloc.Snapshot, int] | None):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^\w.-]+', '_', name).strip('_') or 'profile'
+
+        if not self.profile.getstats():
+            printc(f"&eNo profile data recorded for {name}")
+            return
+        total = _stats(self.profile)
+        total.dump_stats(self.out_dir / f"{slug}.prof")
+
+        out = io.StringIO()
+        out.write(f"Profile of {name}\n\n")
+        out.write("== CPU time per task ==\n")
+        for label, tt in sorted(self.tasks.items(), key=lambda x: -x[1]):
+            out.write(f"{tt:>10.3f}s  {label}\n")
+
+        for sort in ('tottime', 'cumulative'):
+            out.write(f"\n== Top {self.top} functions by {sort} ==\n")
+            _stats(total, stream=out).sort_stats(sort).print_stats(self.top)
+
+        if snapshot:
+            snap, peak = snapshot
+            out.write(f"\n== Memory: peak {peak / 1e6:.1f} MB, top {self.top} allocation sites ==\n")
+            snap = snap.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            for stat in snap.statistics('lineno')[:self.top]:
+                out.write(f"{stat.size / 1e6:>10.2f} MB {stat.count:>9} blocks  {stat.traceback[0]}\n")
+
+        summary = self.out_dir / f"{slug}.txt"
+        summary.write_text(out.getvalue())
+
+        printc(f"&aProfile of {name} saved to {self.out_dir / f'{slug}.prof'} and {summary}")
+        total.sort_stats('tottime')
+        for func in total.fcn_list[:10]:
+            cc, nc, tt, ct, _ = total.stats[func]
+            print(f"  {tt:>8.3f}s {ct:>8.3f}s cum  {pstats.func_std_string(func)}")
+
+
+def _stats(*items: cProfile.Profile | pstats.Stats, stream=None) -> pstats.Stats:
+    stats = pstats.Stats(stream=stream)
+    stats.add(*items)
+    return stats
+
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true", help="Profile the run and write per-export CPU profiles "
+                                                               "and hotspot summaries")
+    parser.add_argument("--profile-dir", default="profile", help="Output directory of --profile (default: profile)")
+    parser.add_argument("--profile-memory", action="store_true", help="Also sample memory with tracemalloc")
+    parser.add_argument("--profile-top", type=int, default=25, help="Number of hotspots in the summaries")
+
+
+def from_args(args) -> Profiler | None:
+    if not (args.profile or args.profile_memory):
+        return None
+    return Profiler(Path(args.profile_dir), memory=args.profile_memory, top=args.profile_top)
@@ -2,8 +2,6 @@ import os
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Union
-from telethon.sync import TelegramClient
-from telethon.sessions import StringSession
 import toml
 from hypy_utils import printc
 
@@ -40,6 +38,9 @@ def load_config(path: str = "config.toml") -> Config:
     return Config(**toml.loads(fp.read_text()))
 
 def get_telegram_client(path: str = "config.toml"):
+    from telethon.sync import TelegramClient
+    from telethon.sessions import StringSession
+
     cfg = load_config(path)
     client = TelegramClient(StringSession(cfg.string_session), cfg.api_id, cfg.api_hash)
     return client
@@ -1,15 +1,33 @@
+from functools import lru_cache
 from pathlib import Path
 
-from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, MessageMediaContact, MessageMediaPoll, MessageMediaWebPage, MessageMediaGeo, MessageMediaVenue
+HTML_PATH = Path(__file__).parent.parent / "tg-blog.html"
 
-MEDIA_TYPE_MAP = {
-    MessageMediaPhoto: "photo",
-    MessageMediaDocument: "document",
-    MessageMediaContact: "contact",
-    MessageMediaPoll: "poll",
-    MessageMediaWebPage: "web_page",
-    MessageMediaGeo: "location",
-    MessageMediaVenue: "location",
-}
 
-HTML = (Path(__file__).parent.parent / "tg-blog.html").read_text()
+@lru_cache(maxsize=None)
+def load_html() -> str:
+    return HTML_PATH.read_text()
+
+
+@lru_cache(maxsize=None)
+def media_type_map() -> dict[type, str]:
+    from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, MessageMediaContact, MessageMediaPoll, \
+        MessageMediaWebPage, MessageMediaGeo, MessageMediaVenue
+    return {
+        MessageMediaPhoto: "photo",
+        MessageMediaDocument: "document",
+        MessageMediaContact: "contact",
+        MessageMediaPoll: "poll",
+        MessageMediaWebPage: "web_page",
+        MessageMediaGeo: "location",
+        MessageMediaVenue: "location",
+    }
+
+
+def __getattr__(name: str):
+    # Loaded on first use, so that importing this module doesn't read the template or import Telethon
+    if name == 'HTML':
+        return load_html()
+    if name == 'MEDIA_TYPE_MAP':
+        return media_type_map()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,6 +1,6 @@
 
 from hypy_utils.dict_utils import deep_dict
-from telethon.tl.types import MessageEntityBold, MessageEntityItalic, MessageEntityCode, MessageEntityPre, MessageEntityTextUrl, MessageEntityUrl, MessageEntityMention, MessageEntityHashtag, MessageEntityCashtag, MessageEntityBotCommand, MessageEntityEmail, MessageEntityPhone, MessageEntityUnderline, MessageEntityStrike, MessageEntitySpoiler, Message
+from telethon.tl.types import MessageEntityBold, MessageEntityItalic, MessageEntityCode, MessageEntityPre, MessageEntityTextUrl, MessageEntityUrl, MessageEntityMention, MessageEntityHashtag, MessageEntityCashtag, MessageEntityBotCommand, MessageEntityEmail, MessageEntityPhone, MessageEntityUnderline, MessageEntityStrike, MessageEntitySpoiler, MessageEntityCustomEmoji, Message
 from tgc.pyro.consts import MEDIA_TYPE_MAP
 
 def convert_media_dict(msg: Message) -> dict:
@@ -53,6 +53,9 @@ def entity_start_end(text: str, en: Message) -> tuple[str, str] | None:
         return ("<s>", "</s>")
     if isinstance(en, MessageEntitySpoiler):
         return ("<span class='spoiler'>", "</span>")
+    if isinstance(en, MessageEntityCustomEmoji):
+        # 占位符，下载后由 emoji.replace_emojis 替换为实际路径
+        return (f'<i class="custom-emoji" emoji-src="emoji/{en.document_id}">', "</i>")
     return None
 
 
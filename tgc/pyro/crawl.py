@@ -1,22 +1,29 @@
 import argparse
 import asyncio
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Union
-from PIL import Image
-from hypy_utils import printc, json_stringify, write
+from typing import Callable, Union
+from hypy_utils import printc, write
 from hypy_utils.dict_utils import remove_keys
-from telethon.sync import TelegramClient
-from telethon.sessions import StringSession
-from telethon.tl.types import User, Chat, Message, DocumentAttributeSticker
+from telethon.tl.types import User, Message
 
-from .config import load_config, Config
-from .consts import HTML
+from .. import codec, profiling
+from . import derivatives, metrics, optimize, peers, storage, timeseries, upload_journal, video
+from .consts import load_html
 from .convert import convert_text, convert_media_dict
-from .download_media import download_media, has_media, guess_ext, download_media_urlsafe
+from .download_media import download_media, download_thumbnail, has_media, resolve_ext, download_media_urlsafe
+from .emoji import replace_emojis, resolve_emojis
 from .grouper import group_msgs
+from .filters import MessageFilter
+from .media_policy import MediaPolicy
+from .media_queue import enqueue, pending_media
+from .peers import resolve_chat
 from ..convert_export import remove_nones
 from ..convert_media_types import tgs_to_apng
-from ..rss.posts_to_feed import posts_to_feed, FeedMeta
+from ..model import Post, as_posts, merge_posts, parse_ts, to_dicts
+from ..output import precompress
+from ..pages import write_pages
+from ..rss.posts_to_feed import build_artifacts, FeedMeta, SitemapMeta
 
 
 def effective_text(msg: Message) -> str:
@@ -113,7 +120,7 @@ async def process_message(msg: Message, path: Path, export: dict, client):
         if f.get('thumbs'):
             thumb: dict = max(f['thumbs'], key=lambda x: x['file_size'])
             # Telethon 没有 FileId.decode，直接用 mime_type 判断扩展名
-            ext = guess_ext(client, thumb.get('mime_type', None))
+            ext = resolve_ext(mime_type=thumb.get('mime_type'))
             fp = await download_media(client, thumb['file_id'], directory=media_path,
                                       fname=fp.with_suffix(fp.suffix + f'_thumb{ext}').name)
             f['thumb'] = str(fp.absolute().relative_to(path.absolute()))
@@ -129,51 +136,340 @@ async def process_message(msg: Message, path: Path, export: dict, client):
             img = m['image'] = m.pop('file')
 
             # Read image size
+            from PIL import Image
             img['width'], img['height'] = Image.open(path / img['url']).size
 
     return remove_keys(remove_nones(m), {'file_id', 'file_unique_id'})
 
 
 async def download_custom_emojis(msgs: list[Message], results: list[dict], path: Path, client):
-    print("Downloading custom emojis...")
-    # List custom emoji ids
-    ids = set()
-    for msg in msgs:
-        if hasattr(msg, 'entities') and msg.entities:
-            for e in msg.entities:
-                if hasattr(e, 'custom_emoji_id') and e.custom_emoji_id:
-                    ids.add(e.custom_emoji_id)
-        if hasattr(msg, 'caption_entities') and msg.caption_entities:
-            for e in msg.caption_entities:
-                if hasattr(e, 'custom_emoji_id') and e.custom_emoji_id:
-                    ids.add(e.custom_emoji_id)
-    ids = list(ids)
-    orig_ids = list(ids)
-
-    # Query stickers 200 ids at a time
-    stickers = []
-    while ids:
-        stickers += await client.get_custom_emoji_stickers(ids[:200])
-        ids = ids[200:]
-
-    # Download stickers
-    for id, s in zip(orig_ids, stickers):
-        ext = guess_ext(client, getattr(s, 'mime_type', None))
-        op = (await download_media(client, s, path / "emoji", f'{id}{ext}')).absolute().relative_to(path.absolute())
-
-        # Replace sticker paths
-        for r in results:
-            if "text" in r:
-                r['text'] = r['text'].replace(f'<i class="custom-emoji" emoji-src="emoji/{id}">',
-                                              f'<i class="custom-emoji" emoji-src="{op}">')
-
-
-async def process_chat(chat_id_input, path: Path, export: dict, client):
+    emojis = await resolve_emojis(msgs, path, client)
+    for r in results:
+        if r.get('text'):
+            r['text'] = replace_emojis(r['text'], emojis)
+
+
+# Range of message ids already scanned, including the filtered ones (which leave no post)
+SCANNED_FILE = ".crawl.json"
+
+
+def load_scanned(path: Path) -> tuple[int | None, int | None]:
+    """
+    :return: Lowest and highest message id scanned by earlier crawls of an export (None if unknown)
+    """
+    fp = path / SCANNED_FILE
+    if not fp.is_file():
+        return None, None
+    try:
+        d = codec.read(fp)
+        return d.get('min_id'), d.get('max_id')
+    except (ValueError, AttributeError) as e:
+        print(f"Warning: Could not load {fp}: {e}")
+        return None, None
+
+
+def save_scanned(path: Path, min_id: int | None, max_id: int | None):
+    path.mkdir(parents=True, exist_ok=True)
+    codec.write_json(path / SCANNED_FILE, {'min_id': min_id, 'max_id': max_id}, indent=True)
+
+
+IMAGE_EXTS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.ico']
+AUDIO_EXTS = ['.mp3', '.ogg', '.wav', '.aac', '.flac', '.m4a', '.wma']
+
+
+def media_type(ext: str) -> str:
+    """
+    :param ext: Extension of a stored file
+    :return: media_type of the file (photo, video, audio or file)
+    """
+    ext = ext.lower()
+    if ext in IMAGE_EXTS:
+        return 'photo'
+    if ext in video.VIDEO_EXTS or ext == '.m3u8':
+        return 'video'
+    if ext in AUDIO_EXTS:
+        return 'audio'
+    return 'file'
+
+
+def stored_info(m: Message, r: dict, name: str) -> dict:
+    """
+    Media info shared by every kind of stored file
+
+    :param m: Message of the media
+    :param r: Upload result (see storage.Storage.put)
+    :param name: Original file name
+    """
+    return {
+        'date': getattr(m, 'date', None),
+        'original_name': r.get('original_name', name),
+        'url': r['url'],  # 外链
+        'size': r.get('size')
+    }
+
+
+def video_info(r: dict, thumb: dict | None, mime_type: str) -> dict:
+    """
+    Media info of a stored video, its dimensions are the ones of the pre-generated thumbnail if any
+
+    :param r: Upload result of the video (or of one of its segments)
+    :param thumb: Stored thumbnail (see upload_video_thumb)
+    :param mime_type: Mime type of the stored file
+    """
+    return {
+        'mime_type': mime_type,
+        'width': thumb['width'] if thumb else r.get('width'),
+        'height': thumb['height'] if thumb else r.get('height'),
+        'duration': r.get('duration', 0),
+        'media_type': 'video',
+        'thumb': thumb['url'] if thumb else None
+    }
+
+
+async def upload_video_thumb(fp: Path, journal, store) -> dict | None:
+    """
+    Generate the thumbnail of a video (the frame at 1s) and store it
+
+    :param fp: Local video file
+    :param journal: Upload journal of the export
+    :param store: Storage of the export
+    :return: url, width and height of the stored thumbnail, or None if it couldn't be generated or stored
+    """
+    import subprocess
+    from PIL import Image
+
+    thumb_path = fp.with_suffix('.jpg')
+    try:
+        with metrics.stage('thumbnail'):
+            subprocess.run(['ffmpeg', '-i', str(fp), '-ss', '00:00:01.000', '-vframes', '1', '-y', str(thumb_path)],
+                           capture_output=True, text=True)
+        if not thumb_path.exists() or not thumb_path.stat().st_size:
+            print(f"Failed to generate thumbnail before upload for {fp.name}")
+            return None
+        with Image.open(thumb_path) as img:
+            width, height = img.size
+        r = await journal.upload(thumb_path, store)
+    except Exception as e:
+        print(f"Error generating thumbnail before upload for {fp.name}: {e}")
+        return None
+
+    # 清理本地缩略图文件（本地存储时保留）
+    if not store.keeps_local:
+        thumb_path.unlink(missing_ok=True)
+    if not isinstance(r, dict) or 'url' not in r:
+        return None
+    print(f"Pre-uploaded thumbnail: {r['url']} ({width}x{height})")
+    return {'url': r['url'], 'width': width, 'height': height}
+
+
+async def process_media(client, m: Message, path: Path, post_id: int, export: dict) -> list[dict]:
+    """
+    Download, thumbnail and upload the media of a message
+
+    :param client: Telegram client
+    :param m: Message with media
+    :param path: Export path
+    :param post_id: Id of the post the message belongs to (media is downloaded into path/post_id)
+    :param export: Export config
+    :return: Media infos (see split_media), empty if the media was skipped or failed to upload
+    """
+    journal = upload_journal.get(path)
+    if (recorded := journal.media(post_id, m.id)) is not None:
+        print(f"Reusing recorded uploads of message {m.id}")
+        return recorded
+    # 下载前按媒体策略判断（类型、mime、大小），不传输任何数据
+    decision = MediaPolicy.from_export(export).evaluate(m)
+    if decision.action == 'skip':
+        MediaPolicy.report(m, decision)
+        return []
+    journal.begin(post_id, m.id)
+    store = storage.get(export, path)
+
+    if decision.action == 'thumb':
+        # 超过大小限制的视频只保留缩略图
+        MediaPolicy.report(m, decision)
+        info = {**pending_media(m), 'omitted': decision.reason}
+        thumb = await download_thumbnail(client, m, path/str(post_id))
+        if thumb and isinstance(r := await journal.upload(thumb, store), dict):
+            info['thumb'] = r.get('url')
+        journal.finish(post_id, m.id, [info], [] if store.keeps_local or not thumb else [thumb])
+        return [info]
+
+    media_files = []
+    fp, name = await download_media_urlsafe(client, m, directory=path/str(post_id))
+    if not fp:
+        journal.abort(post_id, m.id, [])
+        return media_files
+
+    # 上传前优化图片（去除元数据、无损重新压缩，optimize_images）
+    await optimize.optimize_file(fp, export)
+
+    # 在上传之前，先为视频生成并上传缩略图
+    thumb = None
+    if fp.suffix.lower() in video.VIDEO_EXTS:
+        print(f"Pre-generating thumbnail for video before upload: {name}")
+        thumb = await upload_video_thumb(fp, journal, store)
+
+    # 现在进行视频上传（超过分段大小的视频先用 ffmpeg 切分为 HLS 或 MP4 分段）
+    upload_result, created = await video.store_video(fp, journal, store, export)
+
+    if isinstance(upload_result, list):
+        # 分片视频，使用预生成的缩略图信息
+        for item in upload_result:
+            if isinstance(item, dict) and 'url' in item:
+                media_files.append({**stored_info(m, item, name),
+                                    **video_info(item, thumb, item.get('mime_type', 'video/mp4'))})
+    elif isinstance(upload_result, dict) and 'url' in upload_result:
+        ext = Path(str(upload_result['url'])).suffix.lower()
+        info = stored_info(m, upload_result, name)
+        kind = media_type(ext)
+        if kind == 'photo':
+            # 图片 - 缩略图直接使用图片本身的URL
+            info.update({
+                'width': upload_result.get('width'),
+                'height': upload_result.get('height'),
+                'media_type': 'photo',
+                'thumb': upload_result['url'],
+                'mime_type': 'image/jpeg'
+            })
+            # 生成多种宽度的 WebP 缩略图（thumb_widths），供 srcset 使用
+            thumbs, derived = await derivatives.derive(fp, journal, store, export)
+            if thumbs:
+                info['thumbs'] = thumbs
+                info['thumb'] = derivatives.preview(thumbs)
+                created += derived
+        elif kind == 'video':
+            # 视频（或 HLS 播放列表） - 使用预生成的缩略图信息
+            info.update(video_info(upload_result, thumb, video.HLS_MIME if ext == '.m3u8' else 'video/mp4'))
+        elif kind == 'audio':
+            info.update({
+                'mime_type': 'audio/mpeg',
+                'duration': upload_result.get('duration', 0),
+                'media_type': 'audio',
+                'thumb': None
+            })
+        else:
+            info.update({
+                'mime_type': 'application/octet-stream',
+                'media_type': 'file',
+                'thumb': None
+            })
+        media_files.append(info)
+
+    # 上传完成后记录结果再删除本地文件，中断时下次运行可直接复用
+    if media_files:
+        journal.finish(post_id, m.id, media_files, [] if store.keeps_local else [fp, *created])
+    else:
+        # 存储失败：记录为失败并清理本地文件，避免日志和文件无限增长
+        print(f"Failed to store the media of message {m.id}")
+        journal.abort(post_id, m.id, [fp, *created] + ([fp.with_suffix('.jpg')] if fp.suffix.lower() in video.VIDEO_EXTS else []))
+    return media_files
+
+
+def split_media(media_files: list[dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Convert media infos of a post into its images and files
+
+    :param media_files: Media infos returned by process_media
+    :return: Images, files
+    """
+    # 分离图片和其他文件，匹配参考格式
+    images = []
+    files = []
+
+    for m in media_files:
+        if m.get('media_type') == 'photo':
+            # 图片格式 - 精简字段，匹配参考格式
+            image_info = {
+                'width': m.get('width'),
+                'height': m.get('height'),
+                'date': m.get('date'),
+                'media_type': 'photo',
+                'original_name': m.get('original_name'),
+                'url': m.get('url'),
+                'size': m.get('size'),
+                'thumb': m.get('thumb'),
+                'thumbs': m.get('thumbs')
+            }
+            # 移除None值
+            image_info = {k: v for k, v in image_info.items() if v is not None}
+            images.append(image_info)
+        else:
+            # 视频/文件格式 - 匹配参考格式
+            file_info = {}
+
+            # 基础尺寸信息（如果存在）
+            if m.get('width'):
+                file_info['width'] = m['width']
+            if m.get('height'):
+                file_info['height'] = m['height']
+            if m.get('duration'):
+                file_info['duration'] = m['duration']
+
+            # 视频特定字段
+            if m.get('media_type') == 'video':
+                file_info['file_name'] = m.get('original_name')  # 使用file_name而不是original_name
+                file_info['mime_type'] = m.get('mime_type') or 'video/mp4'  # HLS 播放列表保留其类型
+                file_info['supports_streaming'] = True
+                file_info['media_type'] = 'video_file'  # 匹配参考格式
+            else:
+                # 其他文件类型
+                file_info['file_name'] = m.get('original_name')
+                file_info['mime_type'] = m.get('mime_type', 'application/octet-stream')
+
+            # 通用字段
+            file_info.update({
+                'date': m.get('date'),
+                'original_name': m.get('original_name'),
+                'url': m.get('url'),
+                'size': m.get('size')
+            })
+
+            # 缩略图（仅当存在时）
+            if m.get('thumb'):
+                file_info['thumb'] = m['thumb']
+            # 按媒体策略只保留了缩略图的视频
+            if m.get('omitted'):
+                file_info['omitted'] = m['omitted']
+
+            # 移除None值
+            file_info = {k: v for k, v in file_info.items() if v is not None}
+            files.append(file_info)
+    return images, files
+
+
+async def process_chat(chat_id_input, path: Path, export: dict, client,
+                       on_merge: Callable[[list[Post]], list[Post]] | None = None):
+    """
+    Crawl new posts of a chat and save them
+
+    :param chat_id_input: Chat id or username
+    :param path: Export path
+    :param export: Export config (set `backfill = false` to only crawl posts newer than the saved ones)
+    :param client: Telegram client
+    :param on_merge: Called with all posts (sorted by id) before they are saved, returns the posts to save
+    """
+    with metrics.run(export), timeseries.recording(export):
+        try:
+            await _process_chat(chat_id_input, path, export, client, on_merge)
+        except Exception as e:
+            if not peers.is_stale(e):
+                raise
+            # 缓存的 access hash 被拒绝（例如 session 换了账号），重新解析后重试一次
+            printc(f"&eCached peer of {chat_id_input} was rejected ({e}), resolving again")
+            metrics.count('peer_cache_stale')
+            peers.forget_peer(path)
+            await _process_chat(chat_id_input, path, export, client, on_merge)
+
+
+async def _process_chat(chat_id_input, path: Path, export: dict, client,
+                        on_merge: Callable[[list[Post]], list[Post]] | None = None):
     try:
         # 验证并转换聊天ID
         chat_id = validate_chat_id(chat_id_input)
         printc(f"&aTrying to access chat: {chat_id}")
-        chat = await client.get_entity(chat_id)
+        with metrics.stage('resolve'):
+            chat = await resolve_chat(client, chat_id_input, path, export)
         printc(f"&aChat obtained. Chat name: {getattr(chat, 'title', str(chat))} | Type: {getattr(chat, 'type', type(chat))} | ID: {getattr(chat, 'id', '')}")
     except ValueError as e:
         if "Peer id invalid" in str(e):
@@ -200,7 +496,6 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
 
     # 持续爬取直到获取到有效消息或达到最大限制
     print("Crawling channel posts...")
-    import json
     posts_path = path / "posts.json"
     
     # 获取已有贴文的所有ID集合和范围
@@ -209,42 +504,57 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
     existing_max_id = None
     
     if posts_path.exists():
-        with open(posts_path, "r", encoding="utf-8") as f:
-            try:
-                old_posts = json.load(f)
-                if old_posts:
-                    existing_ids = set(int(post.get('id', 0)) for post in old_posts if post.get('id'))
-                    if existing_ids:
-                        existing_min_id = min(existing_ids)
-                        existing_max_id = max(existing_ids)
-                        print(f"Found {len(existing_ids)} existing posts, ID range: {existing_min_id} - {existing_max_id}")
-                    else:
-                        print("Found existing posts.json but no valid IDs")
-            except Exception as e:
-                print(f"Warning: Could not load existing posts.json: {e}")
-                old_posts = []
+        try:
+            with metrics.stage('load_posts'):
+                old_posts = sorted(as_posts(codec.load_posts(posts_path)), key=lambda x: x.id)
+            if old_posts:
+                existing_ids = set(post.id for post in old_posts if post.id)
+                if existing_ids:
+                    existing_min_id = min(existing_ids)
+                    existing_max_id = max(existing_ids)
+                    print(f"Found {len(existing_ids)} existing posts, ID range: {existing_min_id} - {existing_max_id}")
+                else:
+                    print("Found existing posts.json but no valid IDs")
+        except Exception as e:
+            print(f"Warning: Could not load existing posts.json: {e}")
+            old_posts = []
     else:
         old_posts = []
         print("No existing posts.json found, starting fresh")
     
     # 保存原始的existing_ids，用于最终去重检查
     original_existing_ids = existing_ids.copy()
+
+    # 刷新最近的贴文：编辑、删除、浏览量和转发数
+    refreshed = 0
+    if old_posts and (export.get('refresh_posts') or export.get('refresh_days')):
+        from .refresh import refresh_posts
+        old_posts, refreshed = await refresh_posts(client, chat, path, export, old_posts)
     
-    # 计算起始ID：从最大已有ID开始向上采集新贴文
-    start_id = existing_max_id if existing_max_id else 0
+    # 已扫描的范围：被过滤的消息不会留下贴文，需单独记录，否则每次运行都会重新扫描全部历史
+    scanned_min_id, scanned_max_id = load_scanned(path)
+    lowest_id = min((i for i in (existing_min_id, scanned_min_id) if i is not None), default=None)
+
+    # 计算起始ID：从最大已有（或已扫描）ID开始向上采集新贴文
+    start_id = max(existing_max_id or 0, scanned_max_id or 0)
     print(f"Starting crawl from ID > {start_id}")
 
+    # 按配置的规则过滤消息，被过滤的消息不会下载，也不计入 max_posts_per_run
+    msg_filter = MessageFilter.from_export(export)
+
     msgs = []
     last_id = start_id
-    max_total = 20  # 每次最多执行20个有效贴文
+    max_total = int(export.get('max_posts_per_run') or 20)  # 每次最多执行20个有效贴文（可配置）
     no_new_messages_count = 0  # 连续没有新消息的批次计数
     max_empty_batches = 3  # 连续3个批次都没有新消息才停止向上采集
     
     # 第一阶段：向上采集新贴文（ID > start_id）
     print("=== Phase 1: Crawling newer posts (向上采集) ===")
     while len(msgs) < max_total:
-        batch = await client.get_messages(chat.id, limit=min(100, max_total - len(msgs)), min_id=last_id)
+        with metrics.stage('get_messages'):
+            batch = await client.get_messages(chat, limit=min(100, max_total - len(msgs)), min_id=last_id)
         batch = [m for m in batch if hasattr(m, 'id') and not getattr(m, 'empty', False)]
+        metrics.count('messages_fetched', len(batch))
         if not batch:
             print("> No more newer messages available.")
             break
@@ -264,8 +574,10 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
                 existing_ids.add(m.id)  # 添加到已存在集合，避免重复处理
         
         if new_batch:
-            msgs.extend(new_batch)
             last_id = new_batch[-1].id
+            if msg_filter:
+                new_batch = msg_filter.apply(new_batch)
+            msgs.extend(new_batch)
             no_new_messages_count = 0  # 重置计数
             print(f"> Added {len(new_batch)} newer messages (skipped {skipped_count} existing), total: {len(msgs)} (last ID: {last_id})")
         else:
@@ -279,24 +591,32 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
                 print(f"> No new messages found in {max_empty_batches} consecutive batches, stopping upward crawl.")
                 break
     
+    # 批次末尾暂缓的相册在本方向采集结束时决定
+    if msg_filter:
+        msgs.extend(msg_filter.flush())
+
     # 第二阶段：如果没有采集满，向下采集历史贴文（ID < start_id）
-    if len(msgs) < max_total and (existing_min_id is None or existing_min_id > 1):
+    if export.get('backfill', True) and len(msgs) < max_total and (lowest_id is None or lowest_id > 1):
         remaining_quota = max_total - len(msgs)
         print(f"=== Phase 2: Crawling older posts (向下采集) - Need {remaining_quota} more ===")
         
-        # 从已有的最小ID开始向下采集
-        max_id = existing_min_id - 1 if existing_min_id else start_id
-        print(f"Starting downward crawl from ID < {max_id + 1}")
+        # 从已有（或已扫描）的最小ID开始向下采集
+        # max_id 不包含自身（只返回 ID < max_id 的消息）
+        max_id = lowest_id if lowest_id else start_id
+        print(f"Starting downward crawl from ID < {max_id}")
         
         downward_no_new_count = 0
         downward_max_empty = 500  # 增加到500次重试，更积极地采集历史贴文
         
         while len(msgs) < max_total:
             # 向下采集：使用max_id限制上限
-            batch = await client.get_messages(chat.id, limit=min(100, max_total - len(msgs)), max_id=max_id)
+            with metrics.stage('get_messages'):
+                batch = await client.get_messages(chat, limit=min(100, max_total - len(msgs)), max_id=max_id)
             batch = [m for m in batch if hasattr(m, 'id') and not getattr(m, 'empty', False)]
+            metrics.count('messages_fetched', len(batch))
             if not batch:
                 print("> No more older messages available.")
+                max_id = 1
                 break
                 
             # 按ID从大到小排序（向下采集）
@@ -314,22 +634,44 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
                     existing_ids.add(m.id)
             
             if new_batch:
+                max_id = min(m.id for m in new_batch)  # 更新max_id为本批最小ID
+                # 早于 since 的历史消息都会被过滤，无需继续向下采集
+                reached_since = msg_filter and msg_filter.since is not None \
+                    and parse_ts(new_batch[-1].date) < msg_filter.since
+                if msg_filter:
+                    new_batch = msg_filter.apply(new_batch)
                 msgs.extend(new_batch)
-                max_id = min(m.id for m in new_batch) - 1  # 更新max_id为最小ID-1
                 downward_no_new_count = 0
-                print(f"> Added {len(new_batch)} older messages (skipped {skipped_count} existing), total: {len(msgs)} (next max_id: {max_id + 1})")
+                print(f"> Added {len(new_batch)} older messages (skipped {skipped_count} existing), total: {len(msgs)} (next max_id: {max_id})")
+                if reached_since:
+                    print("> Reached the since date of the filter, stopping downward crawl.")
+                    break
+                # max_id=0 表示不限制，会重新从最新的消息开始，到达 ID 1 即停止
+                if max_id <= 1:
+                    print("> Reached the first message, stopping downward crawl.")
+                    break
             else:
                 # 如果这批都是已存在的，继续向下
-                max_id = min(m.id for m in batch) - 1 if batch else max_id - 100
+                max_id = min(m.id for m in batch) if batch else max_id - 100
                 downward_no_new_count += 1
-                print(f"> No new messages in downward batch (skipped {skipped_count} existing), next max_id: {max_id + 1} (empty batches: {downward_no_new_count})")
+                print(f"> No new messages in downward batch (skipped {skipped_count} existing), next max_id: {max_id} (empty batches: {downward_no_new_count})")
                 
+                if max_id <= 1:
+                    print("> Reached the first message, stopping downward crawl.")
+                    break
                 if downward_no_new_count >= downward_max_empty:
                     print(f"> No new messages found in {downward_max_empty} consecutive downward batches, stopping.")
                     break
+        if msg_filter:
+            msgs.extend(msg_filter.flush())
+        # max_id 及以上的消息都已扫描
+        lowest_id = max_id
     
     if not msgs:
         print("No new messages to process.")
+        if refreshed:
+            save_posts(path, export, on_merge(old_posts) if on_merge else old_posts)
+        save_scanned(path, lowest_id, last_id)
         return
 
     print(f"Successfully collected {len(msgs)} new messages for processing")
@@ -337,6 +679,9 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
         msg_ids = [m.id for m in msgs]
         print(f"Message ID range: {min(msg_ids)} - {max(msg_ids)}")
 
+    # 相册在此时已完整（跨批次的相册会被保留到下一次运行），按贴文记录浏览量
+    timeseries.sample(msgs)
+
     # 按 grouped_id 分组
     from collections import defaultdict
     msg_groups = defaultdict(list)
@@ -349,6 +694,10 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
 
     results = []
     print(f"Processing {len(msg_groups)} message groups...")
+    # 延迟下载模式：先保存贴文，媒体任务写入队列由 tgc media 处理
+    defer = export.get('defer_media')
+    policy = MediaPolicy.from_export(export)
+    media_jobs: dict[int, list[Message]] = {}
     
     for gid, group in msg_groups.items():
         # 组内收集所有媒体和附言
@@ -358,283 +707,34 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
         post_id = min(m.id for m in group if hasattr(m, 'id'))
         print(f"Processing group {gid} with post_id {post_id}")
         
+        # 有需要下载的媒体时整个贴文的媒体都进入队列（worker 会替换贴文的全部媒体），策略跳过的除外
+        decisions = {m.id: policy.evaluate(m) for m in group if has_media(m)}
+        deferred = defer and any(d.action == 'download' for d in decisions.values())
         for m in group:
-            if has_media(m):
-                fp, name = await download_media_urlsafe(client, m, directory=path/str(post_id), max_file_size=int((export.get('size_limit_mb') or 0) * 1000_000))
-                if fp:
-                    from .config import load_config
-                    cfg = load_config()
-                    from .download_media import upload_file_with_retry
-                    
-                    # 在上传之前，先检查是否为视频并生成缩略图
-                    video_thumb_info = None
-                    ext = fp.suffix.lower()
-                    
-                    if ext in ['.mp4', '.mkv', '.mov', '.webm', '.avi']:
-                        print(f"Pre-generating thumbnail for video before upload: {name}")
-                        try:
-                            import subprocess
-                            from PIL import Image
-                            
-                            thumb_path = fp.with_suffix('.jpg')
-                            
-                            # 使用ffmpeg生成缩略图
-                            ffmpeg_cmd = [
-                                'ffmpeg', '-i', str(fp), '-ss', '00:00:01.000', 
-                                '-vframes', '1', '-y', str(thumb_path)
-                            ]
-                            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-                            
-                            if thumb_path.exists() and thumb_path.stat().st_size > 0:
-                                print(f"Generated thumbnail before upload: {thumb_path}")
-                                
-                                # 获取缩略图尺寸
-                                try:
-                                    img = Image.open(thumb_path)
-                                    thumb_width, thumb_height = img.size
-                                    print(f"Pre-upload thumbnail size: {thumb_width}x{thumb_height}")
-                                    
-                                    # 上传缩略图
-                                    thumb_upload_result = upload_file_with_retry(str(thumb_path), cfg)
-                                    thumb_url = None
-                                    if isinstance(thumb_upload_result, dict) and 'url' in thumb_upload_result:
-                                        thumb_url = thumb_upload_result['url']
-                                    elif isinstance(thumb_upload_result, str):
-                                        thumb_url = thumb_upload_result
-                                    
-                                    if thumb_url:
-                                        video_thumb_info = {
-                                            'thumb_url': thumb_url,
-                                            'thumb_width': thumb_width,
-                                            'thumb_height': thumb_height
-                                        }
-                                        print(f"Pre-uploaded thumbnail: {thumb_url}")
-                                    
-                                    # 清理本地缩略图文件
-                                    try:
-                                        thumb_path.unlink()
-                                    except:
-                                        pass
-                                except Exception as e:
-                                    print(f"Failed to get thumbnail size: {e}")
-                            else:
-                                print(f"Failed to generate thumbnail before upload for {name}")
-                        except Exception as e:
-                            print(f"Error generating thumbnail before upload for {name}: {e}")
-                    
-                    # 现在进行视频上传
-                    upload_result = upload_file_with_retry(str(fp), cfg)
-                    
-                    # 处理上传返回结果，确保结构正确
-                    if isinstance(upload_result, list):
-                        # 分片视频，使用预生成的缩略图信息
-                        for idx, item in enumerate(upload_result):
-                            if isinstance(item, dict) and 'url' in item:
-                                # download_media.py 返回的是包含完整参数的 dict
-                                info = {
-                                    'mime_type': item.get('mime_type', 'video/mp4'),
-                                    'date': getattr(m, 'date', None),
-                                    'width': video_thumb_info['thumb_width'] if video_thumb_info else item.get('width'),  # 使用预生成的缩略图尺寸
-                                    'height': video_thumb_info['thumb_height'] if video_thumb_info else item.get('height'),
-                                    'duration': item.get('duration', 0),
-                                    'media_type': 'video',
-                                    'original_name': item.get('original_name', name),
-                                    'url': item['url'],  # 外链
-                                    'size': item.get('size'),
-                                    'thumb': video_thumb_info['thumb_url'] if video_thumb_info else None  # 使用预生成的缩略图
-                                }
-                                
-                                media_files.append(info)
-                    elif isinstance(upload_result, dict) and 'url' in upload_result:
-                        # 单文件上传，download_media.py 返回包含完整参数的 dict
-                        ext = Path(str(upload_result['url'])).suffix.lower()
-                        
-                        info = {
-                            'date': getattr(m, 'date', None),
-                            'original_name': upload_result.get('original_name', name),
-                            'url': upload_result['url'],  # 外链
-                            'size': upload_result.get('size')
-                        }
-                        
-                        if ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.ico']:
-                            # 图片 - 缩略图直接使用图片本身的URL
-                            info.update({
-                                'width': upload_result.get('width'),
-                                'height': upload_result.get('height'),
-                                'media_type': 'photo',
-                                'thumb': upload_result['url'],  # 缩略图直接使用图片本身的URL
-                                'mime_type': 'image/jpeg'
-                            })
-                        elif ext in ['.mp4', '.mkv', '.mov', '.webm', '.avi']:
-                            # 视频 - 使用预生成的缩略图信息
-                            info.update({
-                                'mime_type': 'video/mp4',
-                                'width': video_thumb_info['thumb_width'] if video_thumb_info else upload_result.get('width'),  # 使用预生成的缩略图尺寸
-                                'height': video_thumb_info['thumb_height'] if video_thumb_info else upload_result.get('height'),
-                                'duration': upload_result.get('duration', 0),
-                                'media_type': 'video',
-                                'thumb': video_thumb_info['thumb_url'] if video_thumb_info else None  # 使用预生成的缩略图
-                            })
-                        elif ext in ['.mp3', '.ogg', '.wav', '.aac', '.flac', '.m4a', '.wma']:
-                            # 音频
-                            info.update({
-                                'mime_type': 'audio/mpeg',
-                                'duration': upload_result.get('duration', 0),
-                                'media_type': 'audio',
-                                'thumb': None
-                            })
-                        else:
-                            # 其他文件
-                            info.update({
-                                'mime_type': 'application/octet-stream',
-                                'media_type': 'file',
-                                'thumb': None
-                            })
-                        
-                        media_files.append(info)
-                    elif upload_result:
-                        # 旧格式兼容：直接是外链字符串
-                        ext = Path(str(upload_result)).suffix.lower()
-                        info = {
-                            'date': getattr(m, 'date', None),
-                            'original_name': name,
-                            'url': upload_result,  # 外链
-                            'size': fp.stat().st_size if fp.exists() else None
-                        }
-                        
-                        if ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.ico']:
-                            # 图片
-                            try:
-                                from PIL import Image
-                                img = Image.open(fp)
-                                info['width'], info['height'] = img.size
-                            except Exception:
-                                pass
-                            info.update({
-                                'media_type': 'photo',
-                                'thumb': upload_result + '_thumb.jpg',
-                                'mime_type': 'image/jpeg'
-                            })
-                        elif ext in ['.mp4', '.mkv', '.mov', '.webm', '.avi']:
-                            # 视频
-                            try:
-                                import subprocess, json as _json
-                                ffprobe_cmd = [
-                                    'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-                                    '-show_entries', 'stream=width,height,duration',
-                                    '-of', 'json', str(fp)
-                                ]
-                                result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
-                                meta = _json.loads(result.stdout)
-                                stream = meta.get('streams', [{}])[0]
-                                info['width'] = stream.get('width')
-                                info['height'] = stream.get('height')
-                                info['duration'] = int(float(stream.get('duration', 0)))
-                            except Exception:
-                                pass
-                            info.update({
-                                'mime_type': 'video/mp4',
-                                'media_type': 'video',
-                                'thumb': video_thumb_info['thumb_url'] if video_thumb_info else None,
-                                'width': video_thumb_info['thumb_width'] if video_thumb_info else info.get('width'),
-                                'height': video_thumb_info['thumb_height'] if video_thumb_info else info.get('height')
-                            })
-                        elif ext in ['.mp3', '.ogg', '.wav', '.aac', '.flac', '.m4a', '.wma']:
-                            # 音频
-                            try:
-                                import subprocess, json as _json
-                                ffprobe_cmd = [
-                                    'ffprobe', '-v', 'error', '-select_streams', 'a:0',
-                                    '-show_entries', 'stream=duration',
-                                    '-of', 'json', str(fp)
-                                ]
-                                result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
-                                meta = _json.loads(result.stdout)
-                                stream = meta.get('streams', [{}])[0]
-                                info['duration'] = int(float(stream.get('duration', 0)))
-                            except Exception:
-                                pass
-                            info.update({
-                                'mime_type': 'audio/mpeg',
-                                'media_type': 'audio',
-                                'thumb': None
-                            })
-                        else:
-                            # 其他文件
-                            info.update({
-                                'mime_type': 'application/octet-stream',
-                                'media_type': 'file',
-                                'thumb': None
-                            })
-                        
-                        media_files.append(info)
+            if m.id in decisions:
+                if deferred and decisions[m.id].action != 'skip':
+                    media_jobs.setdefault(post_id, []).append(m)
+                    media_files.append(pending_media(m))
+                elif deferred:
+                    MediaPolicy.report(m, decisions[m.id])
+                else:
+                    media_files += await process_media(client, m, path, post_id, export)
             if not caption and (getattr(m, 'message', None) or getattr(m, 'text', None)):
                 caption = effective_text(m)
         # 取该组所有消息的最早日期作为贴文日期
         group_dates = [getattr(m, 'date', None) for m in group if getattr(m, 'date', None)]
         post_date = min(group_dates) if group_dates else None
-        # 分离图片和其他文件，匹配参考格式
-        images = []
-        files = []
-        
-        for m in media_files:
-            if m.get('media_type') == 'photo':
-                # 图片格式 - 精简字段，匹配参考格式
-                image_info = {
-                    'width': m.get('width'),
-                    'height': m.get('height'),
-                    'date': m.get('date'),
-                    'media_type': 'photo',
-                    'original_name': m.get('original_name'),
-                    'url': m.get('url'),
-                    'size': m.get('size'),
-                    'thumb': m.get('thumb')
-                }
-                # 移除None值
-                image_info = {k: v for k, v in image_info.items() if v is not None}
-                images.append(image_info)
-            else:
-                # 视频/文件格式 - 匹配参考格式
-                file_info = {}
-                
-                # 基础尺寸信息（如果存在）
-                if m.get('width'):
-                    file_info['width'] = m['width']
-                if m.get('height'):
-                    file_info['height'] = m['height']
-                if m.get('duration'):
-                    file_info['duration'] = m['duration']
-                
-                # 视频特定字段
-                if m.get('media_type') == 'video':
-                    file_info['file_name'] = m.get('original_name')  # 使用file_name而不是original_name
-                    file_info['mime_type'] = 'video/mp4'
-                    file_info['supports_streaming'] = True
-                    file_info['media_type'] = 'video_file'  # 匹配参考格式
-                else:
-                    # 其他文件类型
-                    file_info['file_name'] = m.get('original_name')
-                    file_info['mime_type'] = m.get('mime_type', 'application/octet-stream')
-                
-                # 通用字段
-                file_info.update({
-                    'date': m.get('date'),
-                    'original_name': m.get('original_name'),
-                    'url': m.get('url'),
-                    'size': m.get('size')
-                })
-                
-                # 缩略图（仅当存在时）
-                if m.get('thumb'):
-                    file_info['thumb'] = m['thumb']
-                    
-                # 移除None值
-                file_info = {k: v for k, v in file_info.items() if v is not None}
-                files.append(file_info)
-
+        images, files = split_media(media_files)
+        if post_id in media_jobs:
+            for item in images + files:
+                item['pending'] = True
+
+        post = {'id': post_id, 'media_group_id': gid}
+        # 记录相册的所有消息ID，刷新时据此检测编辑和删除
+        if getattr(group[0], 'grouped_id', None):
+            post['msg_ids'] = sorted(m.id for m in group)
         results.append({
-            'id': post_id,
-            'media_group_id': gid,
+            **post,
             'date': post_date,
             'text': caption,
             'images': images,  # 图片数组，参数扁平化
@@ -646,7 +746,7 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
     
     # 显示即将检查的贴文ID范围
     if results:
-        result_ids = [int(post.get('id', 0)) for post in results]
+        result_ids = [post['id'] for post in results]
         result_min_id = min(result_ids)
         result_max_id = max(result_ids)
         print(f"Checking {original_count} results with ID range: {result_min_id} - {result_max_id}")
@@ -657,7 +757,7 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
     results = []
     
     for post in results_before_dedup:
-        post_id = int(post.get('id', 0))
+        post_id = post['id']
         if post_id not in original_existing_ids:
             results.append(post)
         else:
@@ -674,106 +774,80 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
             print(f"All {original_count} processed posts were already in existing range {existing_min_id}-{existing_max_id}")
         else:
             print(f"All {original_count} processed posts were already processed before")
+        if refreshed:
+            save_posts(path, export, on_merge(old_posts) if on_merge else old_posts)
+        save_scanned(path, lowest_id, last_id)
         return
     
     print(f"Final result: {len(results)} new posts to add (from {original_count} processed)")
 
+    metrics.count('posts_new', len(results))
+
+    queued = [r['id'] for r in results if r['id'] in media_jobs]
+    for post_id in queued:
+        enqueue(path, post_id, media_jobs[post_id])
+    if queued:
+        print(f"Queued media of {len(queued)} posts, run `tgc media` to process them")
+
     # 兼容原有 emoji 下载和分组
     await download_custom_emojis(msgs, results, path, client)
 
-    # 智能插入逻辑：根据ID范围决定插入位置和排序
-    from datetime import datetime
-    
-    # 统一时间格式处理
-    def format_date(date_obj):
-        """统一时间格式为ISO字符串"""
-        if isinstance(date_obj, datetime):
-            return date_obj.isoformat()
-        elif isinstance(date_obj, str):
-            return date_obj
-        return None
-    
-    # 格式化所有结果的时间
-    for post in results:
-        if post.get('date'):
-            post['date'] = format_date(post['date'])
-        # 格式化媒体文件的时间
-        for img in post.get('images', []):
-            if img.get('date'):
-                img['date'] = format_date(img['date'])
-        for file in post.get('files', []):
-            if file.get('date'):
-                file['date'] = format_date(file['date'])
-    
-    # 格式化旧贴文的时间
-    for post in old_posts:
-        if post.get('date'):
-            post['date'] = format_date(post['date'])
-        for img in post.get('images', []):
-            if img.get('date'):
-                img['date'] = format_date(img['date'])
-        for file in post.get('files', []):
-            if file.get('date'):
-                file['date'] = format_date(file['date'])
-    
-    # 去重：移除已存在的ID
-    new_ids = set(int(post.get('id', 0)) for post in results)
-    old_posts = [post for post in old_posts if int(post.get('id', 0)) not in new_ids]
-    
-    if not results:
-        merged_posts = old_posts
-    elif not old_posts:
-        # 如果没有旧贴文，直接按ID从小到大排序
-        merged_posts = sorted(results, key=lambda x: int(x.get('id', 0)))
-    else:
-        # 计算ID范围
-        new_min_id = min(int(post.get('id', 0)) for post in results)
-        new_max_id = max(int(post.get('id', 0)) for post in results)
-        old_min_id = min(int(post.get('id', 0)) for post in old_posts)
-        old_max_id = max(int(post.get('id', 0)) for post in old_posts)
-        
-        print(f"新贴文ID范围: {new_min_id} - {new_max_id}")
-        print(f"现有贴文ID范围: {old_min_id} - {old_max_id}")
-        
-        if new_min_id > old_max_id:
-            # 新贴文ID都比现有最大ID大 → 插入到最下面，按从小到大排序
-            print("→ 新贴文插入到底部，按ID从小到大排序")
-            sorted_new = sorted(results, key=lambda x: int(x.get('id', 0)))
-            merged_posts = old_posts + sorted_new
-        elif new_max_id < old_min_id:
-            # 新贴文ID都比现有最小ID小 → 插入到最上面，按从小到大排序
-            print("→ 新贴文插入到顶部，按ID从小到大排序")
-            sorted_new = sorted(results, key=lambda x: int(x.get('id', 0)))
-            merged_posts = sorted_new + old_posts
-        else:
-            # 有重叠或混合情况 → 全部合并后按ID从小到大排序
-            print("→ ID范围有重叠，全部重新排序（ID从小到大）")
-            merged_posts = sorted(results + old_posts, key=lambda x: int(x.get('id', 0)))
+    # 转换为紧凑的 Post 模型（同时把 datetime 统一格式化为 ISO 字符串），旧贴文无需再格式化
+    new_posts = as_posts(results)
+    if old_posts:
+        print(f"新贴文ID范围: {min(p.id for p in new_posts)} - {max(p.id for p in new_posts)}")
+        print(f"现有贴文ID范围: {old_posts[0].id} - {old_posts[-1].id}")
+
+    # 合并：同 ID 以新贴文为准，结果按 ID 从小到大排序（新贴文都更新时直接追加到底部）
+    merged_posts = merge_posts(old_posts, new_posts)
+    if on_merge:
+        merged_posts = on_merge(merged_posts)
+    save_posts(path, export, merged_posts)
+    # 贴文保存后再记录扫描范围，中断的运行会重新扫描
+    save_scanned(path, lowest_id, last_id)
+
+
+def save_posts(path: Path, export: dict, merged_posts: list[Post]):
+    """
+    Write posts.json and every output derived from it (pages, index.html, feeds, sitemap, robots.txt
+    and pre-compressed files)
+
+    :param path: Export path
+    :param export: Export config
+    :param merged_posts: All posts of the export, sorted by id
+    """
+    merged_dicts = to_dicts(merged_posts)
+
     # 保存所有格式的文件，使用统一的智能插入逻辑
-    write(posts_path, json_stringify(merged_posts, indent=2))
-    # 生成 index.html 但不写入数据（使用空数组）
-    write(path / "index.html", HTML.replace("$$POSTS_DATA$$", "[]"))
+    # 开启预压缩时写紧凑 JSON（缩进会让体积翻倍）
+    with metrics.stage('write_posts'):
+        codec.write_json(path / "posts.json", merged_dicts, indent=not export.get('compress'))
+        upload_journal.get(path).commit()
+        # 分页输出：只重写内容有变化的页（通常只有最新一页）和索引
+        if export.get('page_size'):
+            write_pages(path, merged_dicts, int(export['page_size']))
+        # 生成 index.html 但不写入数据（使用空数组）
+        write(path / "index.html", load_html().replace("$$POSTS_DATA$$", "[]"))
+    metrics.gauge('posts_total', len(merged_posts))
     
     # 同样的数据和排序逻辑应用到所有输出格式
     if 'rss' in export:
-        print("Exporting RSS feed with same post order...")
-        # 确保RSS使用相同的贴文顺序
+        print("Exporting RSS feed, XML sitemap and robots.txt with same post order...")
+        # 确保RSS使用相同的贴文顺序，并从RSS配置自动生成站点地图；一次遍历生成全部，未变化的文件不重写
         rss_meta = FeedMeta(**export['rss'])
-        posts_to_feed(path, rss_meta, posts_data=merged_posts)
-        
-        # 自动从RSS配置生成站点地图
-        print("Auto-generating XML sitemap from RSS configuration...")
-        from tgc.rss.posts_to_feed import posts_to_sitemap_from_rss, generate_robots_txt
-        
-        posts_to_sitemap_from_rss(path, rss_meta, posts_data=merged_posts)
-        
-        # 生成robots.txt
-        sitemap_url = f"{rss_meta.link.rstrip('/')}/sitemap.xml"
-        generate_robots_txt(path, rss_meta.link, sitemap_url)
+        with metrics.stage('artifacts'):
+            build_artifacts(path, merged_posts, feed=rss_meta, sitemap=SitemapMeta(base_url=rss_meta.link), robots=True)
+
+    # 为所有输出生成 .gz（以及可选的 .zst）预压缩文件，只重新压缩内容有变化的文件
+    if export.get('compress'):
+        with metrics.stage('precompress'):
+            precompress(path, zstd=export['compress'] == 'zstd')
 
     printc(f"&aDone! Saved {len(merged_posts)} posts to:")
     printc(f"  - {path / 'posts.json'}")
     printc(f"  - {path / 'index.html'} (without data)")
+    if export.get('page_size'):
+        printc(f"  - {path / 'posts' / 'index.json'} (pages of {export['page_size']} posts)")
     if 'rss' in export:
         printc(f"  - {path / 'rss.xml'}")
         printc(f"  - {path / 'atom.xml'}")
@@ -781,26 +855,44 @@ async def process_chat(chat_id_input, path: Path, export: dict, client):
         printc(f"  - {path / 'robots.txt'}")
 
 
-async def run_app(client, cfg):
+async def run_app(client, cfg, profiler: profiling.Profiler | None = None):
     me: User = await client.get_me()
     printc(f"&aLogin success! ID: {me.id}")
     for export in cfg.exports:
-        await process_chat(export["chat_id"], Path(export["path"]), export, client)
+        name = str(export.get('name') or export['chat_id'])
+        with profiler.section(name) if profiler else nullcontext():
+            await process_chat(export["chat_id"], Path(export["path"]), export, client)
 
 
 
 
 
 def main():
+    import sys
+    if sys.argv[1:2] == ['watch']:
+        from .watch import main as watch_main
+        return watch_main(sys.argv[2:])
+    if sys.argv[1:2] == ['media']:
+        from .media_queue import main as media_main
+        return media_main(sys.argv[2:])
+    if sys.argv[1:2] == ['views']:
+        from .timeseries import main as views_main
+        return views_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser("Telegram Channel Message to Public API Crawler")
     parser.add_argument("config", help="Config path", nargs="?", default="config.toml")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiler = profiling.from_args(args)
 
     from tgc.pyro.config import get_telegram_client, load_config
     client = get_telegram_client(args.config)
     cfg = load_config(args.config)
     client.start()
-    asyncio.get_event_loop().run_until_complete(run_app(client, cfg))
+    loop = asyncio.get_event_loop()
+    if profiler:
+        profiler.install(loop)
+    loop.run_until_complete(run_app(client, cfg, profiler))
 
 def run():
     main()
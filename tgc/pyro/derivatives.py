@@ -0,0 +1,144 @@
+"""
+Responsive image derivatives (thumb_widths)
+
+With `thumb_widths` set on an export (e.g. [320, 640, 1280]), every photo gets WebP derivatives at
+those widths, so the timeline can load a preview sized for the screen (`srcset`) instead of the
+full-resolution original. Photos are never upscaled: widths at or above the photo's own width are
+replaced by one derivative at its native width.
+
+Derivatives are rendered with Pillow in a process pool, and cached by the SHA-256 of the source in
+a cache shared by all exports ($tgc_cache_dir/thumbs, by default ~/.cache/tgc/thumbs), so the same
+photo is only rendered once. They are then stored next to the original with the export's storage
+backend, and recorded on the image as `thumbs` ([{width, height, url}], narrowest first). `thumb`
+points to the narrowest derivative at least PREVIEW_WIDTH wide.
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .. import codec
+from . import metrics
+
+QUALITY = 80
+PREVIEW_WIDTH = 640
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def cache_dir() -> Path:
+    return Path(os.getenv('tgc_cache_dir') or Path.home() / ".cache" / "tgc") / "thumbs"
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor()
+    return _pool
+
+
+def render(src: str, widths: list[int], out: str, quality: int) -> list[tuple[int, int, str]]:
+    """
+    Render WebP derivatives of an image (runs in the process pool)
+
+    :param src: Source image
+    :param widths: Requested widths
+    :param out: Output directory
+    :param quality: WebP quality
+    :return: (width, height, file name) of each derivative, narrowest first
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if im.mode in ('P', 'LA', 'PA') else 'RGB')
+        sizes = sorted({w for w in widths if w < im.width} | ({im.width} if max(widths) >= im.width else set()))
+        results = []
+        for w in sizes:
+            h = max(1, round(im.height * w / im.width))
+            img = im if w == im.width else im.resize((w, h), Image.LANCZOS)
+            name = f"{w}w.webp"
+            tmp = Path(out) / f"{name}.tmp"
+            img.save(tmp, 'WEBP', quality=quality, method=4)
+            os.replace(tmp, Path(out) / name)
+            results.append((w, h, name))
+        return results
+
+
+def file_hash(fp: Path) -> str:
+    h = hashlib.sha256()
+    with open(fp, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def cached_render(fp: Path, widths: list[int], quality: int) -> tuple[Path, list[tuple[int, int, str]]]:
+    """
+    Derivatives of an image from the cache, rendered first if missing
+
+    :return: Cache directory of the image, and (width, height, file name) of each derivative
+    """
+    h = await asyncio.to_thread(file_hash, fp)
+    d = cache_dir() / h[:2] / h
+    index = d / "index.json"
+    if index.is_file():
+        cached = codec.read(index)
+        if cached['widths'] == widths and cached['quality'] == quality \
+                and all((d / name).is_file() for _, _, name in cached['sizes']):
+            metrics.cache('thumbs', True)
+            return d, [tuple(s) for s in cached['sizes']]
+    metrics.cache('thumbs', False)
+
+    d.mkdir(parents=True, exist_ok=True)
+    with metrics.stage('derivatives'):
+        sizes = await asyncio.get_running_loop().run_in_executor(get_pool(), render, str(fp), widths, str(d), quality)
+    codec.write_json(index, {'widths': widths, 'quality': quality, 'sizes': sizes})
+    return d, sizes
+
+
+async def derive(fp: Path, journal, store, export: dict) -> tuple[list[dict], list[Path]]:
+    """
+    Create and store the derivatives of a photo
+
+    :param fp: Downloaded photo (in the post's directory of the export)
+    :param journal: Upload journal of the export
+    :param store: Storage backend of the export
+    :param export: Export config (thumb_widths, thumb_quality)
+    :return: Derivatives ({width, height, url}, narrowest first), and the local files created
+    """
+    widths = sorted(int(w) for w in export.get('thumb_widths') or [])
+    if not widths:
+        return [], []
+    try:
+        d, sizes = await cached_render(fp, widths, int(export.get('thumb_quality') or QUALITY))
+    except Exception as e:
+        print(f"Failed to create thumbnails of {fp.name}: {e}")
+        return [], []
+
+    files = []
+    for w, h, name in sizes:
+        dst = fp.with_name(f"{fp.stem}.{name}")
+        if not dst.exists():
+            try:
+                os.link(d / name, dst)
+            except OSError:
+                shutil.copy2(d / name, dst)
+        files.append(dst)
+
+    results = await journal.upload_many(files, store)
+    thumbs = [{'width': w, 'height': h, 'url': r['url']}
+              for (w, h, _), r in zip(sizes, results) if isinstance(r, dict) and r.get('url')]
+    return thumbs, files
+
+
+def preview(thumbs: list[dict]) -> str | None:
+    """
+    :return: URL of the narrowest derivative at least PREVIEW_WIDTH wide (or the widest one)
+    """
+    if not thumbs:
+        return None
+    return next((t['url'] for t in thumbs if t['width'] >= PREVIEW_WIDTH), thumbs[-1]['url'])
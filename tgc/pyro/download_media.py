@@ -1,19 +1,56 @@
-import requests
+import mimetypes
 import time
 import os
 import asyncio
 import shutil
 from tempfile import TemporaryDirectory
+from functools import lru_cache
 from telethon.sync import TelegramClient
-from telethon.tl.types import Message
+from telethon.tl.types import Document, Message
 from pathlib import Path
 from typing import Optional, Dict
 from hypy_utils import ensure_dir, md5
 from hypy_utils.file_utils import escape_filename
+from .. import codec
+from . import metrics
 from telethon.errors import FloodWaitError
 
+# 每次下载前的随机延迟（秒），避免被 Telegram 限速或封号
+DOWNLOAD_DELAY = (0.5, 2.0)
+
+
+def probe_info(local_path: str) -> dict:
+    """
+    Media info of a local file before it is stored (dimensions and duration from ffprobe)
+    """
+    ext = Path(local_path).suffix.lower()
+    info = {'original_name': os.path.basename(local_path)}
+    import subprocess
+    try:
+        ffprobe_cmd = [
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'stream=width,height,duration',
+            '-of', 'json', local_path
+        ]
+        with metrics.stage('ffprobe'):
+            result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
+        meta = codec.loads(result.stdout)
+        stream = meta.get('streams', [{}])[0]
+        info['width'] = stream.get('width')
+        info['height'] = stream.get('height')
+        info['duration'] = int(float(stream.get('duration', 0)))
+    except Exception:
+        pass
+    info['mime_type'] = 'video/mp4' if ext in ['.mp4', '.mkv', '.mov', '.webm', '.avi'] else None
+    info['size'] = os.path.getsize(local_path) if os.path.exists(local_path) else None
+    thumb_path = local_path.replace('.mp4', '_thumb.jpg')
+    if thumb_path != local_path and os.path.exists(thumb_path):
+        info['thumb'] = thumb_path
+    return info
+
+
 # 上传本地文件到远程，失败重试3次，返回外链并删除本地文件
-def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
+def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3, keep_local=False):
     url = getattr(cfg, 'upload_url', None)
     auth_code = getattr(cfg, 'upload_auth_code', None)
     base_url = getattr(cfg, 'image_base_url', None)
@@ -33,13 +70,14 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
         upload_folder = 'doc'
     else:
         upload_folder = 'other'
+    import requests
     file_size = os.path.getsize(local_path)
     chunk_size = 20 * 1024 * 1024  # 20MB
     is_video = ext in ['.mp4', '.mkv', '.mov', '.webm', '.avi']
     if is_video and file_size > chunk_size:
         # 仅视频分片上传，分片前识别参数
         part_infos = []
-        import subprocess, json as _json
+        import subprocess
         with open(local_path, 'rb') as f:
             part_num = 0
             while True:
@@ -60,8 +98,9 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
                         '-show_entries', 'stream=width,height,duration',
                         '-of', 'json', part_path
                     ]
-                    result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
-                    meta = _json.loads(result.stdout)
+                    with metrics.stage('ffprobe'):
+                        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
+                    meta = codec.loads(result.stdout)
                     stream = meta.get('streams', [{}])[0]
                     info['width'] = stream.get('width')
                     info['height'] = stream.get('height')
@@ -87,7 +126,10 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
                             'uploadFolder': upload_folder,
                         }
                         print(f"  上传参数")
-                        resp = requests.post(url, files=files, params=data, timeout=60)
+                        if attempt:
+                            metrics.count('upload_retries')
+                        with metrics.stage('upload'):
+                            resp = requests.post(url, files=files, params=data, timeout=60)
                         files['file'].close()
                         print(f"  响应状态码: {resp.status_code}")
                         print(f"  响应内容")
@@ -96,11 +138,13 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
                             if isinstance(j, list) and j and 'src' in j[0]:
                                 remote_path = base_url + j[0]['src']
                                 print(f"  分片上传成功")
+                                metrics.count('bytes_uploaded', len(chunk))
                                 info['url'] = remote_path
                                 part_infos.append(info)
                                 break
                             elif isinstance(j, dict) and 'data' in j and j['data'] and 'src' in j['data'][0]:
                                 remote_path = base_url + j['data'][0]['src']
+                                metrics.count('bytes_uploaded', len(chunk))
                                 info['url'] = remote_path
                                 part_infos.append(info)
                                 break
@@ -111,33 +155,16 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
                     except Exception as e:
                         print(f"[分片上传] 第{attempt+1}次失败: {e}")
                         time.sleep(2)
+                else:
+                    metrics.count('upload_failures')
                 os.remove(part_path)
-        os.remove(local_path)
+        if not keep_local:
+            os.remove(local_path)
         print(f"[分片上传]")
         return part_infos if part_infos else None
     else:
         # 其他类型或小视频，上传前识别参数
-        info = {'original_name': os.path.basename(local_path)}
-        import subprocess, json as _json
-        try:
-            ffprobe_cmd = [
-                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-                '-show_entries', 'stream=width,height,duration',
-                '-of', 'json', local_path
-            ]
-            result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
-            meta = _json.loads(result.stdout)
-            stream = meta.get('streams', [{}])[0]
-            info['width'] = stream.get('width')
-            info['height'] = stream.get('height')
-            info['duration'] = int(float(stream.get('duration', 0)))
-        except Exception:
-            pass
-        info['mime_type'] = 'video/mp4' if ext in ['.mp4', '.mkv', '.mov', '.webm', '.avi'] else None
-        info['size'] = os.path.getsize(local_path) if os.path.exists(local_path) else None
-        thumb_path = local_path.replace('.mp4', '_thumb.jpg')
-        if os.path.exists(thumb_path):
-            info['thumb'] = thumb_path
+        info = probe_info(local_path)
         for attempt in range(max_retry):
             try:
                 print(f"[上传] 尝试第{attempt+1}次：")
@@ -156,7 +183,10 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
                     'uploadFolder': upload_folder,
                 }
                 print(f"  上传参数")
-                resp = requests.post(url, files=files, params=data, timeout=30)
+                if attempt:
+                    metrics.count('upload_retries')
+                with metrics.stage('upload'):
+                    resp = requests.post(url, files=files, params=data, timeout=30)
                 files['file'].close()
                 print(f"  响应状态码: {resp.status_code}")
                 print(f"  响应内容")
@@ -165,14 +195,18 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
                     if isinstance(j, list) and j and 'src' in j[0]:
                         remote_path = base_url + j[0]['src']
                         print(f"  上传成功，外链")
+                        metrics.count('bytes_uploaded', file_size)
                         info['url'] = remote_path
-                        os.remove(local_path)
+                        if not keep_local:
+                            os.remove(local_path)
                         return info
                     elif isinstance(j, dict) and 'data' in j and j['data'] and 'src' in j['data'][0]:
                         remote_path = base_url + j['data'][0]['src']
                         print(f"  上传成功，外链")
+                        metrics.count('bytes_uploaded', file_size)
                         info['url'] = remote_path
-                        os.remove(local_path)
+                        if not keep_local:
+                            os.remove(local_path)
                         return info
                     else:
                         print(f"[上传] 响应无 src 字段: {j}")
@@ -182,6 +216,7 @@ def upload_file_with_retry(local_path, cfg, upload_folder=None, max_retry=3):
                 print(f"[上传] 第{attempt+1}次失败: {e}")
                 time.sleep(2)
         print(f"[上传] 文件 {local_path} 上传失败，已重试{max_retry}次")
+        metrics.count('upload_failures')
         return None
 
 def get_file_name(client: TelegramClient, message: Message) -> str:
@@ -201,98 +236,152 @@ def get_file_name(client: TelegramClient, message: Message) -> str:
     # 兜底 file_name
     if not file_name:
         file_name = getattr(media, 'file_name', None)
-    ext = guess_ext(client, mime_type, file_name)
+    ext = resolve_ext(media, mime_type, file_name)
     if file_name:
         file_name = escape_filename(Path(file_name).stem + ext)
     else:
         file_name = escape_filename(f"media_{getattr(message, 'id', '')}{ext}")
     return file_name
 
-def guess_ext(client: TelegramClient, mime_type: Optional[str], file_name: Optional[str] = None) -> str:
-    # 优先用文件名后缀
-    if file_name:
-        ext = Path(file_name).suffix
-        if ext and len(ext) <= 8:
-            return ext
-    # 常见 mime_type 映射表
-    mime_map = {
-        'image/jpeg': '.jpg',
-        'image/png': '.png',
-        'image/gif': '.gif',
-        'image/webp': '.webp',
-        'image/bmp': '.bmp',
-        'image/tiff': '.tif',
-        'image/x-icon': '.ico',
-        'video/mp4': '.mp4',
-        'video/x-matroska': '.mkv',
-        'video/quicktime': '.mov',
-        'video/webm': '.webm',
-        'video/x-msvideo': '.avi',
-        'audio/mpeg': '.mp3',
-        'audio/ogg': '.ogg',
-        'audio/wav': '.wav',
-        'audio/aac': '.aac',
-        'audio/flac': '.flac',
-        'audio/mp4': '.m4a',
-        'audio/x-ms-wma': '.wma',
-        'application/pdf': '.pdf',
-        'application/zip': '.zip',
-        'application/x-tgsticker': '.tgs',
-        'application/msword': '.doc',
-        'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
-        'application/vnd.ms-excel': '.xls',
-        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
-        'application/vnd.ms-powerpoint': '.ppt',
-        'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
-        'text/plain': '.txt',
-        'text/html': '.html',
-        'application/x-rar-compressed': '.rar',
-        'application/x-7z-compressed': '.7z',
-        'application/x-tar': '.tar',
-        'application/x-bzip2': '.bz2',
-        'application/x-gzip': '.gz',
-    }
-    if mime_type and mime_type in mime_map:
-        return mime_map[mime_type]
-    # 优先判断 media 类型
-    import inspect
-    frame = inspect.currentframe()
-    outer_frames = inspect.getouterframes(frame)
-    media_obj = None
-    for f in outer_frames:
-        if 'media' in f.frame.f_locals:
-            media_obj = f.frame.f_locals['media']
-            break
-    # Telegram 图片消息
-    if media_obj and (media_obj.__class__.__name__ == 'MessageMediaPhoto' or media_obj.__class__.__name__ == 'Photo'):
+# 常见 mime_type 到扩展名的映射（优先于 mimetypes，保证结果稳定）
+MIME_EXTS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/bmp': '.bmp',
+    'image/tiff': '.tif',
+    'image/x-icon': '.ico',
+    'video/mp4': '.mp4',
+    'video/x-matroska': '.mkv',
+    'video/quicktime': '.mov',
+    'video/webm': '.webm',
+    'video/x-msvideo': '.avi',
+    'audio/mpeg': '.mp3',
+    'audio/ogg': '.ogg',
+    'audio/wav': '.wav',
+    'audio/aac': '.aac',
+    'audio/flac': '.flac',
+    'audio/mp4': '.m4a',
+    'audio/x-ms-wma': '.wma',
+    'application/pdf': '.pdf',
+    'application/zip': '.zip',
+    'application/x-tgsticker': '.tgs',
+    'application/msword': '.doc',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/vnd.ms-excel': '.xls',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+    'application/vnd.ms-powerpoint': '.ppt',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': '.pptx',
+    'text/plain': '.txt',
+    'text/html': '.html',
+    'application/x-rar-compressed': '.rar',
+    'application/x-7z-compressed': '.7z',
+    'application/x-tar': '.tar',
+    'application/x-bzip2': '.bz2',
+    'application/x-gzip': '.gz',
+}
+
+# Telegram 图片没有 mime_type
+PHOTO_CLASSES = {'MessageMediaPhoto', 'Photo', 'PhotoSize', 'PhotoCachedSize', 'PhotoStrippedSize',
+                 'PhotoSizeProgressive'}
+
+# mimetypes 也不认识时按大类兜底
+MIME_FAMILY_EXTS = {'image': '.jpg', 'video': '.mp4', 'audio': '.mp3'}
+
+
+def media_mime_type(media) -> Optional[str]:
+    """
+    mime_type of a media object (documents keep it on media.document)
+    """
+    return getattr(media, 'mime_type', None) or getattr(getattr(media, 'document', None), 'mime_type', None)
+
+
+@lru_cache(maxsize=1024)
+def _resolve_ext(mime_type: Optional[str], media_class: Optional[str]) -> Optional[str]:
+    if mime_type in MIME_EXTS:
+        return MIME_EXTS[mime_type]
+    if media_class in PHOTO_CLASSES:
         return '.jpg'
     if mime_type:
-        if mime_type.startswith('image/'):
-            return '.jpg'
-        elif mime_type.startswith('video/'):
-            return '.mp4'
-        elif mime_type.startswith('audio/'):
-            return '.mp3'
+        return mimetypes.guess_extension(mime_type, strict=False) or MIME_FAMILY_EXTS.get(mime_type.split('/')[0])
+    return None
+
+
+@lru_cache(maxsize=256)
+def _report_unknown(mime_type: Optional[str], media_class: Optional[str]):
+    # 每种未识别格式只输出一次，便于后续完善
+    print(f"[未识别格式] mime_type={mime_type} media={media_class}")
+
+
+def resolve_ext(media=None, mime_type: Optional[str] = None, file_name: Optional[str] = None) -> str:
+    """
+    Resolve the file extension of a media file
+
+    Order: the file name's suffix, the mime type (MIME_EXTS, then mimetypes), the media class
+    (photos have no mime type), and '.bin' for unknown types (counted as unknown_media_types).
+
+    :param media: Telethon media object (MessageMediaPhoto, MessageMediaDocument, Document, ...)
+    :param mime_type: Mime type, if not given it is read from the media
+    :param file_name: Original file name
+    """
+    suffix = Path(file_name).suffix if file_name else ''
+    if suffix and len(suffix) <= 8:
+        return suffix
+
+    mime_type = mime_type or media_mime_type(media)
+    media_class = type(media).__name__ if media is not None else None
+    ext = _resolve_ext(mime_type, media_class)
+    if ext:
+        return ext
+
     # 兜底：如果 file_name 有点后缀但太长（如 .bin），只取最后 5 个字符
-    if file_name and '.' in file_name:
-        ext = Path(file_name).suffix
-        if ext and len(ext) > 8:
-            return ext[-5:]
-    # 输出未识别 bin 文件的 message 信息，便于后续完善
-    import inspect
-    frame = inspect.currentframe()
-    outer_frames = inspect.getouterframes(frame)
-    for f in outer_frames:
-        if 'message' in f.frame.f_locals:
-            msg = f.frame.f_locals['message']
-            print(f"[未识别格式] message.id={getattr(msg, 'id', None)} mime_type={mime_type} file_name={file_name} media={getattr(msg, 'media', None)}")
-            break
+    if suffix:
+        return suffix[-5:]
+    metrics.count('unknown_media_types')
+    _report_unknown(mime_type, media_class)
     return '.bin'
 
+
+def guess_ext(client: TelegramClient, mime_type: Optional[str], file_name: Optional[str] = None) -> str:
+    return resolve_ext(mime_type=mime_type, file_name=file_name)
+
+
 def has_media(message: Message) -> Optional[object]:
     # Telethon Message 直接判断 media 字段
     return getattr(message, 'media', None)
 
+
+def media_size(message) -> int:
+    """
+    Size of the media of a message (or of a Document) in bytes, from its metadata
+    """
+    # 文件大小在 media.document.size 上（照片取最大尺寸），message.file 已统一处理
+    if isinstance(message, Document):
+        return message.size or 0
+    f = getattr(message, 'file', None)
+    return (getattr(f, 'size', None) or 0) if f else 0
+
+
+async def download_thumbnail(client: TelegramClient, message: Message, directory: str | Path) -> Optional[Path]:
+    """
+    Download the largest thumbnail of a document (e.g. a video) instead of the document itself
+
+    :return: Path of the thumbnail, None if the document has none
+    """
+    doc = getattr(getattr(message, 'media', None), 'document', None)
+    if not getattr(doc, 'thumbs', None):
+        return None
+    p = ensure_dir(directory) / f"{message.id}_thumb.jpg"
+    if p.exists():
+        return p
+    tmp = p.with_name(p.name + '.download')
+    with metrics.stage('download'):
+        await client.download_media(message, file=tmp, thumb=-1)
+    os.replace(tmp, p)
+    metrics.count('bytes_downloaded', p.stat().st_size)
+    return p
+
 async def download_media(
     client: TelegramClient,
     message: Message,
@@ -303,27 +392,40 @@ async def download_media(
     max_file_size: int = 0
 ) -> Optional[Path]:
     directory = ensure_dir(directory)
-    media = has_media(message)
+    # 自定义表情等直接传入 Document
+    media = message if isinstance(message, Document) else has_media(message)
     if not media:
         return None
-    fsize = getattr(media, 'size', 0)
+    fsize = media_size(message)
     if max_file_size and fsize > max_file_size:
         print(f"Skipped {fname} because of file size limit ({fsize} > {max_file_size})")
+        metrics.count('downloads_skipped')
         return None
     file_name = fname or get_file_name(client, message)
     p = directory / file_name
     if p.exists():
+        metrics.cache('media', True)
         return p
+    metrics.cache('media', False)
     print(f"Downloading {p.name}...")
     try:
         # 下载前适当延迟，避免被 Telegram 限速或封号
         import random
-        await asyncio.sleep(random.uniform(0.5, 2.0))
-        await client.download_media(message, file=p)
+        with metrics.stage('download_delay'):
+            await asyncio.sleep(random.uniform(*DOWNLOAD_DELAY))
+        # 先下载到临时文件，避免中断后残留的半个文件被当作已下载
+        tmp = p.with_name(p.name + '.download')
+        with metrics.stage('download'):
+            await client.download_media(message, file=tmp)
+        os.replace(tmp, p)
+        metrics.count('bytes_downloaded', p.stat().st_size if p.exists() else 0)
         return p
     except FloodWaitError as e:
         print(f"Sleeping for {e.seconds} seconds...")
-        await asyncio.sleep(e.seconds)
+        metrics.count('floodwaits')
+        metrics.count('floodwait_seconds', e.seconds)
+        with metrics.stage('floodwait'):
+            await asyncio.sleep(e.seconds)
         return await download_media(client, message, directory, fname, progress, progress_args, max_file_size)
 
 async def download_media_urlsafe(
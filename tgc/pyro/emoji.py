@@ -0,0 +1,156 @@
+"""
+Custom emoji resolution
+
+Custom emojis are downloaded once into a cache shared by all exports and runs ($tgc_cache_dir/emoji,
+by default ~/.cache/tgc/emoji), keyed by custom_emoji_id. Only ids missing from the cache are
+fetched (with bounded concurrency), and cached files are hard-linked (or copied) into each export's
+emoji directory. The placeholders written by convert_text are then rewritten in a single regex pass
+over each text.
+"""
+import asyncio
+import os
+import re
+import shutil
+from pathlib import Path
+
+from hypy_utils import printc
+from telethon.tl.types import MessageEntityCustomEmoji
+
+from . import metrics
+from .download_media import download_media, resolve_ext
+
+# Written by convert_text for every custom emoji entity
+PLACEHOLDER = re.compile(r'<i class="custom-emoji" emoji-src="emoji/(\d+)">')
+
+# Concurrent emoji downloads
+CONCURRENCY = 4
+
+
+def cache_dir() -> Path:
+    return Path(os.getenv('tgc_cache_dir') or Path.home() / ".cache" / "tgc") / "emoji"
+
+
+class EmojiCache:
+    """
+    Directory of downloaded custom emojis, named <custom_emoji_id><ext>
+
+    :param directory: Cache directory
+    """
+
+    def __init__(self, directory: Path):
+        self.dir = directory
+        self.files: dict[int, str] = {}
+        if directory.is_dir():
+            for name in os.listdir(directory):
+                stem = name.split('.', 1)[0]
+                if stem.isdigit():
+                    self.files[int(stem)] = name
+
+    async def fetch(self, client, ids: list[int]):
+        """
+        Download custom emojis into the cache
+        """
+        from telethon.tl.functions.messages import GetCustomEmojiDocumentsRequest
+
+        docs = []
+        for i in range(0, len(ids), 200):
+            with metrics.stage('emoji'):
+                docs += await client(GetCustomEmojiDocumentsRequest(document_id=ids[i:i + 200]))
+
+        sem = asyncio.Semaphore(CONCURRENCY)
+
+        async def download(doc):
+            # A failed emoji is left out of the cache (and its placeholder unresolved), it's fetched
+            # again by the next run that needs it
+            try:
+                async with sem:
+                    fp = await download_media(client, doc, self.dir, f'{doc.id}{resolve_ext(doc)}')
+            except Exception as e:
+                printc(f"&cFailed to download custom emoji {doc.id}: {e}")
+                metrics.count('emojis_failed')
+                return
+            if fp:
+                self.files[doc.id] = fp.name
+
+        await asyncio.gather(*(download(d) for d in docs))
+
+    def link(self, id: int, directory: Path) -> str | None:
+        """
+        Hard-link (or copy) a cached emoji into a directory
+
+        :return: File name, or None if the emoji isn't cached
+        """
+        name = self.files.get(id)
+        if name is None:
+            return None
+        dst = directory / name
+        if not dst.exists():
+            directory.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(self.dir / name, dst)
+            except OSError:
+                shutil.copy2(self.dir / name, dst)
+        return name
+
+
+_cache: EmojiCache | None = None
+
+
+def get_cache() -> EmojiCache:
+    global _cache
+    if _cache is None:
+        _cache = EmojiCache(cache_dir())
+    return _cache
+
+
+def emoji_ids(msgs) -> set[int]:
+    ids = set()
+    for msg in msgs:
+        for e in getattr(msg, 'entities', None) or []:
+            if isinstance(e, MessageEntityCustomEmoji):
+                ids.add(e.document_id)
+    return ids
+
+
+async def resolve_emojis(msgs, path: Path, client) -> dict[int, str]:
+    """
+    Make the custom emojis of messages available in an export
+
+    :param msgs: Messages
+    :param path: Export path
+    :param client: Telegram client
+    :return: Path of each emoji relative to the export path, by custom_emoji_id
+    """
+    ids = emoji_ids(msgs)
+    if not ids:
+        return {}
+    cache = get_cache()
+    missing = []
+    for i in ids:
+        hit = i in cache.files
+        metrics.cache('emoji', hit)
+        if not hit:
+            missing.append(i)
+    if missing:
+        print(f"Downloading {len(missing)} custom emojis ({len(ids) - len(missing)} cached)...")
+        await cache.fetch(client, missing)
+
+    out = {}
+    for i in ids:
+        if name := cache.link(i, path / "emoji"):
+            out[i] = f"emoji/{name}"
+    return out
+
+
+def replace_emojis(text: str | None, emojis: dict[int, str]) -> str | None:
+    """
+    Point the custom emoji placeholders of a text to the downloaded files
+    """
+    if not text or not emojis or 'custom-emoji' not in text:
+        return text
+
+    def sub(m: re.Match) -> str:
+        src = emojis.get(int(m[1]))
+        return f'<i class="custom-emoji" emoji-src="{src}">' if src else m[0]
+
+    return PLACEHOLDER.sub(sub, text)
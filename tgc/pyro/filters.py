@@ -0,0 +1,204 @@
+"""
+Per-export message filter
+
+Messages are filtered right after each get_messages batch, so filtered messages are never
+downloaded, converted or uploaded, and don't count towards max_posts_per_run:
+
+```toml
+[exports.filter]
+include_hashtags = ["#tech", "#linux"]   # Only posts with one of these hashtags (case-insensitive)
+exclude_hashtags = ["#ad"]
+include_regex = "..."                    # Only posts whose text matches (Python regex, searched)
+exclude_regex = "..."
+service_messages = false                 # Drop service messages (pins, title changes, ...)
+forwards = false                         # Drop all forwarded messages
+exclude_forwarded_from = [-1001234567890, "Some Channel"]   # Drop forwards from these chats (id or name)
+since = "2023-01-01"                     # Only posts in this date range (ISO dates, inclusive)
+until = "2024-12-31T23:59:59"
+media_types = ["photo", "video", "text"] # Only these types (see media_policy), "text" for posts without media
+```
+
+Text rules (hashtags and regexes) apply to whole albums: the caption is on one message of the
+album, so the other messages follow its decision. An album is only decided once all of its
+messages were seen: if it ends a batch, it may continue in the next one (in either direction of
+the crawl), so its messages are held back until a later batch moves past it, or until `flush` at
+the end of the crawl. The number of filtered messages is counted in the run metrics per rule
+(messages_filtered_<rule>).
+"""
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from ..model import parse_ts, parse_until
+from . import metrics
+from .media_policy import media_kind
+
+HASHTAG = re.compile(r'#\w+')
+
+
+def _ts(value, end: bool = False) -> int | None:
+    """
+    Epoch seconds of a since/until value (ISO string, or a TOML date or datetime). Dates without a
+    time mean the start of the day, or its end for `until`.
+    """
+    if value is None:
+        return None
+    if end:
+        return parse_until(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = value.isoformat()
+    return parse_ts(value)
+
+
+@dataclass(slots=True)
+class MessageFilter:
+    include_hashtags: set[str] | None = None
+    exclude_hashtags: set[str] | None = None
+    include_regex: re.Pattern | None = None
+    exclude_regex: re.Pattern | None = None
+    service_messages: bool = True
+    forwards: bool = True
+    exclude_forwarded_from: set[str] | None = None
+    since: int | None = None
+    until: int | None = None
+    media_types: set[str] | None = None
+    # Text decisions of albums seen in this run
+    groups: dict[int, str | None] = field(default_factory=dict)
+    # Messages of albums that may continue in the next batch
+    held: dict[int, list] = field(default_factory=dict)
+
+    @classmethod
+    def from_export(cls, export: dict) -> 'MessageFilter | None':
+        """
+        :return: Filter of an export, None if it has no filter rules
+        """
+        f = export.get('filter')
+        if not f:
+            return None
+
+        def tags(key):
+            return {t.lower() if t.startswith('#') else f"#{t.lower()}" for t in f[key]} if f.get(key) else None
+
+        return cls(include_hashtags=tags('include_hashtags'), exclude_hashtags=tags('exclude_hashtags'),
+                   include_regex=re.compile(f['include_regex']) if f.get('include_regex') else None,
+                   exclude_regex=re.compile(f['exclude_regex']) if f.get('exclude_regex') else None,
+                   service_messages=f.get('service_messages', True), forwards=f.get('forwards', True),
+                   exclude_forwarded_from={str(x) for x in f['exclude_forwarded_from']}
+                   if f.get('exclude_forwarded_from') else None,
+                   since=_ts(f.get('since')), until=_ts(f.get('until'), end=True),
+                   media_types=set(f['media_types']) if f.get('media_types') else None)
+
+    def text_rule(self, text: str) -> str | None:
+        """
+        :return: Name of the text rule that drops this text, None if it is kept
+        """
+        if self.include_hashtags or self.exclude_hashtags:
+            found = {t.lower() for t in HASHTAG.findall(text)}
+            if self.include_hashtags and not found & self.include_hashtags:
+                return 'include_hashtags'
+            if self.exclude_hashtags and found & self.exclude_hashtags:
+                return 'exclude_hashtags'
+        if self.include_regex and not self.include_regex.search(text):
+            return 'include_regex'
+        if self.exclude_regex and self.exclude_regex.search(text):
+            return 'exclude_regex'
+        return None
+
+    def forward_origin(self, m) -> set[str]:
+        fwd = m.fwd_from
+        out = set()
+        if getattr(fwd, 'from_name', None):
+            out.add(fwd.from_name)
+        if (peer := getattr(fwd, 'from_id', None)) is not None:
+            from telethon import utils
+            out |= {str(utils.get_peer_id(peer)), str(utils.get_peer_id(peer, add_mark=False))}
+        if post_author := getattr(fwd, 'post_author', None):
+            out.add(post_author)
+        return out
+
+    def message_rule(self, m) -> str | None:
+        """
+        :return: Name of the per-message rule that drops this message, None if it is kept
+        """
+        from telethon.tl.types import MessageService
+
+        if isinstance(m, MessageService):
+            return None if self.service_messages else 'service_messages'
+        if m.fwd_from:
+            if not self.forwards:
+                return 'forwards'
+            if self.exclude_forwarded_from and self.forward_origin(m) & self.exclude_forwarded_from:
+                return 'exclude_forwarded_from'
+        if self.since is not None or self.until is not None:
+            ts = parse_ts(m.date)
+            if self.since is not None and ts < self.since:
+                return 'since'
+            if self.until is not None and ts > self.until:
+                return 'until'
+        if self.media_types and (media_kind(m) if m.media else 'text') not in self.media_types:
+            return 'media_types'
+        return None
+
+    @property
+    def has_text_rules(self) -> bool:
+        return bool(self.include_hashtags or self.exclude_hashtags or self.include_regex or self.exclude_regex)
+
+    def _decide(self, m, rule: str | None, out: list) -> int:
+        """
+        :return: Number of messages filtered out (0 or 1)
+        """
+        if rule is None:
+            out.append(m)
+            return 0
+        metrics.count('messages_filtered')
+        metrics.count(f'messages_filtered_{rule}')
+        return 1
+
+    def _release(self, gid: int, out: list) -> int:
+        rule = self.groups.get(gid, self.text_rule(''))
+        return sum(self._decide(m, rule, out) for m in self.held.pop(gid))
+
+    def apply(self, msgs: list) -> list:
+        """
+        :param msgs: Messages of a batch, in crawl order
+        :return: Messages that pass the filter. Messages of an album that ends the batch are held back
+                 and returned with a later batch (or by flush).
+        """
+        text_rules = self.has_text_rules
+        out = []
+        filtered = 0
+        for m in msgs:
+            gid = getattr(m, 'grouped_id', None)
+            if text_rules and gid and (text := getattr(m, 'message', None)):
+                # Any caption of the album that passes keeps it
+                if self.groups.get(gid, '') is not None:
+                    self.groups[gid] = self.text_rule(text)
+            rule = self.message_rule(m)
+            if rule is None and text_rules:
+                if gid:
+                    self.held.setdefault(gid, []).append(m)
+                    continue
+                rule = self.text_rule(getattr(m, 'message', None) or '')
+            filtered += self._decide(m, rule, out)
+
+        # Albums are complete once the batch moves past them
+        frontier = getattr(msgs[-1], 'grouped_id', None) if msgs else None
+        for gid in [g for g in self.held if g != frontier]:
+            filtered += self._release(gid, out)
+
+        if filtered:
+            print(f"> Filtered out {filtered} messages")
+        if held := sum(len(v) for v in self.held.values()):
+            print(f"> Holding back {held} messages of an album until its other messages are fetched")
+        return out
+
+    def flush(self) -> list:
+        """
+        Decide the albums held back by apply (call when a crawl direction ends)
+
+        :return: Held messages that pass the filter
+        """
+        out = []
+        for gid in list(self.held):
+            self._release(gid, out)
+        return out
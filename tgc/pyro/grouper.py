@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from hypy_utils.dict_utils import remove_nones
 
 
@@ -15,9 +17,10 @@ def group_msgs(msgs: list[dict]) -> list[dict]:
 
     # Find groups
     id_map = {m['id']: m for m in msgs}
-    tmp_grouped: list[dict] = [d for d in msgs if 'media_group_id' in d]
-    gids: set[int] = {d['media_group_id'] for d in tmp_grouped}
-    groups: dict[int, list[dict]] = {g: [d for d in tmp_grouped if d['media_group_id'] == g] for g in gids}
+    groups: dict[int, list[dict]] = defaultdict(list)
+    for d in msgs:
+        if 'media_group_id' in d:
+            groups[d['media_group_id']].append(d)
 
     # Group messages
     result = []
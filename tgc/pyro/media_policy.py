@@ -0,0 +1,109 @@
+"""
+Per-export media policy
+
+Decides from a message's metadata (type, mime type and size, as reported by Telegram) whether its
+media is downloaded, before any bytes are transferred:
+
+```toml
+[exports.media_policy]
+max_mb = { video = 200, photo = 20, file = 50 }   # Per type, types without a limit use size_limit_mb
+allow_mime = ["image/*", "video/*"]               # Only download matching mime types (fnmatch patterns)
+deny_mime = ["application/x-msdownload"]          # Never download matching mime types
+oversize_video = "thumb"                          # Keep only the thumbnail of videos over the limit
+```
+
+Types are photo, video, animation, sticker, audio and file. Photos have no mime type and are
+matched as image/jpeg. Every skip is printed with its reason and counted in the run metrics
+(media_skipped, media_skipped_<type>, media_thumb_only).
+"""
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from typing import NamedTuple
+
+from . import metrics
+from .download_media import media_size
+
+KINDS = ('photo', 'video', 'animation', 'sticker', 'audio', 'file')
+
+
+class Decision(NamedTuple):
+    action: str         # download, thumb or skip
+    reason: str | None = None
+
+
+DOWNLOAD = Decision('download')
+
+
+def media_kind(m) -> str:
+    if m.photo:
+        return 'photo'
+    if m.sticker:
+        return 'sticker'
+    if m.gif:
+        return 'animation'
+    if m.video or m.video_note:
+        return 'video'
+    if m.audio or m.voice:
+        return 'audio'
+    return 'file'
+
+
+def media_mime(m) -> str:
+    return (getattr(m.file, 'mime_type', None) if m.file else None) or ('image/jpeg' if m.photo else '')
+
+
+@dataclass(slots=True)
+class MediaPolicy:
+    size_limit: int = 0                         # Bytes, for types without their own limit (0 = none)
+    max_size: dict[str, int] | None = None      # Bytes by type
+    allow_mime: list[str] | None = None
+    deny_mime: list[str] | None = None
+    oversize_video: str = 'skip'
+
+    @classmethod
+    def from_export(cls, export: dict) -> 'MediaPolicy':
+        p = export.get('media_policy') or {}
+        max_mb = p.get('max_mb') or {}
+        unknown = set(max_mb) - set(KINDS)
+        if unknown:
+            raise ValueError(f"Unknown media types in media_policy.max_mb: {', '.join(sorted(unknown))} "
+                             f"(expected {', '.join(KINDS)})")
+        oversize = p.get('oversize_video') or 'skip'
+        if oversize not in ('skip', 'thumb'):
+            raise ValueError(f"Unknown media_policy.oversize_video {oversize!r} (expected skip or thumb)")
+        return cls(size_limit=int((export.get('size_limit_mb') or 0) * 1000_000),
+                   max_size={k: int(v * 1000_000) for k, v in max_mb.items()},
+                   allow_mime=p.get('allow_mime'), deny_mime=p.get('deny_mime'), oversize_video=oversize)
+
+    def limit(self, kind: str) -> int:
+        return (self.max_size or {}).get(kind, self.size_limit)
+
+    def evaluate(self, m) -> Decision:
+        """
+        Decide what to download of a message's media, from its metadata only
+        """
+        kind = media_kind(m)
+        mime = media_mime(m)
+        if self.deny_mime and any(fnmatch(mime, p) for p in self.deny_mime):
+            return Decision('skip', f"mime type {mime} is denied")
+        if self.allow_mime and not any(fnmatch(mime, p) for p in self.allow_mime):
+            return Decision('skip', f"mime type {mime or 'unknown'} is not allowed")
+        size = media_size(m)
+        limit = self.limit(kind)
+        if limit and size > limit:
+            reason = f"{size / 1e6:.1f} MB exceeds the {kind} limit of {limit / 1e6:.1f} MB"
+            if kind == 'video' and self.oversize_video == 'thumb':
+                return Decision('thumb', reason)
+            return Decision('skip', reason)
+        return DOWNLOAD
+
+    @staticmethod
+    def report(m, decision: Decision):
+        kind = media_kind(m)
+        if decision.action == 'thumb':
+            print(f"Keeping only the thumbnail of message {m.id} ({kind}): {decision.reason}")
+            metrics.count('media_thumb_only')
+        elif decision.action == 'skip':
+            print(f"Skipped media of message {m.id} ({kind}): {decision.reason}")
+            metrics.count('media_skipped')
+            metrics.count(f'media_skipped_{kind}')
@@ -0,0 +1,199 @@
+"""
+Deferred media queue (defer_media, tgc media)
+
+With `defer_media` enabled on an export, process_chat saves new posts right away with placeholder
+media items (`"pending": true`, with the type, size and dimensions known from the message), and
+records one job per post in <export>/.media-queue/<post id>.json. The `tgc media` worker drains
+the queues: it re-fetches the messages (file references expire, so messages aren't stored),
+downloads, thumbnails and uploads the media with bounded concurrency and an optional byte budget,
+and patches the results into the saved posts.
+
+Jobs are only removed after the patched posts are saved, so an interrupted worker repeats them. A
+job fails (and keeps its placeholders) unless the media of all of its messages were stored.
+"""
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+
+from hypy_utils import printc
+from telethon.tl.types import Message
+
+from .. import codec
+from . import metrics
+
+QUEUE_DIR = ".media-queue"
+
+# Failed jobs are retried by later workers up to this many times
+MAX_ATTEMPTS = 5
+
+
+def pending_media(m: Message) -> dict:
+    """
+    Placeholder media info of a message, from what is known without downloading it
+    """
+    f = m.file
+    duration = getattr(f, 'duration', None)
+    return {
+        'date': m.date,
+        'original_name': getattr(f, 'name', None),
+        'size': getattr(f, 'size', None),
+        'width': getattr(f, 'width', None),
+        'height': getattr(f, 'height', None),
+        'duration': int(duration) if duration else None,
+        'media_type': 'photo' if m.photo else 'video' if m.video else 'file',
+        'mime_type': getattr(f, 'mime_type', None),
+    }
+
+
+def enqueue(path: Path, post_id: int, msgs: list[Message]):
+    q = path / QUEUE_DIR
+    q.mkdir(parents=True, exist_ok=True)
+    job = {
+        'post_id': post_id,
+        'msg_ids': [m.id for m in msgs],
+        'size': sum(getattr(m.file, 'size', None) or 0 for m in msgs),
+        'added': time.time(),
+        'attempts': 0,
+    }
+    _write_job(q / f"{post_id}.json", job)
+
+
+def _write_job(fp: Path, job: dict):
+    tmp = fp.with_suffix('.json.tmp')
+    codec.write_json(tmp, job, indent=True)
+    os.replace(tmp, fp)
+
+
+def load_jobs(path: Path) -> list[dict]:
+    """
+    :return: Queued jobs of an export, oldest post first
+    """
+    q = path / QUEUE_DIR
+    if not q.is_dir():
+        return []
+    return sorted((codec.read(fp) for fp in q.glob('*.json')), key=lambda j: j['post_id'])
+
+
+def complete(path: Path, post_id: int):
+    (path / QUEUE_DIR / f"{post_id}.json").unlink(missing_ok=True)
+
+
+def fail(path: Path, job: dict, error: str):
+    job = {**job, 'attempts': job.get('attempts', 0) + 1, 'error': error}
+    _write_job(path / QUEUE_DIR / f"{job['post_id']}.json", job)
+
+
+async def drain(client, export: dict, concurrency: int = 2, max_bytes: int = 0) -> int:
+    """
+    Process the queued media jobs of an export and patch the results into its posts
+
+    :param client: Telegram client
+    :param export: Export config
+    :param concurrency: Jobs processed at the same time
+    :param max_bytes: Stop taking jobs once their media adds up to this many bytes (0 = no limit)
+    :return: Number of posts patched
+    """
+    from ..model import Post, as_posts
+    from .crawl import process_media, save_posts, split_media
+    from .download_media import has_media
+    from .media_policy import MediaPolicy
+    from .peers import forget_peer, is_stale, resolve_chat
+
+    path = Path(export['path'])
+    jobs = [j for j in load_jobs(path) if j.get('attempts', 0) < MAX_ATTEMPTS]
+    if not jobs:
+        return 0
+
+    # The first job is always taken, even if it exceeds the budget on its own
+    selected = []
+    total = 0
+    for j in jobs:
+        if max_bytes and selected and total + j['size'] > max_bytes:
+            break
+        selected.append(j)
+        total += j['size']
+    print(f"Processing media of {len(selected)} of {len(jobs)} queued posts ({total / 1e6:.1f} MB)")
+
+    chat = await resolve_chat(client, export['chat_id'], path, export)
+    policy = MediaPolicy.from_export(export)
+    sem = asyncio.Semaphore(concurrency)
+    done: dict[int, tuple[list[dict], list[dict]]] = {}
+
+    async def run(job: dict):
+        async with sem:
+            try:
+                msgs = await client.get_messages(chat, ids=job['msg_ids'])
+                media_files = []
+                for m in msgs:
+                    if m is not None and has_media(m):
+                        infos = await process_media(client, m, path, job['post_id'], export)
+                        # Only media skipped by the policy have no result, anything else failed
+                        if not infos and policy.evaluate(m).action != 'skip':
+                            raise RuntimeError(f"media of message {m.id} could not be stored")
+                        media_files += infos
+                done[job['post_id']] = split_media(media_files)
+            except Exception as e:
+                printc(f"&cFailed to process media of post {job['post_id']}: {e}")
+                metrics.count('media_jobs_failed')
+                if is_stale(e):
+                    # Not the job's fault, the chat is resolved again by the next worker
+                    forget_peer(path)
+                else:
+                    fail(path, job, str(e))
+
+    await asyncio.gather(*(run(j) for j in selected))
+    if not done:
+        return 0
+
+    posts_path = path / "posts.json"
+    posts = sorted(as_posts(codec.load_posts(posts_path)), key=lambda x: x.id) if posts_path.exists() else []
+    patched = set()
+    for i, p in enumerate(posts):
+        if p.id in done:
+            d = p.to_dict()
+            d['images'], d['files'] = done[p.id]
+            posts[i] = Post.from_dict(d)
+            patched.add(p.id)
+    if patched:
+        save_posts(path, export, posts)
+
+    for job in selected:
+        if job['post_id'] in patched:
+            complete(path, job['post_id'])
+        elif job['post_id'] in done:
+            fail(path, job, "post not found in posts.json")
+    metrics.count('media_jobs_done', len(patched))
+    return len(patched)
+
+
+async def run_worker(client, cfg, concurrency: int, max_bytes: int, names: list[str] | None = None):
+    me = await client.get_me()
+    printc(f"&aLogin success! ID: {me.id}")
+    for export in cfg.exports:
+        name = str(export.get('name') or export['chat_id'])
+        if names and name not in names:
+            continue
+        if not load_jobs(Path(export['path'])):
+            continue
+        printc(f"&aDraining media queue of {name}")
+        with metrics.run({**export, 'name': f"{name}-media"}):
+            await drain(client, export, concurrency, max_bytes)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser("tgc media", description="Download and upload the deferred media of "
+                                                              "exports with defer_media enabled")
+    parser.add_argument("config", help="Config path", nargs="?", default="config.toml")
+    parser.add_argument("-j", "--concurrency", type=int, default=2, help="Posts processed at the same time")
+    parser.add_argument("--max-mb", type=float, default=0, help="Stop after this much media per export (MB)")
+    parser.add_argument("--export", nargs="*", help="Only these exports (by name or chat_id)")
+    args = parser.parse_args(argv)
+
+    from tgc.pyro.config import get_telegram_client, load_config
+    client = get_telegram_client(args.config)
+    cfg = load_config(args.config)
+    client.start()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run_worker(client, cfg, args.concurrency, int(args.max_mb * 1e6), args.export))
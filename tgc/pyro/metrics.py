@@ -0,0 +1,191 @@
+"""
+Per-run crawl metrics
+
+A RunMetrics object collects stage durations, counters and cache hit rates for one export. The
+active run is kept in a context variable, so instrumented code only calls the module functions
+(stage, count, cache), which are no-ops outside of a run. At the end of the run the metrics are
+written as a JSON run report and a Prometheus textfile (for node_exporter's textfile collector).
+"""
+import os
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .. import codec
+
+_current: ContextVar['RunMetrics | None'] = ContextVar('tgc_run_metrics', default=None)
+
+
+class _Stage:
+    __slots__ = ('m', 'name', 'start')
+
+    def __init__(self, m: 'RunMetrics', name: str):
+        self.m = m
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.m.seconds[self.name] += time.perf_counter() - self.start
+        self.m.calls[self.name] += 1
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+class RunMetrics:
+    """
+    Metrics of one crawl run of an export
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.duration = 0.0
+        self.seconds: dict[str, float] = defaultdict(float)
+        self.calls: Counter = Counter()
+        self.counters: Counter = Counter()
+        self.gauges: dict[str, float] = {}
+        self.caches: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+        self._start = time.perf_counter()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def to_dict(self) -> dict:
+        return {
+            'export': self.name,
+            'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            'duration': self.duration,
+            'stages': {k: {'calls': self.calls[k], 'seconds': v}
+                       for k, v in sorted(self.seconds.items(), key=lambda x: -x[1])},
+            'counters': dict(sorted(self.counters.items())),
+            'gauges': dict(sorted(self.gauges.items())),
+            'caches': {k: {'hits': h, 'misses': m, 'hit_rate': h / (h + m) if h + m else None}
+                       for k, (h, m) in sorted(self.caches.items())},
+        }
+
+    def to_prometheus(self) -> str:
+        label = f'export="{_escape(self.name)}"'
+        lines = []
+
+        def metric(name: str, help: str, samples: list[tuple[str, float]]):
+            lines.append(f"# HELP tgc_{name} {help}")
+            lines.append(f"# TYPE tgc_{name} gauge")
+            lines.extend(f"tgc_{name}{{{label}{extra}}} {value!r}" for extra, value in samples)
+
+        metric('run_timestamp_seconds', "Start time of the last crawl run", [("", self.started)])
+        metric('run_duration_seconds', "Wall time of the last crawl run", [("", self.duration)])
+        metric('stage_duration_seconds', "Wall time spent in each stage during the last run",
+               [(f',stage="{_escape(k)}"', v) for k, v in sorted(self.seconds.items())])
+        metric('stage_calls', "Number of times each stage ran during the last run",
+               [(f',stage="{_escape(k)}"', self.calls[k]) for k in sorted(self.seconds)])
+        for k, v in sorted(self.counters.items()):
+            metric(_metric_name(k), f"{k} during the last run", [("", v)])
+        for k, v in sorted(self.gauges.items()):
+            metric(_metric_name(k), k, [("", v)])
+        if self.caches:
+            metric('cache_hits', "Cache hits during the last run",
+                   [(f',cache="{_escape(k)}"', h) for k, (h, _) in sorted(self.caches.items())])
+            metric('cache_misses', "Cache misses during the last run",
+                   [(f',cache="{_escape(k)}"', m) for k, (_, m) in sorted(self.caches.items())])
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: Path) -> tuple[Path, Path]:
+        """
+        Write <name>.json and <name>.prom into the directory
+
+        The textfile is written to a temporary file and renamed, so the collector never reads a
+        partial file.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^\w.-]+', '_', self.name).strip('_') or 'export'
+        report = directory / f"{slug}.json"
+        codec.write_json(report, self.to_dict(), indent=True)
+        prom = directory / f"{slug}.prom"
+        tmp = prom.with_suffix('.prom.tmp')
+        tmp.write_text(self.to_prometheus())
+        os.replace(tmp, prom)
+        return report, prom
+
+    def summary(self) -> str:
+        top = sorted(self.seconds.items(), key=lambda x: -x[1])[:5]
+        out = f"Run took {self.duration:.1f}s: " + ", ".join(f"{k} {v:.1f}s" for k, v in top)
+        if saved := self.counters.get('optimize_bytes_saved'):
+            out += f" (image optimization saved {saved / 1e6:.1f} MB)"
+        return out
+
+
+def _escape(v: str) -> str:
+    return v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _metric_name(k: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', k)
+
+
+def current() -> RunMetrics | None:
+    return _current.get()
+
+
+def stage(name: str) -> _Stage | _NoStage:
+    """
+    Time a block as a stage of the current run: `with metrics.stage('upload'): ...`
+    """
+    m = _current.get()
+    return _Stage(m, name) if m else _NO_STAGE
+
+
+def count(name: str, n: float = 1):
+    if m := _current.get():
+        m.counters[name] += n
+
+
+def gauge(name: str, value: float):
+    if m := _current.get():
+        m.gauges[name] = value
+
+
+def cache(name: str, hit: bool):
+    if m := _current.get():
+        m.caches[name][0 if hit else 1] += 1
+
+
+@contextmanager
+def run(export: dict):
+    """
+    Collect metrics for one run of an export, and write the reports into the export's
+    `metrics_dir` (if configured) when the run ends
+
+    :param export: Export config
+    """
+    m = RunMetrics(str(export.get('name') or export.get('chat_id')))
+    token = _current.set(m)
+    try:
+        yield m
+    finally:
+        _current.reset(token)
+        m.finish()
+        print(m.summary())
+        if export.get('metrics_dir'):
+            report, prom = m.write(Path(export['metrics_dir']))
+            print(f"Metrics saved to {report} and {prom}")
@@ -0,0 +1,123 @@
+"""
+Image optimization before storing (optimize_images)
+
+With `optimize_images` enabled on an export, downloaded JPEG and PNG files are rewritten before
+they are stored:
+
+* JPEG: metadata is stripped (except the ICC color profile) and the entropy coding is optimized
+  losslessly with jpegtran (`-copy icc -optimize -progressive`) when it is installed. Without jpegtran, Pillow re-saves the
+  image with its original quantization tables (`quality="keep"`), which is near-lossless.
+* PNG: re-saved by Pillow with `optimize=True` and without text chunks, which is lossless.
+
+Color profiles are kept in every case, dropping them would shift the colors of wide-gamut images.
+* With `max_image_px`, images whose longest side exceeds it are downscaled (JPEGs are re-encoded
+  at quality 90).
+
+Stripping the metadata would display images with an EXIF orientation sideways, so they are
+rotated into place first: JPEGs losslessly with jpegtran (`-perfect`, so the rotation fails rather
+than trimming the edges), PNGs by Pillow. Oriented JPEGs that can't be rotated losslessly are left
+untouched. A rewritten file only replaces the original if it is smaller (or was downscaled). The work runs in a process pool of `optimize_workers` processes (default:
+half of the CPU cores), and the bytes saved are counted in the run metrics.
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from . import metrics
+
+JPEG_EXTS = ['.jpg', '.jpeg']
+PNG_EXTS = ['.png']
+
+# jpegtran transforms undoing each EXIF orientation
+ORIENTATIONS = {2: ['-flip', 'horizontal'], 3: ['-rotate', '180'], 4: ['-flip', 'vertical'], 5: ['-transpose'],
+                6: ['-rotate', '90'], 7: ['-transverse'], 8: ['-rotate', '270']}
+
+_pools: dict[int, ProcessPoolExecutor] = {}
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return _pools[workers]
+
+
+def optimize_image(src: str, max_px: int = 0) -> tuple[int, int]:
+    """
+    Optimize an image in place (runs in the process pool)
+
+    :param src: JPEG or PNG file
+    :param max_px: Downscale images whose longest side exceeds this (0 = never)
+    :return: Size before and after
+    """
+    from PIL import Image, ImageOps
+
+    fp = Path(src)
+    before = fp.stat().st_size
+    tmp = fp.with_name(f"{fp.stem}.optimized{fp.suffix}")
+    is_jpeg = fp.suffix.lower() in JPEG_EXTS
+
+    with Image.open(fp) as im:
+        if im.format != ('JPEG' if is_jpeg else 'PNG'):
+            return before, before
+        orientation = im.getexif().get(0x0112, 1)
+        resize = max_px and max(im.size) > max_px
+        if is_jpeg and not resize:
+            if shutil.which('jpegtran'):
+                transform = ['-perfect', *ORIENTATIONS[orientation]] if orientation in ORIENTATIONS else []
+                result = subprocess.run(['jpegtran', '-copy', 'icc', '-optimize', '-progressive', *transform,
+                                         '-outfile', str(tmp), str(fp)], capture_output=True)
+                if result.returncode != 0:
+                    tmp.unlink(missing_ok=True)
+                    return before, before
+            elif orientation in ORIENTATIONS:
+                # Pillow can only rotate by re-encoding
+                return before, before
+            else:
+                im.save(tmp, 'JPEG', quality='keep', subsampling='keep', optimize=True, progressive=True,
+                        icc_profile=im.info.get('icc_profile'))
+        else:
+            img = ImageOps.exif_transpose(im)
+            if resize:
+                img.thumbnail((max_px, max_px), Image.LANCZOS)
+            if is_jpeg:
+                img.save(tmp, 'JPEG', quality=90, optimize=True, progressive=True,
+                         icc_profile=im.info.get('icc_profile'))
+            else:
+                img.save(tmp, 'PNG', optimize=True)
+
+    after = tmp.stat().st_size
+    if after < before or resize:
+        os.replace(tmp, fp)
+        return before, after
+    tmp.unlink()
+    return before, before
+
+
+async def optimize_file(fp: Path, export: dict) -> int:
+    """
+    Optimize a downloaded image if enabled for the export
+
+    :param fp: Downloaded file
+    :param export: Export config (optimize_images, max_image_px, optimize_workers)
+    :return: Bytes saved
+    """
+    if not export.get('optimize_images') or fp.suffix.lower() not in JPEG_EXTS + PNG_EXTS:
+        return 0
+    pool = get_pool(int(export.get('optimize_workers') or default_workers()))
+    try:
+        with metrics.stage('optimize'):
+            before, after = await asyncio.get_running_loop().run_in_executor(
+                pool, optimize_image, str(fp), int(export.get('max_image_px') or 0))
+    except Exception as e:
+        print(f"Failed to optimize {fp.name}: {e}")
+        return 0
+    metrics.count('optimize_bytes_before', before)
+    metrics.count('optimize_bytes_saved', before - after)
+    return before - after
@@ -0,0 +1,131 @@
+"""
+Persistent peer cache
+
+The session is rebuilt from the config string on every run, so Telethon's entity cache is always
+empty, and resolving a username-style chat_id costs a rate-limited ResolveUsername request each
+run. The resolved peer (id, access hash, username and title) is saved as .peer.json in the export
+directory and used directly on later runs. After `peer_cache_days` (default 7) it is revalidated
+by id and access hash, which doesn't need ResolveUsername either; only if that fails is the
+chat_id resolved again.
+
+Access hashes are only valid for the account that resolved them, so the cache records the account
+id and is discarded when the session belongs to another account. If Telegram still rejects a cached
+peer (STALE_ERRORS), the crawl forgets it and resolves the chat again.
+"""
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from .. import codec
+from . import metrics
+
+PEER_FILE = ".peer.json"
+
+# Errors of requests made with a cached peer whose access hash isn't valid (anymore)
+STALE_ERRORS = ('ChannelInvalidError', 'ChannelPrivateError', 'PeerIdInvalidError')
+
+
+@dataclass(slots=True)
+class CachedPeer:
+    """
+    A resolved chat. It can be passed to client methods in place of the entity (Telethon accepts
+    any object with an `input_entity`).
+    """
+    chat_id: str            # chat_id of the export config
+    id: int
+    type: str               # channel, chat or user
+    access_hash: int | None = None
+    username: str | None = None
+    title: str | None = None
+    resolved: float = 0
+    account: int | None = None      # Id of the account that resolved it
+
+    @property
+    def input_entity(self):
+        from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser
+        if self.type == 'channel':
+            return InputPeerChannel(self.id, self.access_hash or 0)
+        if self.type == 'chat':
+            return InputPeerChat(self.id)
+        return InputPeerUser(self.id, self.access_hash or 0)
+
+    @classmethod
+    def from_entity(cls, chat_id, entity, account: int | None = None) -> 'CachedPeer':
+        from telethon.tl.types import Channel, Chat
+        title = getattr(entity, 'title', None)
+        if title is None and hasattr(entity, 'first_name'):
+            title = " ".join(n for n in (entity.first_name, entity.last_name) if n)
+        return cls(chat_id=str(chat_id), id=entity.id,
+                   type='channel' if isinstance(entity, Channel) else 'chat' if isinstance(entity, Chat) else 'user',
+                   access_hash=getattr(entity, 'access_hash', None), username=getattr(entity, 'username', None),
+                   title=title, resolved=time.time(), account=account)
+
+
+def load_peer(path: Path) -> CachedPeer | None:
+    fp = path / PEER_FILE
+    if not fp.is_file():
+        return None
+    try:
+        return CachedPeer(**codec.read(fp))
+    except (ValueError, TypeError) as e:
+        print(f"Warning: Could not load {fp}: {e}")
+        return None
+
+
+def save_peer(path: Path, peer: CachedPeer):
+    path.mkdir(parents=True, exist_ok=True)
+    codec.write_json(path / PEER_FILE, asdict(peer), indent=True)
+
+
+def forget_peer(path: Path):
+    (path / PEER_FILE).unlink(missing_ok=True)
+
+
+def is_stale(e: Exception) -> bool:
+    """
+    :return: Whether an error means that the cached peer of the request is no longer valid
+    """
+    return type(e).__name__ in STALE_ERRORS
+
+
+async def account_id(client) -> int | None:
+    # The input peer of the logged in account is cached by Telethon after the first get_me
+    me = await client.get_me(input_peer=True)
+    return getattr(me, 'user_id', None) or getattr(me, 'id', None)
+
+
+async def resolve_chat(client, chat_id, path: Path, export: dict):
+    """
+    Resolve the chat of an export, using the peer cache when possible
+
+    :param client: Telegram client
+    :param chat_id: chat_id of the export (id or username)
+    :param path: Export path
+    :param export: Export config (`peer_cache_days`)
+    :return: Cached peer, or the entity if it was resolved over the network
+    """
+    from .crawl import validate_chat_id
+
+    ttl = float(export.get('peer_cache_days') if export.get('peer_cache_days') is not None else 7) * 86400
+    account = await account_id(client)
+    cached = load_peer(path)
+    if cached and (cached.chat_id != str(chat_id) or cached.account != account):
+        cached = None
+
+    if cached and time.time() - cached.resolved < ttl:
+        metrics.cache('peer', True)
+        return cached
+    metrics.cache('peer', False)
+
+    entity = None
+    if cached:
+        # Revalidate by id and access hash
+        try:
+            entity = await client.get_entity(cached.input_entity)
+        except Exception as e:
+            print(f"Cached peer of {chat_id} is no longer valid ({e}), resolving again")
+    if entity is None:
+        entity = await client.get_entity(validate_chat_id(chat_id))
+
+    save_peer(path, CachedPeer.from_entity(chat_id, entity, account))
+    return entity
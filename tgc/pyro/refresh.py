@@ -0,0 +1,197 @@
+"""
+Refresh of recently saved posts
+
+process_chat only crawls posts it hasn't saved yet. The refresh pass re-fetches the messages of a
+recent window of saved posts (the last `refresh_posts` posts and/or the posts of the last
+`refresh_days` days) by id, 100 per request, and applies edits, deletions and the current view and
+forward counts. Every message of an album is fetched (see Post.msg_ids), so an edited caption is
+found on any of them, and an album is only removed once all of its messages are deleted. Albums
+saved before their message ids were recorded are looked up among the ALBUM_SIZE ids following the
+post id first.
+
+A content hash of every refreshed message (text, entities, views, forwards) is kept in
+.refresh.json, so unchanged messages are skipped without converting their text again.
+"""
+import hashlib
+import time
+from pathlib import Path
+
+from telethon.tl.types import Message
+
+from .. import codec
+from . import metrics, timeseries
+from .crawl import effective_text
+from .emoji import replace_emojis, resolve_emojis
+from ..model import Post
+
+# Content hashes of the refreshed messages, by message id
+MANIFEST = ".refresh.json"
+# Maximum number of messages in an album
+ALBUM_SIZE = 10
+
+
+def message_hash(msg: Message) -> str:
+    entities = [e.to_dict() for e in getattr(msg, 'entities', None) or []]
+    data = codec.dumps([getattr(msg, 'message', None), entities, getattr(msg, 'views', None),
+                        getattr(msg, 'forwards', None)])
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
+
+
+def message_ids(post: Post) -> list[int]:
+    """
+    :return: Ids of the messages that make up a post, first message first
+    """
+    return post.msg_ids or [post.id]
+
+
+def apply_changes(posts: list[Post], edited: dict[int, Message], deleted: set[int],
+                  emojis: dict[int, str] | None = None) -> tuple[list[Post], int]:
+    """
+    Apply edited and deleted messages to saved posts
+
+    :param posts: Posts sorted by id
+    :param edited: Edited messages by message id
+    :param deleted: Deleted message ids
+    :param emojis: Custom emoji paths of the edited messages (see emoji.resolve_emojis)
+    :return: Posts, and the number of posts changed
+    """
+    changed = 0
+    if deleted:
+        kept = []
+        for p in posts:
+            ids = message_ids(p)
+            if deleted.isdisjoint(ids):
+                kept.append(p)
+                continue
+            # Albums are kept until all of their messages are deleted
+            changed += 1
+            if remaining := [i for i in ids if i not in deleted]:
+                p.msg_ids = remaining
+                kept.append(p)
+        posts = kept
+
+    if edited:
+        by_id = {p.id: p for p in posts}
+        by_group = {p.media_group_id: p for p in posts if p.media_group_id}
+        by_post: dict[int, tuple[Post, list[Message]]] = {}
+        for msg in sorted(edited.values(), key=lambda m: m.id):
+            gid = getattr(msg, 'grouped_id', None)
+            post = by_group.get(gid) if gid else by_id.get(msg.id)
+            if post is not None:
+                by_post.setdefault(post.id, (post, []))[1].append(msg)
+
+        for post, msgs in by_post.values():
+            dirty = False
+            # View and forward counts of a post are the ones of its first message
+            if msgs[0].id == message_ids(post)[0]:
+                for k in ('views', 'forwards'):
+                    v = getattr(msgs[0], k, None)
+                    if v is not None and getattr(post, k) != v:
+                        setattr(post, k, v)
+                        dirty = True
+            texts = [replace_emojis(effective_text(m), emojis) for m in msgs]
+            if not getattr(msgs[0], 'grouped_id', None):
+                text = texts[0]
+            elif post.msg_ids and {m.id for m in msgs} >= set(post.msg_ids):
+                # Every message of the album was seen, so without a caption it was removed
+                text = next((t for t in texts if t), None)
+            else:
+                # Only one message of an album carries the caption, and it may not be among these
+                text = next((t for t in texts if t), post.text)
+            if post.text != text:
+                post.text = text
+                dirty = True
+            changed += dirty
+    return posts, changed
+
+
+def refresh_window(posts: list[Post], last: int = 0, days: float = 0) -> list[Post]:
+    """
+    :param posts: Posts sorted by id
+    :param last: Number of newest posts
+    :param days: Also include posts younger than this
+    :return: Posts of the refresh window, sorted by id
+    """
+    start = max(len(posts) - last, 0) if last else len(posts)
+    if days:
+        since = time.time() - days * 86400
+        while start > 0 and posts[start - 1].ts >= since:
+            start -= 1
+    return posts[start:]
+
+
+async def refresh_posts(client, chat, path: Path, export: dict, posts: list[Post]) -> tuple[list[Post], int]:
+    """
+    Re-fetch the refresh window of an export and apply edits, deletions and counters
+
+    :param client: Telegram client
+    :param chat: Chat entity
+    :param path: Export path
+    :param export: Export config (`refresh_posts`, `refresh_days`)
+    :param posts: Saved posts sorted by id
+    :return: Posts, and the number of posts changed
+    """
+    window = refresh_window(posts, int(export.get('refresh_posts') or 0), float(export.get('refresh_days') or 0))
+    if not window:
+        return posts, 0
+
+    mf = path / MANIFEST
+    manifest: dict[str, str] = codec.read(mf) if mf.is_file() else {}
+    hashes = {}
+    edited: dict[int, Message] = {}
+    deleted: set[int] = set()
+
+    # Albums without recorded message ids are probed over the ids they can span (posts of a single
+    # message have their own id as media_group_id)
+    probed = [p for p in window if p.media_group_id and p.media_group_id != p.id and not p.msg_ids]
+    ids = sorted({i for p in window for i in message_ids(p)}
+                 | {i for p in probed for i in range(p.id, p.id + ALBUM_SIZE)})
+    print(f"Refreshing {len(window)} posts ({len(ids)} messages), ID range: {ids[0]} - {ids[-1]}")
+    found: dict[int, Message] = {}
+    for i in range(0, len(ids), 100):
+        batch = ids[i:i + 100]
+        with metrics.stage('refresh'):
+            msgs = await client.get_messages(chat, ids=batch)
+        metrics.count('messages_refreshed', len(batch))
+        found.update((mid, msg) for mid, msg in zip(batch, msgs)
+                     if msg is not None and not getattr(msg, 'empty', False))
+
+    recorded = 0
+    for p in probed:
+        members = [i for i in range(p.id, p.id + ALBUM_SIZE)
+                   if i in found and getattr(found[i], 'grouped_id', None) == p.media_group_id]
+        if members:
+            p.msg_ids = members
+            recorded += 1
+    # Probed ids of other posts are not sampled under the probed album
+    timeseries.sample(list(found.values()), {mid: p.id for p in window for mid in message_ids(p)})
+
+    for p in window:
+        for mid in message_ids(p):
+            if mid not in found:
+                deleted.add(mid)
+                continue
+            key = str(mid)
+            hashes[key] = h = message_hash(found[mid])
+            if manifest.get(key) != h:
+                edited[mid] = found[mid]
+
+    # A changed album is applied with all of its messages, so a removed caption is noticed
+    edited_count = len(edited)
+    for p in window:
+        if p.msg_ids and not edited.keys().isdisjoint(p.msg_ids):
+            edited.update((mid, found[mid]) for mid in p.msg_ids if mid in found)
+
+    emojis = await resolve_emojis(edited.values(), path, client)
+    before = len(posts)
+    posts, changed = apply_changes(posts, edited, deleted, emojis)
+    changed += recorded
+    metrics.count('posts_refreshed', changed)
+    metrics.count('posts_deleted', before - len(posts))
+    print(f"Refreshed {len(window)} posts: {edited_count} changed messages, {len(deleted)} deleted, "
+          f"{changed} posts updated, {before - len(posts)} removed")
+
+    # Hashes outside of the window are dropped, those posts are no longer refreshed
+    if hashes != manifest:
+        codec.write_json(mf, hashes, indent=True)
+    return posts, changed
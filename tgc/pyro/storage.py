@@ -0,0 +1,320 @@
+"""
+Storage backends for downloaded media
+
+Every backend implements the same async interface: `put` stores a local file under a key (its path
+relative to the export, e.g. `123/video.mp4`) and returns its media info with a `url`, `exists`
+checks whether a key is stored, `url_for` maps a key to its public URL, and `put_many` stores
+several files concurrently. Blocking I/O runs in worker threads.
+
+* `local`: files stay on disk (in the export, or in `dir`). Files are stored once by content hash
+  in `.objects` and hard-linked to their keys, so the same media in several posts or exports
+  takes the space of one file. URLs are relative to the export unless `base_url` is set.
+* `http`: the image host configured by `upload_url` (see upload_file_with_retry).
+* `s3`: S3-compatible object stores (AWS, MinIO, R2, ...), through signed path-style requests.
+  Objects whose key already exists with the same size are not uploaded again.
+
+The backend is selected per export with an `[exports.storage]` table (`type = "local" | "http" |
+"s3"`). Without it, exports use the image host if `upload_url` is configured, else local storage.
+"""
+import abc
+import asyncio
+import datetime
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import threading
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+from hypy_utils import printc
+
+from . import metrics
+from .download_media import probe_info, upload_file_with_retry
+
+# Files stored at the same time by put_many
+CONCURRENCY = 4
+
+
+class Storage(abc.ABC):
+    """
+    Base class of storage backends
+    """
+    # Whether stored files are read from the local files (so they must not be deleted)
+    keeps_local = False
+
+    @abc.abstractmethod
+    async def put(self, fp: Path, key: str):
+        """
+        Store a local file
+
+        :param fp: Local file
+        :param key: Key of the file (its path relative to the export)
+        :return: Media info with a `url` (or a list of them for files stored in parts), None if it failed
+        """
+
+    @abc.abstractmethod
+    async def exists(self, key: str) -> bool:
+        """
+        :return: Whether a key is stored
+        """
+
+    @abc.abstractmethod
+    def url_for(self, key: str) -> str | None:
+        """
+        :return: Public URL of a key, None if the backend can't tell without storing it
+        """
+
+    async def put_many(self, items: list[tuple[Path, str]], concurrency: int = CONCURRENCY) -> list:
+        """
+        Store several files concurrently
+
+        :param items: (local file, key) pairs
+        :return: Results of put, in the same order
+        """
+        sem = asyncio.Semaphore(concurrency)
+
+        async def put(fp: Path, key: str):
+            async with sem:
+                return await self.put(fp, key)
+
+        return await asyncio.gather(*(put(fp, key) for fp, key in items))
+
+
+class LocalStorage(Storage):
+    """
+    :param export_path: Export path
+    :param root: Directory the files are stored in (defaults to the export path)
+    :param base_url: Public URL of the root directory (URLs are relative to the export if empty)
+    """
+
+    def __init__(self, export_path: Path, root: Path | None = None, base_url: str = ""):
+        self.export_path = export_path
+        self.root = root or export_path
+        self.base_url = base_url.rstrip('/')
+        self.objects = self.root / ".objects"
+        self.keeps_local = self.root.absolute() == export_path.absolute()
+
+    def url_for(self, key: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{quote(key)}"
+        return Path(os.path.relpath(self.root / key, self.export_path)).as_posix()
+
+    async def exists(self, key: str) -> bool:
+        return (self.root / key).is_file()
+
+    def _put(self, fp: Path, key: str):
+        h = hashlib.sha256()
+        with open(fp, 'rb') as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        obj = self.objects / h.hexdigest()[:2] / f"{h.hexdigest()}{fp.suffix.lower()}"
+        dst = self.root / key
+
+        if obj.exists():
+            metrics.cache('storage_dedup', True)
+        else:
+            metrics.cache('storage_dedup', False)
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp = obj.with_name(obj.name + '.tmp')
+            tmp.unlink(missing_ok=True)
+            try:
+                os.link(fp, tmp)
+            except OSError:
+                shutil.copy2(fp, tmp)
+            os.replace(tmp, obj)
+            metrics.count('bytes_stored', obj.stat().st_size)
+
+        # Point the key to the object (replacing the downloaded file if it is stored in place)
+        if not (dst.exists() and os.path.samefile(dst, obj)):
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(dst.name + '.link')
+            tmp.unlink(missing_ok=True)
+            try:
+                os.link(obj, tmp)
+            except OSError:
+                shutil.copy2(obj, tmp)
+            os.replace(tmp, dst)
+
+        info = probe_info(str(dst))
+        info['url'] = self.url_for(key)
+        return info
+
+    async def put(self, fp: Path, key: str):
+        with metrics.stage('store'):
+            return await asyncio.to_thread(self._put, fp, key)
+
+
+class HttpStorage(Storage):
+    """
+    The image host of upload_file_with_retry
+
+    :param cfg: Config (upload_url, upload_auth_code, image_base_url)
+    """
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    def url_for(self, key: str) -> None:
+        # The host names stored files itself
+        return None
+
+    async def exists(self, key: str) -> bool:
+        # The host has no lookup API, duplicates are avoided by the upload journal
+        return False
+
+    async def put(self, fp: Path, key: str):
+        return await asyncio.to_thread(upload_file_with_retry, str(fp), self.cfg, keep_local=True)
+
+
+class S3Storage(Storage):
+    """
+    S3-compatible object store, with AWS Signature Version 4 signed path-style requests
+
+    :param bucket: Bucket name
+    :param endpoint: Endpoint URL (e.g. http://127.0.0.1:9000 for MinIO)
+    :param access_key: Access key id (defaults to $AWS_ACCESS_KEY_ID)
+    :param secret_key: Secret access key (defaults to $AWS_SECRET_ACCESS_KEY)
+    :param region: Region used for signing
+    :param prefix: Prefix of all keys (e.g. the export name)
+    :param public_url: Public URL of the bucket (defaults to <endpoint>/<bucket>)
+    """
+
+    def __init__(self, bucket: str, endpoint: str = "https://s3.amazonaws.com", access_key: str = "",
+                 secret_key: str = "", region: str = "us-east-1", prefix: str = "", public_url: str = ""):
+        self.bucket = bucket
+        self.endpoint = endpoint.rstrip('/')
+        self.access_key = access_key or os.getenv('AWS_ACCESS_KEY_ID', '')
+        self.secret_key = secret_key or os.getenv('AWS_SECRET_ACCESS_KEY', '')
+        self.region = region
+        self.prefix = prefix.strip('/')
+        self.public_url = (public_url or f"{self.endpoint}/{bucket}").rstrip('/')
+        # Endpoints may be mounted under a path (e.g. https://example.com/s3), which is part of the
+        # signed canonical URI
+        url = urlsplit(self.endpoint)
+        self.origin = f"{url.scheme}://{url.netloc}"
+        self.host = url.netloc
+        self.root = quote(url.path.rstrip('/'))
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        # requests sessions aren't thread-safe, one per worker thread
+        if not hasattr(self.local, 'session'):
+            import requests
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def url_for(self, key: str) -> str:
+        return f"{self.public_url}/{quote(self.object_key(key))}"
+
+    def sign(self, method: str, path: str) -> dict:
+        """
+        :return: Headers authenticating an unsigned-payload request
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+        headers = {'host': self.host, 'x-amz-content-sha256': 'UNSIGNED-PAYLOAD', 'x-amz-date': amz_date}
+        signed = ';'.join(headers)
+        canonical = '\n'.join([method, path, '', *(f"{k}:{v}" for k, v in headers.items()), '', signed,
+                               'UNSIGNED-PAYLOAD'])
+        to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical.encode()).hexdigest()])
+
+        key = f"AWS4{self.secret_key}".encode()
+        for part in scope.split('/'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed}, Signature={signature}")
+        del headers['host']
+        return headers
+
+    def _request(self, method: str, key: str, headers: dict | None = None, **kwargs):
+        path = f"{self.root}/{self.bucket}/{quote(self.object_key(key))}"
+        return self.session.request(method, self.origin + path, headers={**self.sign(method, path), **(headers or {})},
+                                    timeout=60, **kwargs)
+
+    def _size(self, key: str) -> int | None:
+        r = self._request('HEAD', key)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return int(r.headers.get('Content-Length', 0))
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._size, key) is not None
+
+    def _put(self, fp: Path, key: str, max_retry: int = 3):
+        info = probe_info(str(fp))
+        info['url'] = self.url_for(key)
+        if self._size(key) == fp.stat().st_size:
+            metrics.cache('storage_dedup', True)
+            return info
+        metrics.cache('storage_dedup', False)
+
+        content_type = info.get('mime_type') or mimetypes.guess_type(fp.name)[0] or 'application/octet-stream'
+        for attempt in range(max_retry):
+            if attempt:
+                metrics.count('upload_retries')
+            try:
+                with open(fp, 'rb') as f, metrics.stage('upload'):
+                    r = self._request('PUT', key, {'Content-Type': content_type}, data=f)
+                if r.status_code == 200:
+                    metrics.count('bytes_uploaded', fp.stat().st_size)
+                    return info
+                print(f"[S3] PUT {key} failed: {r.status_code} {r.text[:200]}")
+            except Exception as e:
+                print(f"[S3] PUT {key} failed: {e}")
+        return None
+
+    async def put(self, fp: Path, key: str):
+        return await asyncio.to_thread(self._put, fp, key)
+
+
+def create(export: dict, path: Path, cfg=None) -> Storage:
+    """
+    Create the storage backend of an export
+
+    :param export: Export config (`storage` table)
+    :param path: Export path
+    :param cfg: Config (only loaded if needed by the backend)
+    """
+    opts = dict(export.get('storage') or {})
+    kind = opts.pop('type', None)
+    if kind is None:
+        if cfg is None:
+            from .config import load_config
+            cfg = load_config()
+        kind = 'http' if getattr(cfg, 'upload_url', None) else 'local'
+
+    if kind == 'local':
+        return LocalStorage(path, Path(opts['dir']) if opts.get('dir') else None, opts.get('base_url', ''))
+    if kind == 'http':
+        if cfg is None:
+            from .config import load_config
+            cfg = load_config()
+        return HttpStorage(cfg)
+    if kind == 's3':
+        if not opts.get('bucket'):
+            raise ValueError("storage.bucket is required for S3 storage")
+        return S3Storage(**opts)
+    raise ValueError(f"Unknown storage type {kind!r} (expected local, http or s3)")
+
+
+_storages: dict[Path, Storage] = {}
+
+
+def get(export: dict, path: Path) -> Storage:
+    """
+    Storage backend of an export, created on first use
+    """
+    key = path.absolute()
+    if key not in _storages:
+        _storages[key] = create(export, path)
+        printc(f"&aStoring media of {path} with {type(_storages[key]).__name__}")
+    return _storages[key]
@@ -0,0 +1,317 @@
+"""
+Time series of post views and forwards
+
+With `timeseries_dir` set on an export, every message the crawler fetches (new posts, and the
+saved posts re-fetched by the refresh pass) is sampled as (timestamp, post id, views, forwards).
+Nothing is fetched for the samples, they ride on the crawler's existing batches. An album is
+sampled once, with the counts of its first message, under the id of its post.
+
+Samples are stored in columnar chunk files of up to CHUNK_SAMPLES samples, sorted by time. Each
+column is delta-encoded (the first value is stored as a delta from zero) as a fixed-width int32
+array, or int64 if some delta doesn't fit. Chunk files are named <first ts>-<last ts>.tsc, so a
+time range query only decodes the chunks that overlap it.
+
+Aggregates can be exported with `tgc views <dir>` (per post or per day, as CSV or JSON).
+"""
+import argparse
+import csv
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import accumulate
+from pathlib import Path
+
+from .. import codec
+from ..model import parse_ts, parse_until
+
+MAGIC = b'TGTS'
+VERSION = 1
+COLUMNS = ('ts', 'post_id', 'views', 'forwards')
+CHUNK_SAMPLES = 65536
+# Stored for counters that Telegram didn't return
+MISSING = -1
+
+_HEADER = struct.Struct('<4sBBI')
+_COLUMN = struct.Struct('<c')
+_INT32 = range(-2 ** 31, 2 ** 31)
+
+_current: ContextVar['TimeSeries | None'] = ContextVar('tgc_timeseries', default=None)
+
+
+@dataclass(slots=True)
+class Samples:
+    """
+    Samples as columns of int64 arrays
+    """
+    ts: array = field(default_factory=lambda: array('q'))
+    post_id: array = field(default_factory=lambda: array('q'))
+    views: array = field(default_factory=lambda: array('q'))
+    forwards: array = field(default_factory=lambda: array('q'))
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, ts: int, post_id: int, views: int, forwards: int):
+        self.ts.append(ts)
+        self.post_id.append(post_id)
+        self.views.append(views)
+        self.forwards.append(forwards)
+
+    def extend(self, other: 'Samples'):
+        for name in COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def rows(self):
+        return zip(self.ts, self.post_id, self.views, self.forwards)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'Samples':
+        s = cls()
+        for r in rows:
+            s.append(*r)
+        return s
+
+
+def encode(s: Samples) -> bytes:
+    out = [_HEADER.pack(MAGIC, VERSION, len(COLUMNS), len(s))]
+    for name in COLUMNS:
+        col = getattr(s, name)
+        deltas = [b - a for a, b in zip([0, *col], col)]
+        code = 'i' if all(d in _INT32 for d in deltas) else 'q'
+        arr = array(code, deltas)
+        if sys.byteorder == 'big':
+            arr.byteswap()
+        out.append(_COLUMN.pack(code.encode()))
+        out.append(arr.tobytes())
+    return b''.join(out)
+
+
+def decode(data: bytes) -> Samples:
+    magic, version, columns, n = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or columns != len(COLUMNS):
+        raise ValueError(f"Not a version {VERSION} time series chunk")
+    s = Samples()
+    pos = _HEADER.size
+    for name in COLUMNS:
+        code = _COLUMN.unpack_from(data, pos)[0].decode()
+        pos += _COLUMN.size
+        arr = array(code)
+        arr.frombytes(data[pos:pos + n * arr.itemsize])
+        pos += n * arr.itemsize
+        if sys.byteorder == 'big':
+            arr.byteswap()
+        setattr(s, name, array('q', accumulate(arr)))
+    return s
+
+
+def chunk_length(fp: Path) -> int:
+    with open(fp, 'rb') as f:
+        return _HEADER.unpack(f.read(_HEADER.size))[3]
+
+
+class TimeSeries:
+    """
+    Views and forwards samples of one export
+
+    :param directory: Directory of the chunk files
+    """
+
+    def __init__(self, directory: Path):
+        self.dir = directory
+        self.buffer = Samples()
+
+    def add(self, post_id: int, views: int | None, forwards: int | None, ts: int | None = None):
+        self.buffer.append(int(ts or time.time()), post_id,
+                           MISSING if views is None else views, MISSING if forwards is None else forwards)
+
+    def add_messages(self, msgs: list, ts: int | None = None, post_ids: dict[int, int] | None = None):
+        """
+        Sample the messages as posts: the counts of a post are the ones of its first message
+
+        :param msgs: Fetched messages
+        :param post_ids: Post id by message id, messages without one are not sampled. By default, an
+            album is the post of its lowest message id, so albums must not be split across calls.
+        """
+        ts = int(ts or time.time())
+        if post_ids is None:
+            firsts: dict[int, int] = {}
+            for m in msgs:
+                if gid := getattr(m, 'grouped_id', None):
+                    firsts[gid] = min(firsts.get(gid, m.id), m.id)
+            post_ids = {m.id: firsts.get(getattr(m, 'grouped_id', None), m.id) for m in msgs}
+        first: dict[int, object] = {}
+        for m in msgs:
+            pid = post_ids.get(m.id)
+            if pid is not None and (pid not in first or m.id < first[pid].id):
+                first[pid] = m
+        for pid, m in first.items():
+            views = getattr(m, 'views', None)
+            forwards = getattr(m, 'forwards', None)
+            if views is not None or forwards is not None:
+                self.add(pid, views, forwards, ts)
+
+    def chunks(self, since: int | None = None, until: int | None = None) -> list[tuple[int, int, Path]]:
+        """
+        :return: (first ts, last ts, path) of the chunks overlapping the time range, sorted by time
+        """
+        if not self.dir.is_dir():
+            return []
+        out = []
+        for fp in self.dir.glob('*.tsc'):
+            first, last = (int(x) for x in fp.stem.split('-'))
+            if (since is None or last >= since) and (until is None or first <= until):
+                out.append((first, last, fp))
+        return sorted(out)
+
+    def flush(self) -> Path | None:
+        """
+        Write the buffered samples. They are merged into the newest chunk while it has room.
+
+        :return: Chunk file written
+        """
+        if not len(self.buffer):
+            return None
+        new = Samples.from_rows(sorted(self.buffer.rows()))
+        self.buffer = Samples()
+
+        self.dir.mkdir(parents=True, exist_ok=True)
+        old = None
+        chunks = self.chunks()
+        if chunks:
+            first, last, fp = chunks[-1]
+            if last <= new.ts[0] and chunk_length(fp) + len(new) <= CHUNK_SAMPLES:
+                old = fp
+                merged = decode(fp.read_bytes())
+                merged.extend(new)
+                new = merged
+
+        out = self.dir / f"{new.ts[0]}-{new.ts[-1]}.tsc"
+        tmp = out.with_suffix('.tsc.tmp')
+        tmp.write_bytes(encode(new))
+        os.replace(tmp, out)
+        if old and old != out:
+            old.unlink()
+        return out
+
+    def query(self, since: int | None = None, until: int | None = None,
+              post_ids: set[int] | None = None) -> Samples:
+        """
+        :param since: First timestamp (inclusive)
+        :param until: Last timestamp (inclusive)
+        :param post_ids: Only samples of these posts
+        :return: Samples sorted by time
+        """
+        out = Samples()
+        for first, last, fp in self.chunks(since, until):
+            s = decode(fp.read_bytes())
+            if post_ids is None and (since is None or first >= since) and (until is None or last <= until):
+                out.extend(s)
+                continue
+            for r in s.rows():
+                if (since is None or r[0] >= since) and (until is None or r[0] <= until) \
+                        and (post_ids is None or r[1] in post_ids):
+                    out.append(*r)
+        return out
+
+
+def sample(msgs: list, post_ids: dict[int, int] | None = None):
+    """
+    Sample views and forwards of fetched messages into the current export's time series
+    (see TimeSeries.add_messages)
+    """
+    if ts := _current.get():
+        ts.add_messages(msgs, post_ids=post_ids)
+
+
+@contextmanager
+def recording(export: dict):
+    """
+    Record samples for one run of an export into its `timeseries_dir` (if configured)
+
+    :param export: Export config
+    """
+    if not export.get('timeseries_dir'):
+        yield None
+        return
+    ts = TimeSeries(Path(export['timeseries_dir']))
+    token = _current.set(ts)
+    try:
+        yield ts
+    finally:
+        _current.reset(token)
+        if fp := ts.flush():
+            print(f"View samples saved to {fp}")
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def by_post(s: Samples) -> list[dict]:
+    posts: dict[int, list[tuple]] = defaultdict(list)
+    for r in s.rows():
+        posts[r[1]].append(r)
+    out = []
+    for pid, rows in sorted(posts.items()):
+        row = {'post_id': pid, 'samples': len(rows), 'first': _iso(rows[0][0]), 'last': _iso(rows[-1][0])}
+        for i, k in ((2, 'views'), (3, 'forwards')):
+            values = [r[i] for r in rows if r[i] != MISSING]
+            row[k] = values[-1] if values else None
+            row[f'{k}_gained'] = values[-1] - values[0] if values else None
+        out.append(row)
+    return out
+
+
+def by_day(s: Samples) -> list[dict]:
+    """
+    Views and forwards gained per day (UTC). The growth between two samples of a post counts
+    towards the day of the later sample.
+    """
+    days: dict[str, dict] = {}
+    prev: dict[int, tuple] = {}
+    for r in s.rows():
+        day = _iso(r[0])[:10]
+        d = days.setdefault(day, {'day': day, 'samples': 0, 'posts': set(), 'views_gained': 0, 'forwards_gained': 0})
+        d['samples'] += 1
+        d['posts'].add(r[1])
+        if p := prev.get(r[1]):
+            for i, k in ((2, 'views_gained'), (3, 'forwards_gained')):
+                if r[i] != MISSING and p[i] != MISSING:
+                    d[k] += r[i] - p[i]
+        prev[r[1]] = r
+    return [{**d, 'posts': len(d['posts'])} for d in days.values()]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser("tgc views", description="Export aggregates of the views and forwards "
+                                                              "time series of an export")
+    parser.add_argument("dir", help="Time series directory (timeseries_dir of the export)")
+    parser.add_argument("--since", help="First date or time (ISO format)")
+    parser.add_argument("--until", help="Last date or time (ISO format, a date includes the whole day)")
+    parser.add_argument("--post", type=int, nargs="*", help="Only these post ids")
+    parser.add_argument("--by", choices=["post", "day"], default="post", help="Aggregate per post or per day")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    args = parser.parse_args(argv)
+
+    s = TimeSeries(Path(args.dir)).query(parse_ts(args.since) if args.since else None,
+                                         parse_until(args.until) if args.until else None,
+                                         set(args.post) if args.post else None)
+    rows = by_post(s) if args.by == 'post' else by_day(s)
+    if args.format == 'json':
+        print(codec.stringify(rows, indent=True))
+        return
+    if rows:
+        w = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
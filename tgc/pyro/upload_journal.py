@@ -0,0 +1,185 @@
+"""
+Upload journal
+
+Every upload of an export is recorded in the append-only <export>/.upload-journal.jsonl, and
+replayed when the export is first used in a process:
+
+* file:<path>  pending -> uploaded(result)   one uploaded file (media, thumbnail)
+* msg:<post>/<msg>  pending -> uploaded(media infos) -> committed   the media of one message
+                    pending -> failed   the media of one message couldn't be downloaded or stored
+
+Local files are only deleted after the media of their message is recorded as uploaded, and
+uploaded media are committed once posts.json containing them is saved. So if the process dies in
+between, the next run reuses the recorded results instead of uploading again, and messages whose
+uploads were interrupted resume from the downloaded files instead of downloading them again.
+Committed and failed records are dropped from the journal when it is compacted after each commit
+(the local files of failed messages are deleted right away).
+"""
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from .. import codec
+from . import metrics
+
+JOURNAL = ".upload-journal.jsonl"
+
+
+class UploadJournal:
+    """
+    :param path: Export path
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.fp = path / JOURNAL
+        self.records: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.replay()
+
+    def replay(self):
+        if not self.fp.is_file():
+            return
+        for line in self.fp.read_bytes().splitlines():
+            try:
+                rec = codec.loads(line)
+            except ValueError:
+                # Torn write of the last record
+                continue
+            self.records[rec['key']] = rec
+        pending = sum(r['state'] == 'pending' for r in self.records.values())
+        uploaded = sum(r['state'] == 'uploaded' for r in self.records.values())
+        if pending or uploaded:
+            print(f"Upload journal: {uploaded} uploaded but uncommitted, {pending} interrupted")
+
+    def _append(self, key: str, state: str, result=None):
+        rec = {'key': key, 'state': state, 'ts': time.time()}
+        if result is not None:
+            rec['result'] = result
+        with self.lock:
+            self.records[key] = rec
+            self.fp.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.fp, 'ab') as f:
+                f.write(codec.dumps(rec) + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def key(self, fp: Path) -> str:
+        """
+        :return: Journal key of a file in the export (file:<path relative to the export>)
+        """
+        return f"file:{fp.absolute().relative_to(self.path.absolute()).as_posix()}"
+
+    def result(self, key: str):
+        rec = self.records.get(key)
+        return rec.get('result') if rec and rec['state'] != 'pending' else None
+
+    async def upload(self, fp: Path, storage):
+        """
+        Store a file once. The local file is kept (see finish).
+
+        :param fp: Local file in the export
+        :param storage: Storage backend of the export
+        :return: Result of storage.put
+        """
+        key = self.key(fp)
+        if (r := self.result(key)) is not None:
+            metrics.cache('upload_journal', True)
+            print(f"Reusing recorded upload of {fp.name}")
+            return r
+        metrics.cache('upload_journal', False)
+        self._append(key, 'pending')
+        r = await storage.put(fp, key[5:])
+        if r is not None:
+            self._append(key, 'uploaded', r)
+        return r
+
+    async def upload_many(self, files: list[Path], storage) -> list:
+        """
+        Store several files once, the ones not recorded yet concurrently (see Storage.put_many)
+
+        :return: Results of storage.put, in the same order
+        """
+        keys = [self.key(fp) for fp in files]
+        results = [self.result(k) for k in keys]
+        todo = [i for i, r in enumerate(results) if r is None]
+        for r in results:
+            metrics.cache('upload_journal', r is not None)
+        for i in todo:
+            self._append(keys[i], 'pending')
+        for i, r in zip(todo, await storage.put_many([(files[i], keys[i][5:]) for i in todo])):
+            if r is not None:
+                self._append(keys[i], 'uploaded', r)
+            results[i] = r
+        return results
+
+    def media(self, post_id: int, msg_id: int) -> list[dict] | None:
+        """
+        :return: Recorded media infos of a message, if its uploads finished
+        """
+        return self.result(f"msg:{post_id}/{msg_id}")
+
+    def begin(self, post_id: int, msg_id: int):
+        self._append(f"msg:{post_id}/{msg_id}", 'pending')
+
+    def finish(self, post_id: int, msg_id: int, media_files: list[dict], local_files: list[Path]):
+        """
+        Record the media infos of a message, then delete its local files
+        """
+        self._append(f"msg:{post_id}/{msg_id}", 'uploaded', media_files)
+        for f in local_files:
+            if f.is_dir():
+                shutil.rmtree(f, ignore_errors=True)
+            else:
+                f.unlink(missing_ok=True)
+
+    def abort(self, post_id: int, msg_id: int, local_files: list[Path]):
+        """
+        Record that the media of a message couldn't be stored, then delete its local files
+        """
+        self._append(f"msg:{post_id}/{msg_id}", 'failed')
+        metrics.count('uploads_failed')
+        for f in local_files:
+            if f.is_dir():
+                shutil.rmtree(f, ignore_errors=True)
+            else:
+                f.unlink(missing_ok=True)
+
+    def commit(self):
+        """
+        Mark all uploaded media as committed (call after posts.json is saved), and compact the journal.
+        Only interrupted messages and the file records of their posts are kept.
+        """
+        with self.lock:
+            done = [k for k, r in self.records.items() if k.startswith('msg:') and r['state'] == 'uploaded']
+            # Keep interrupted messages, and the file records of their posts
+            pending = {k[4:].split('/')[0] for k, r in self.records.items()
+                       if k.startswith('msg:') and r['state'] == 'pending'}
+            live = {k: r for k, r in self.records.items()
+                    if (k.startswith('msg:') and r['state'] == 'pending')
+                    or (k.startswith('file:') and k[5:].split('/')[0] in pending)}
+            if len(live) == len(self.records):
+                return
+            self.records = live
+            if not live:
+                self.fp.unlink(missing_ok=True)
+            else:
+                tmp = self.fp.with_suffix('.jsonl.tmp')
+                tmp.write_bytes(b''.join(codec.dumps(r) + b'\n' for r in live.values()))
+                os.replace(tmp, self.fp)
+        metrics.count('uploads_committed', len(done))
+
+
+_journals: dict[Path, UploadJournal] = {}
+
+
+def get(path: Path) -> UploadJournal:
+    """
+    Journal of an export, replayed on first use
+    """
+    key = path.absolute()
+    if key not in _journals:
+        _journals[key] = UploadJournal(path)
+    return _journals[key]
@@ -0,0 +1,202 @@
+"""
+Video packaging for size-limited storage
+
+Videos larger than the segment limit (`video_segment_mb`, 20 MB by default for remote storage) are
+split with ffmpeg stream copy, so nothing is re-encoded and every part starts at a keyframe:
+
+* `hls` (default): an HLS playlist (index.m3u8) with fMP4 segments and an init segment. The
+  segments are stored in parallel, the playlist is rewritten to point to their URLs and stored
+  last, and the post records the playlist URL as a single video.
+* `mp4`: independently playable MP4 segments with faststart, each recorded as its own video.
+
+The segment duration is chosen from the average bitrate so that segments fit under the limit; it
+is halved and the video split again if a long GOP still produces an oversized segment. Videos that
+stay whole are remuxed with faststart (moov atom first) so they can start playing while loading.
+Without ffmpeg, videos are stored as they are.
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+from . import metrics
+
+VIDEO_EXTS = ['.mp4', '.mkv', '.mov', '.webm', '.avi']
+FASTSTART_EXTS = ['.mp4', '.mov', '.m4v']
+PLAYLIST = "index.m3u8"
+HLS_MIME = "application/vnd.apple.mpegurl"
+
+# Segments are aimed at this fraction of the limit, bitrate varies within a video
+HEADROOM = 0.8
+# Attempts with halved segment durations before oversized segments are stored anyway
+MAX_SPLITS = 3
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+def _run(cmd: list[str]) -> bool:
+    with metrics.stage('ffmpeg'):
+        result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+    return result.returncode == 0
+
+
+def probe_duration(fp: Path) -> float:
+    with metrics.stage('ffprobe'):
+        result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                                 '-of', 'default=noprint_wrappers=1:nokey=1', str(fp)],
+                                capture_output=True, text=True)
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return 0
+
+
+def faststart(fp: Path) -> bool:
+    """
+    Remux a video in place with the moov atom first
+
+    :return: Whether the video was remuxed
+    """
+    if fp.suffix.lower() not in FASTSTART_EXTS:
+        return False
+    tmp = fp.with_name(f"{fp.stem}.faststart{fp.suffix}")
+    if not _run(['ffmpeg', '-v', 'error', '-y', '-i', str(fp), '-map', '0', '-c', 'copy',
+                 '-movflags', '+faststart', str(tmp)]):
+        tmp.unlink(missing_ok=True)
+        return False
+    os.replace(tmp, fp)
+    return True
+
+
+def segment_time(size: int, duration: float, limit: int) -> float:
+    """
+    :return: Segment duration (seconds) for segments of about HEADROOM * limit bytes
+    """
+    if size <= 0 or duration <= 0:
+        return 10
+    return max(1.0, duration * limit * HEADROOM / size)
+
+
+def split(fp: Path, out: Path, mode: str, seconds: float) -> list[Path]:
+    """
+    Split a video with stream copy
+
+    :param fp: Video
+    :param out: Output directory (emptied first)
+    :param mode: hls or mp4
+    :param seconds: Segment duration
+    :return: Segment files, in order (for hls: the init segment, then the media segments)
+    """
+    if out.exists():
+        shutil.rmtree(out)
+    out.mkdir(parents=True)
+    streams = ['-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy']
+    if mode == 'hls':
+        ok = _run(['ffmpeg', '-v', 'error', '-y', '-i', str(fp), *streams,
+                   '-f', 'hls', '-hls_time', f"{seconds:.3f}", '-hls_playlist_type', 'vod',
+                   '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+                   '-hls_segment_filename', str(out / 'seg%04d.m4s'), str(out / PLAYLIST)])
+        files = ([out / 'init.mp4'] if (out / 'init.mp4').exists() else []) + sorted(out.glob('seg*.m4s'))
+    else:
+        ok = _run(['ffmpeg', '-v', 'error', '-y', '-i', str(fp), *streams,
+                   '-f', 'segment', '-segment_time', f"{seconds:.3f}", '-reset_timestamps', '1',
+                   '-segment_format', 'mp4', '-segment_format_options', 'movflags=+faststart',
+                   str(out / 'part%04d.mp4')])
+        files = sorted(out.glob('part*.mp4'))
+    return files if ok else []
+
+
+def package(fp: Path, mode: str, limit: int) -> tuple[Path, list[Path]] | None:
+    """
+    Split a video into segments under the limit
+
+    :return: Output directory and segment files, None if ffmpeg failed
+    """
+    out = fp.parent / f"{fp.stem}-{mode}"
+    seconds = segment_time(fp.stat().st_size, probe_duration(fp), limit)
+    for attempt in range(MAX_SPLITS):
+        files = split(fp, out, mode, seconds)
+        if not files:
+            shutil.rmtree(out, ignore_errors=True)
+            return None
+        oversized = [f for f in files if f.stat().st_size > limit]
+        if not oversized or seconds <= 1:
+            break
+        if attempt < MAX_SPLITS - 1:
+            print(f"{len(oversized)} segments of {fp.name} exceed the limit, splitting again")
+            seconds = max(1.0, seconds / 2)
+    else:
+        print(f"Warning: {len(oversized)} segments of {fp.name} still exceed the limit")
+    metrics.count('video_segments', len(files))
+    return out, files
+
+
+def rewrite_playlist(playlist: Path, urls: dict[str, str]):
+    """
+    Point the segment URIs of an HLS playlist to their stored URLs
+
+    :param playlist: Playlist file
+    :param urls: Stored URL by segment file name
+    """
+    lines = []
+    for line in playlist.read_text().splitlines():
+        if line and not line.startswith('#'):
+            line = urls.get(line, line)
+        elif line.startswith('#EXT-X-MAP:'):
+            for name, url in urls.items():
+                line = line.replace(f'URI="{name}"', f'URI="{url}"')
+        lines.append(line)
+    playlist.write_text('\n'.join(lines) + '\n')
+
+
+async def store_video(fp: Path, journal, store, export: dict):
+    """
+    Store a video, packaged into segments if it exceeds the limit
+
+    :param fp: Downloaded video
+    :param journal: Upload journal of the export
+    :param store: Storage backend of the export
+    :param export: Export config (video_segment_mb, video_packaging)
+    :return: Store result (a media info, or a list of them for mp4 segments), and the local files created
+    """
+    mb = export.get('video_segment_mb')
+    limit = int((mb if mb is not None else 0 if store.keeps_local else 20) * 1000_000)
+    mode = export.get('video_packaging') or 'hls'
+    if mode not in ('hls', 'mp4'):
+        raise ValueError(f"Unknown video_packaging {mode!r} (expected hls or mp4)")
+
+    if fp.suffix.lower() not in VIDEO_EXTS or not ffmpeg_available() \
+            or journal.result(journal.key(fp)) is not None:
+        return await journal.upload(fp, store), []
+
+    if not limit or fp.stat().st_size <= limit:
+        await asyncio.to_thread(faststart, fp)
+        return await journal.upload(fp, store), []
+
+    print(f"Packaging {fp.name} ({fp.stat().st_size / 1e6:.1f} MB) as {mode} segments")
+    packaged = await asyncio.to_thread(package, fp, mode, limit)
+    if packaged is None:
+        return await journal.upload(fp, store), []
+    out, files = packaged
+    duration = await asyncio.to_thread(probe_duration, fp)
+
+    results = await journal.upload_many(files, store)
+    if any(r is None for r in results):
+        print(f"Failed to store some segments of {fp.name}")
+        return None, [out]
+
+    if mode == 'mp4':
+        return [{**r, 'mime_type': 'video/mp4'} for r in results], [out]
+
+    # Relative URLs (local storage) already resolve against the playlist
+    rewrite_playlist(out / PLAYLIST, {f.name: r['url'] for f, r in zip(files, results) if '://' in r['url']})
+    r = await journal.upload(out / PLAYLIST, store)
+    if r is None:
+        return None, [out]
+    return {**r, 'mime_type': HLS_MIME, 'duration': int(duration), 'size': sum(f.stat().st_size for f in files),
+            'original_name': fp.name}, [out]
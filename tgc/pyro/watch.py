@@ -0,0 +1,233 @@
+"""
+Watch mode (tgc watch)
+
+Instead of polling from cron, the client stays connected and listens to Telegram's update events
+(new, edited and deleted messages) of the configured chats. Events of each export are coalesced:
+a flush runs `debounce` seconds after the last event (and at most `max_wait` seconds after the
+first one), so an album or a burst of posts results in a single crawl and a single rewrite of
+posts.json, the pages and the feeds.
+"""
+import argparse
+import asyncio
+from pathlib import Path
+
+from hypy_utils import printc
+from telethon.tl.types import Message
+
+from .. import codec
+from . import metrics
+from .crawl import process_chat, save_posts
+from .emoji import resolve_emojis
+from .peers import resolve_chat
+from .refresh import apply_changes
+from ..model import Post, as_posts
+
+
+class ExportWatch:
+    """
+    Pending changes and the debounce timer of one export
+
+    :param export: Export config
+    :param client: Telegram client
+    :param debounce: Seconds without new events before flushing
+    :param max_wait: Maximum seconds between the first pending event and the flush
+    """
+
+    def __init__(self, export: dict, client, debounce: float, max_wait: float):
+        self.export = export
+        self.path = Path(export['path'])
+        self.client = client
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.name = str(export.get('name') or export['chat_id'])
+        # Deletions in channels carry the chat id, others don't
+        self.channel = True
+
+        self.new = False
+        self.edited: dict[int, Message] = {}
+        self.deleted: set[int] = set()
+        self.first: float | None = None
+        self.timer: asyncio.TimerHandle | None = None
+        self.flushing: set[asyncio.Task] = set()
+        self.lock = asyncio.Lock()
+
+    def on_new(self, msg: Message):
+        self.new = True
+        self.schedule()
+
+    def on_edit(self, msg: Message):
+        self.edited[msg.id] = msg
+        self.schedule()
+
+    def on_delete(self, ids: list[int]):
+        self.deleted.update(ids)
+        self.edited = {k: v for k, v in self.edited.items() if k not in self.deleted}
+        self.schedule()
+
+    def schedule(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.first is None:
+            self.first = now
+        if self.timer:
+            self.timer.cancel()
+        delay = max(0.0, min(self.debounce, self.first + self.max_wait - now))
+        self.timer = loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self.timer = None
+        self.first = None
+        task = asyncio.ensure_future(self.flush())
+        self.flushing.add(task)
+        task.add_done_callback(self.flushing.discard)
+
+    async def flush(self):
+        """
+        Persist all pending changes. New messages are crawled incrementally (without backfill),
+        edits and deletions are applied to the merged posts before they are saved.
+        """
+        async with self.lock:
+            new, edited, deleted = self.new, self.edited, self.deleted
+            self.new, self.edited, self.deleted = False, {}, set()
+            if not (new or edited or deleted):
+                return
+            printc(f"&aFlushing {self.name}: {'new messages, ' if new else ''}"
+                   f"{len(edited)} edited, {len(deleted)} deleted")
+
+            applied = False
+            emojis = {}
+
+            def on_merge(posts: list[Post]) -> list[Post]:
+                nonlocal applied
+                applied = True
+                posts, changed = apply_changes(posts, edited, deleted, emojis)
+                metrics.count('posts_changed', changed)
+                return posts
+
+            try:
+                if edited:
+                    emojis = await resolve_emojis(edited.values(), self.path, self.client)
+                if new:
+                    await process_chat(self.export['chat_id'], self.path, {**self.export, 'backfill': False},
+                                       self.client, on_merge)
+
+                # No new posts were saved, apply the edits and deletions to the saved posts
+                if not applied and (edited or deleted):
+                    with metrics.run(self.export):
+                        posts_path = self.path / "posts.json"
+                        if not posts_path.exists():
+                            return
+                        with metrics.stage('load_posts'):
+                            posts = sorted(as_posts(codec.load_posts(posts_path)), key=lambda x: x.id)
+                        posts, changed = apply_changes(posts, edited, deleted, emojis)
+                        metrics.count('posts_changed', changed)
+                        if changed:
+                            save_posts(self.path, self.export, posts)
+                        else:
+                            print(f"No saved posts of {self.name} were affected")
+            except Exception as e:
+                printc(f"&cFailed to flush {self.name}: {e}")
+
+    async def catch_up(self):
+        """
+        Crawl the posts missed while not watching. Events arriving meanwhile are buffered, and
+        their flush waits until the crawl is saved.
+        """
+        async with self.lock:
+            await process_chat(self.export['chat_id'], self.path, self.export, self.client)
+
+    async def close(self):
+        """
+        Flush pending changes immediately
+        """
+        if self.timer:
+            self.timer.cancel()
+            self._fire()
+        if self.flushing:
+            await asyncio.gather(*self.flushing, return_exceptions=True)
+
+
+async def watch(client, cfg, debounce: float = 10, max_wait: float = 60, catch_up: bool = True):
+    """
+    Keep the client connected and persist changes of all exports as they happen
+
+    :param client: Started Telegram client
+    :param cfg: Config
+    :param debounce: Seconds without new events before an export is flushed
+    :param max_wait: Maximum seconds between the first pending event of an export and the flush
+    :param catch_up: Crawl every export once after the handlers are registered, to catch up on missed posts
+    """
+    from telethon import events, utils
+    from telethon.tl.types import InputPeerChannel
+
+    me = await client.get_me()
+    printc(f"&aLogin success! ID: {me.id}")
+
+    watches: dict[int, ExportWatch] = {}
+    entities = []
+    for export in cfg.exports:
+        w = ExportWatch(export, client, debounce, max_wait)
+        try:
+            entity = utils.get_input_peer(await resolve_chat(client, export['chat_id'], w.path, export))
+        except Exception as e:
+            printc(f"&cCannot watch {w.name}: {e}")
+            continue
+        w.channel = isinstance(entity, InputPeerChannel)
+        watches[utils.get_peer_id(entity)] = w
+        entities.append(entity)
+
+    if not watches:
+        printc("&cNo chats to watch")
+        return
+
+    # Handlers are registered before catching up, so changes made during the crawl aren't lost
+    @client.on(events.NewMessage(chats=entities))
+    async def on_new(event):
+        if w := watches.get(event.chat_id):
+            w.on_new(event.message)
+
+    @client.on(events.MessageEdited(chats=entities))
+    async def on_edit(event):
+        if w := watches.get(event.chat_id):
+            w.on_edit(event.message)
+
+    @client.on(events.MessageDeleted())
+    async def on_delete(event):
+        if event.chat_id is not None:
+            if w := watches.get(event.chat_id):
+                w.on_delete(event.deleted_ids)
+            return
+        # Message ids outside of channels are only unique per account, apply them to all such chats
+        for w in watches.values():
+            if not w.channel:
+                w.on_delete(event.deleted_ids)
+
+    if catch_up:
+        for w in watches.values():
+            await w.catch_up()
+
+    printc(f"&aWatching {len(watches)} chats (debounce {debounce}s, max wait {max_wait}s)")
+    try:
+        await client.run_until_disconnected()
+    finally:
+        for w in watches.values():
+            await w.close()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser("tgc watch", description="Keep connected and update exports as posts "
+                                                              "are sent, edited or deleted")
+    parser.add_argument("config", help="Config path", nargs="?", default="config.toml")
+    parser.add_argument("--debounce", type=float, default=10, help="Seconds without new events before saving "
+                                                                   "(default: 10)")
+    parser.add_argument("--max-wait", type=float, default=60, help="Maximum seconds between an event and saving "
+                                                                   "(default: 60)")
+    parser.add_argument("--no-catch-up", action="store_true", help="Don't crawl missed posts on start")
+    args = parser.parse_args(argv)
+
+    from tgc.pyro.config import get_telegram_client, load_config
+    client = get_telegram_client(args.config)
+    cfg = load_config(args.config)
+    client.start()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(watch(client, cfg, args.debounce, args.max_wait, not args.no_catch_up))
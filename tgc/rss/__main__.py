@@ -1,10 +1,11 @@
 import argparse
-import json
 from pathlib import Path
 
 import toml
 
-from tgc.rss.posts_to_feed import FeedMeta, SitemapMeta, posts_to_feed, posts_to_sitemap, posts_to_sitemap_from_rss, generate_robots_txt
+from tgc import codec
+from tgc.output import precompress
+from tgc.rss.posts_to_feed import FeedMeta, SitemapMeta, build_artifacts
 
 if __name__ == '__main__':
     # Create argument parser
@@ -27,6 +28,10 @@ if __name__ == '__main__':
     # Mode selection
     parser.add_argument('--sitemap-only', action='store_true', help='Generate only sitemap (no RSS)')
     parser.add_argument('--rss-only', action='store_true', help='Generate only RSS (no auto-sitemap)')
+
+    # Pre-compressed outputs
+    parser.add_argument('--compress', action='store_true', help='Write pre-compressed .gz files next to the outputs')
+    parser.add_argument('--zstd', action='store_true', help='Also write pre-compressed .zst files (implies --compress)')
     
     args = parser.parse_args()
 
@@ -40,10 +45,17 @@ if __name__ == '__main__':
     if args.config:
         config = toml.loads(Path(args.config).read_text())
 
+    # Read posts.json once and share it between all outputs
+    posts = codec.load_posts(Path(args.path) / 'posts.json')
+
     # Determine what to generate
     generate_rss = not args.sitemap_only
     generate_sitemap = bool(args.base_url or config.get('sitemap')) and not args.rss_only
 
+    # Outputs are collected first, and then built in a single pass over the posts
+    feed_meta = None
+    sitemap_meta = None
+
     # Generate RSS if requested
     if generate_rss:
         # Create RSS meta info object
@@ -63,19 +75,14 @@ if __name__ == '__main__':
             if not generate_sitemap:
                 exit(1)
         else:
-            # Call posts_to_feed
-            posts_to_feed(Path(args.path), meta)
-            
-            # 自动从RSS配置生成站点地图（除非明确禁用）
+            feed_meta = meta
+
+            # 自动从RSS配置生成站点地图和robots.txt（除非明确禁用）
             if not args.rss_only:
                 print("Auto-generating XML sitemap from RSS configuration...")
-                posts_to_sitemap_from_rss(Path(args.path), meta)
-                
-                # 生成robots.txt
-                sitemap_url = f"{meta.link.rstrip('/')}/sitemap.xml"
-                generate_robots_txt(Path(args.path), meta.link, sitemap_url)
+                sitemap_meta = SitemapMeta(base_url=meta.link)
 
-    # Generate sitemap if requested (separate configuration)
+    # Generate sitemap if requested (separate configuration, takes precedence over the RSS link)
     if generate_sitemap:
         sitemap_config = config.get('sitemap', {})
         base_url = args.base_url or sitemap_config.get('base_url')
@@ -89,8 +96,10 @@ if __name__ == '__main__':
             default_changefreq=sitemap_config.get('default_changefreq', 'weekly'),
             default_priority=sitemap_config.get('default_priority', 0.5)
         )
-        
-        # Generate sitemap and robots.txt
-        posts_to_sitemap(Path(args.path), sitemap_meta)
-        sitemap_url = f"{base_url.rstrip('/')}/sitemap.xml"
-        generate_robots_txt(Path(args.path), base_url, sitemap_url)
+
+    # Generate everything in one pass, unchanged outputs are not rewritten
+    if feed_meta or sitemap_meta:
+        build_artifacts(Path(args.path), posts, feed=feed_meta, sitemap=sitemap_meta, robots=sitemap_meta is not None)
+
+    if args.compress or args.zstd:
+        precompress(Path(args.path), zstd=args.zstd)
@@ -1,12 +1,11 @@
-import json
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
 import xml.etree.ElementTree as ET
 
-from dateutil import parser
-from feedgen.feed import FeedGenerator
-from markdown import markdown
+from .. import codec
+from ..model import Post, as_posts
+from ..output import write_if_changed
 
 
 @dataclass
@@ -25,6 +24,133 @@ class SitemapMeta:
     default_priority: float = 0.5
 
 
+ROBOTS_TXT = [
+    "User-agent: *",
+    "Allow: /",
+    "",
+    "# Crawl-delay to be respectful to server resources",
+    "Crawl-delay: 1",
+    "",
+    "Sitemap: {sitemap_url}",
+    "",
+    "# Common paths to disallow",
+    "Disallow: /private/",
+    "Disallow: /tmp/",
+    "Disallow: /*.json$",
+    "Disallow: /*?debug=*"
+]
+
+
+def fmt_lastmod(date: datetime) -> str:
+    return date.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+def load_posts(path: Path, posts_data=None, what: str = "") -> list[Post]:
+    # Posts - 使用传入的数据或读取文件
+    if posts_data is not None:
+        posts = as_posts(posts_data)
+        print(f"Using provided posts data with {len(posts)} posts{what}")
+    else:
+        posts = as_posts(codec.load_posts(path / 'posts.json'))
+        print(f"Reading posts from {path / 'posts.json'} with {len(posts)} posts{what}")
+    return posts
+
+
+def build_artifacts(path: Path, posts_data=None, feed: FeedMeta | None = None, sitemap: SitemapMeta | None = None,
+                    robots: bool = False) -> dict[str, bool]:
+    """
+    Build rss.xml, atom.xml, sitemap.xml and robots.txt in one pass over the posts
+
+    Outputs are only rewritten when their content changed, so unchanged files keep their mtime.
+    To keep the output stable between runs, build dates are taken from the newest post instead
+    of the current time.
+
+    :param path: Path to the parent directory that contains posts.json
+    :param posts_data: Optional posts (dicts or Post objects) to use instead of reading from posts.json
+    :param feed: Feed meta info, generates rss.xml and atom.xml if given
+    :param sitemap: Sitemap meta info, generates sitemap.xml if given
+    :param robots: Also generate robots.txt pointing to the sitemap (requires sitemap)
+    :return: Map of output file name to whether it was rewritten
+    """
+    assert not robots or sitemap, "robots.txt requires sitemap meta info"
+    posts = load_posts(path, posts_data)
+    newest = max((p.ts for p in posts), default=0)
+    newest = datetime.fromtimestamp(newest, timezone.utc) if newest else datetime.now(timezone.utc)
+
+    fg = None
+    if feed:
+        # feedgen and markdown are only needed for feeds (and slow to import)
+        from feedgen.feed import FeedGenerator
+        from markdown import markdown
+
+        fg = FeedGenerator()
+
+        # Meta info
+        fg.id(feed.link)
+        fg.title(feed.title)
+        fg.link(href=feed.link, rel='alternate')
+        fg.description(feed.description)
+        fg.language(feed.language)
+        fg.image(feed.image_url)
+        fg.lastBuildDate(newest)
+        fg.updated(newest)
+
+    urlset = None
+    if sitemap:
+        # Create root element
+        urlset = ET.Element("urlset")
+        urlset.set("xmlns", "http://www.sitemaps.org/schemas/sitemap/0.9")
+
+        # Add main page
+        main_url = ET.SubElement(urlset, "url")
+        ET.SubElement(main_url, "loc").text = sitemap.base_url
+        ET.SubElement(main_url, "lastmod").text = fmt_lastmod(newest)
+        ET.SubElement(main_url, "changefreq").text = "daily"
+        ET.SubElement(main_url, "priority").text = "1.0"
+        base_url = sitemap.base_url.rstrip('/')
+        priority = str(sitemap.default_priority)
+
+    for post in posts:
+        if fg:
+            fe = fg.add_entry()
+            fe.id(str(post.id))
+            fe.title(f"{feed.title} #{post.id}")
+            fe.link(href=f'{feed.link}#/?post={post.id}')
+            fe.updated(post.datetime)
+
+            # Escape HTML tags
+            # text = html2text(markdown(post.get('text') or post.get('caption') or ''), bodywidth=0)
+            # text = html.escape(text.replace('\n', '<br>'))
+            fe.description(markdown(post.body))
+
+        if urlset is not None:
+            url_elem = ET.SubElement(urlset, "url")
+            ET.SubElement(url_elem, "loc").text = f"{base_url}/#/?post={post.id}"
+
+            # Last modified (从post的日期，加载时已解析为时间戳；没有日期时使用最新贴文的时间)
+            ET.SubElement(url_elem, "lastmod").text = fmt_lastmod(post.datetime if post.ts else newest)
+
+            # Change frequency & priority (文章优先级略低于主页)
+            ET.SubElement(url_elem, "changefreq").text = sitemap.default_changefreq
+            ET.SubElement(url_elem, "priority").text = priority
+
+    outputs: dict[str, bytes] = {}
+    if fg:
+        outputs['rss.xml'] = fg.rss_str(pretty=True)
+        outputs['atom.xml'] = fg.atom_str(pretty=True)
+    if urlset is not None:
+        ET.indent(urlset, space="  ", level=0)  # Pretty print
+        outputs['sitemap.xml'] = ET.tostring(urlset, encoding='utf-8', xml_declaration=True)
+    if robots:
+        sitemap_url = f"{sitemap.base_url.rstrip('/')}/sitemap.xml"
+        outputs['robots.txt'] = '\n'.join(ROBOTS_TXT).format(sitemap_url=sitemap_url).encode('utf-8')
+
+    written = {name: write_if_changed(path / name, data) for name, data in outputs.items()}
+    for name, w in written.items():
+        print(f"{'Generated' if w else 'Unchanged'} {name} ({len(posts)} posts)")
+    return written
+
+
 def posts_to_feed(path: Path, meta: FeedMeta, posts_data=None):
     """
     Convert posts to RSS feed. This function will create the rss feed in the same directory as posts.json
@@ -33,40 +159,7 @@ def posts_to_feed(path: Path, meta: FeedMeta, posts_data=None):
     :param meta: Feed meta info
     :param posts_data: Optional posts data to use instead of reading from posts.json
     """
-    fg = FeedGenerator()
-    
-    # Meta info
-    fg.id(meta.link)
-    fg.title(meta.title)
-    fg.link(href=meta.link, rel='alternate')
-    fg.description(meta.description)
-    fg.language(meta.language)
-    fg.image(meta.image_url)
-
-    # Posts - 使用传入的数据或读取文件
-    if posts_data is not None:
-        posts = posts_data
-        print(f"Using provided posts data with {len(posts)} posts")
-    else:
-        posts = json.loads((path / 'posts.json').read_text())
-        print(f"Reading posts from {path / 'posts.json'} with {len(posts)} posts")
-    for post in posts:
-        fe = fg.add_entry()
-        fe.id(str(post['id']))
-        fe.title(f"{meta.title} #{post['id']}")
-        fe.link(href=f'{meta.link}#/?post={post["id"]}')
-        fe.updated(parser.parse(post['date']).replace(tzinfo=timezone.utc))
-
-        # Escape HTML tags
-        # text = html2text(markdown(post.get('text') or post.get('caption') or ''), bodywidth=0)
-        # text = html.escape(text.replace('\n', '<br>'))
-        text = markdown(post.get('text') or post.get('caption') or '')
-        fe.description(text)
-
-    fg.rss_file(path / 'rss.xml', pretty=True)
-    fg.atom_file(path / 'atom.xml', pretty=True)
-    
-    print(f"Generated RSS and Atom feeds with {len(posts)} posts in chronological order")
+    build_artifacts(path, posts_data, feed=meta)
 
 
 def posts_to_sitemap_from_rss(path: Path, rss_meta: FeedMeta, posts_data=None, changefreq: str = "weekly", priority: float = 0.5):
@@ -97,60 +190,8 @@ def posts_to_sitemap(path: Path, meta: SitemapMeta, posts_data=None):
     :param meta: Sitemap meta info
     :param posts_data: Optional posts data to use instead of reading from posts.json
     """
-    
-    # Create root element
-    urlset = ET.Element("urlset")
-    urlset.set("xmlns", "http://www.sitemaps.org/schemas/sitemap/0.9")
-    
-    # Posts - 使用传入的数据或读取文件
-    if posts_data is not None:
-        posts = posts_data
-        print(f"Using provided posts data with {len(posts)} posts for sitemap")
-    else:
-        posts = json.loads((path / 'posts.json').read_text())
-        print(f"Reading posts from {path / 'posts.json'} with {len(posts)} posts for sitemap")
-    
-    # Add main page
-    main_url = ET.SubElement(urlset, "url")
-    ET.SubElement(main_url, "loc").text = meta.base_url
-    ET.SubElement(main_url, "lastmod").text = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
-    ET.SubElement(main_url, "changefreq").text = "daily"
-    ET.SubElement(main_url, "priority").text = "1.0"
-    
-    # Add each post
-    for post in posts:
-        url_elem = ET.SubElement(urlset, "url")
-        
-        # URL
-        post_url = f"{meta.base_url.rstrip('/')}/#/?post={post['id']}"
-        ET.SubElement(url_elem, "loc").text = post_url
-        
-        # Last modified (从post的日期)
-        try:
-            post_date = parser.parse(post['date']).replace(tzinfo=timezone.utc)
-            lastmod = post_date.strftime("%Y-%m-%dT%H:%M:%S+00:00")
-            ET.SubElement(url_elem, "lastmod").text = lastmod
-        except:
-            # 如果解析失败，使用当前时间
-            ET.SubElement(url_elem, "lastmod").text = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
-        
-        # Change frequency
-        ET.SubElement(url_elem, "changefreq").text = meta.default_changefreq
-        
-        # Priority (文章优先级略低于主页)
-        ET.SubElement(url_elem, "priority").text = str(meta.default_priority)
-    
-    # Write sitemap.xml
-    tree = ET.ElementTree(urlset)
-    ET.indent(tree, space="  ", level=0)  # Pretty print
-    
-    sitemap_path = path / 'sitemap.xml'
-    tree.write(sitemap_path, encoding='utf-8', xml_declaration=True)
-    
-    print(f"Generated sitemap.xml with {len(posts) + 1} URLs (1 main page + {len(posts)} posts)")
-    print(f"Sitemap saved to: {sitemap_path}")
-    
-    return sitemap_path
+    build_artifacts(path, posts_data, sitemap=meta)
+    return path / 'sitemap.xml'
 
 
 def generate_robots_txt(path: Path, base_url: str, sitemap_url: str):
@@ -161,27 +202,7 @@ def generate_robots_txt(path: Path, base_url: str, sitemap_url: str):
     :param base_url: Base URL of the website
     :param sitemap_url: URL of the sitemap
     """
-    
-    robots_content = [
-        "User-agent: *",
-        "Allow: /",
-        "",
-        "# Crawl-delay to be respectful to server resources", 
-        "Crawl-delay: 1",
-        "",
-        f"Sitemap: {sitemap_url}",
-        "",
-        "# Common paths to disallow",
-        "Disallow: /private/",
-        "Disallow: /tmp/",
-        "Disallow: /*.json$",
-        "Disallow: /*?debug=*"
-    ]
-    
-    # Write robots.txt
     robots_path = path / 'robots.txt'
-    with open(robots_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(robots_content))
-    
-    print(f"Generated robots.txt at: {robots_path}")
+    written = write_if_changed(robots_path, '\n'.join(ROBOTS_TXT).format(sitemap_url=sitemap_url))
+    print(f"{'Generated' if written else 'Unchanged'} robots.txt at: {robots_path}")
     return robots_path